@@ -1,19 +1,122 @@
 # ====================================
 # 本地端代码 - Gradio可视化界面（优化版 - Gradio 6.0兼容）
 # ====================================
+import os
+import time
 import gradio as gr
 import requests
 import base64
+import json
 from io import BytesIO
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from PIL import Image, ImageOps
 import config
 
+def create_session():
+    """
+    共享的 HTTP 会话：长连接复用（省去每次请求的 TCP/TLS 握手）+ 失败重试
+
+    连接失败（请求未发出）总是重试；502/503/504 只对幂等请求（GET 等）重试并遵循 Retry-After。
+    POST（/vqa、/text2image_search、管理接口）遇到 5xx 或读取超时不重试：
+    服务器满载返回 503 时重发只会加重负载，也避免重复执行耗时的推理。
+    """
+    retry = Retry(
+        total=config.HTTP_MAX_RETRIES,
+        connect=config.HTTP_MAX_RETRIES,
+        read=0,
+        status=config.HTTP_MAX_RETRIES,
+        backoff_factor=config.HTTP_RETRY_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=config.HTTP_POOL_SIZE, pool_maxsize=config.HTTP_POOL_SIZE,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+    return session
+
+session = create_session()
+_server_info = {"data": None, "time": 0.0}
+
+def get_server_info(force=False):
+    """服务器 /health 信息（含 VQA 像素预算），按 SERVER_INFO_TTL 缓存；获取失败时返回 None"""
+    if not force and _server_info["data"] is not None and time.time() - _server_info["time"] < config.SERVER_INFO_TTL:
+        return _server_info["data"]
+    try:
+        response = session.get(f"{config.SERVER_URL}/health", timeout=config.HEALTH_CHECK_TIMEOUT)
+        if response.status_code == 200:
+            _server_info.update(data=response.json(), time=time.time())
+    except requests.exceptions.RequestException:
+        pass
+    return _server_info["data"]
+
+def upload_max_pixels():
+    """服务器默认质量档位的像素上限（与服务器端缩放规则一致），旧版服务器未公布时使用本地默认值"""
+    budget = (get_server_info() or {}).get("vqa_pixel_budget")
+    if not budget:
+        return config.UPLOAD_DEFAULT_MAX_PIXELS
+    tier = budget.get("tiers", {}).get(budget.get("default_quality"), {})
+    return min(tier.get("max_pixels", budget["max_pixels"]), budget["max_pixels"])
+
+def prepare_upload(image):
+    """
+    校验并准备上传的图片，返回 (文件名, 字节, MIME 类型, 原始大小)
+
+    image 为本地文件路径（或 PIL 图片）：检查 ALLOWED_IMAGE_TYPES 和 MAX_IMAGE_SIZE_MB，
+    超出服务器像素预算的图片先缩小再按 UPLOAD_JPEG_QUALITY 重新压缩；
+    未超出预算的 JPEG 原样上传。校验失败时抛出 ValueError。
+    """
+    if isinstance(image, str):
+        ext = os.path.splitext(image)[1].lower().lstrip(".")
+        if ext not in config.ALLOWED_IMAGE_TYPES:
+            raise ValueError(f"不支持的图片格式 .{ext}，仅支持 {', '.join(config.ALLOWED_IMAGE_TYPES)}")
+        original_size = os.path.getsize(image)
+        if original_size > config.MAX_IMAGE_SIZE_MB * 1024 * 1024:
+            raise ValueError(f"图片过大（{original_size / 1024 / 1024:.1f}MB），最大 {config.MAX_IMAGE_SIZE_MB}MB")
+        with open(image, "rb") as f:
+            data = f.read()
+        pil_image = Image.open(BytesIO(data))
+    else:
+        data, original_size, pil_image = None, 0, image
+
+    max_pixels = upload_max_pixels() if config.UPLOAD_RESIZE_ENABLED else None
+    width, height = pil_image.size
+    oversized = max_pixels is not None and width * height > max_pixels
+    if data is not None and pil_image.format == "JPEG" and not oversized:
+        return "image.jpg", data, "image/jpeg", original_size
+
+    if oversized:
+        # JPEG 在解码阶段直接按 1/2~1/8 缩小（其他格式忽略），解码后再缩放到预算以内
+        scale = (max_pixels / float(width * height)) ** 0.5
+        pil_image.draft("RGB", (int(width * scale), int(height * scale)))
+    # 重新压缩会丢弃 EXIF，先按拍摄方向旋转
+    pil_image = ImageOps.exif_transpose(pil_image).convert("RGB")
+    width, height = pil_image.size
+    if max_pixels is not None and width * height > max_pixels:
+        scale = (max_pixels / float(width * height)) ** 0.5
+        pil_image = pil_image.resize((max(28, int(width * scale)), max(28, int(height * scale))), Image.BILINEAR)
+    buffer = BytesIO()
+    pil_image.save(buffer, format="JPEG", quality=config.UPLOAD_JPEG_QUALITY, optimize=True)
+    return "image.jpg", buffer.getvalue(), "image/jpeg", original_size or buffer.tell()
+
+def format_upload_size(num_bytes, original_bytes):
+    if original_bytes and original_bytes != num_bytes:
+        return f"上传 {num_bytes / 1024:.0f}KB（原图 {original_bytes / 1024:.0f}KB）"
+    return f"上传 {num_bytes / 1024:.0f}KB"
+
 def check_server_health():
     try:
-        response = requests.get(f"{config.SERVER_URL}/health", timeout=config.HEALTH_CHECK_TIMEOUT)
+        response = session.get(f"{config.SERVER_URL}/health", timeout=config.HEALTH_CHECK_TIMEOUT)
         if response.status_code == 200:
             data = response.json()
-            return f"✅ 连接成功 | 设备: {data['device'].upper()} | 图片库: {data['image_library_size']} 张 | 状态: 正常运行"
+            _server_info.update(data=data, time=time.time())
+            status = {"starting": "模型加载中", "degraded": "部分功能不可用"}.get(data.get("status"), "正常运行")
+            return f"✅ 连接成功 | 设备: {data['device'].upper()} | 图片库: {data['image_library_size']} 张 | 状态: {status}"
         else:
             return f"❌ 服务器响应异常 (状态码: {response.status_code})"
     except requests.exceptions.ConnectionError:
@@ -23,44 +126,118 @@ def check_server_health():
     except Exception as e:
         return f"❌ 检查失败: {str(e)}"
 
+def _vqa_request_once(upload, question):
+    """调用非流式 /vqa 接口（服务器不支持流式输出时的回退）"""
+    response = session.post(
+        f"{config.SERVER_URL}/vqa",
+        files={'image': upload},
+        data={'question': question},
+        timeout=config.VQA_TIMEOUT
+    )
+    if response.status_code == 200:
+        result = response.json()
+        answer = result.get('answer', '未返回答案')
+        return f"💬 {answer}"
+    error_detail = response.json().get('detail', '未知错误')
+    return f"❌ 服务器错误: {error_detail}"
+
+def _iter_sse(response):
+    """解析 SSE 响应，逐个产出 (事件名, 数据字典)"""
+    event, data_lines = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+    if data_lines:
+        yield event, json.loads("\n".join(data_lines))
+
 def vqa_inference(image, question):
+    """图文问答：以生成器形式逐段输出答案（服务器 /vqa/stream 流式接口）"""
     if image is None:
-        return "⚠️ 请先上传图片再提问"
+        yield "⚠️ 请先上传图片再提问"
+        return
     if not question or question.strip() == "":
-        return "⚠️ 请输入您的问题"
+        yield "⚠️ 请输入您的问题"
+        return
     
     try:
-        img_byte_arr = BytesIO()
-        image.save(img_byte_arr, format='JPEG')
-        img_byte_arr.seek(0)
-        
-        response = requests.post(
-            f"{config.SERVER_URL}/vqa",
-            files={'image': ('image.jpg', img_byte_arr, 'image/jpeg')},
+        try:
+            filename, data, mime_type, original_size = prepare_upload(image)
+        except ValueError as e:
+            yield f"⚠️ {e}"
+            return
+        upload = (filename, data, mime_type)
+        upload_info = format_upload_size(len(data), original_size)
+
+        # 流式接口：超时为两段输出之间的最长等待，而不是整个回答的总时长
+        response = session.post(
+            f"{config.SERVER_URL}/vqa/stream",
+            files={'image': upload},
             data={'question': question.strip()},
-            timeout=config.VQA_TIMEOUT
+            timeout=(config.HEALTH_CHECK_TIMEOUT, config.VQA_TIMEOUT),
+            stream=True
         )
-        
-        if response.status_code == 200:
-            result = response.json()
-            answer = result.get('answer', '未返回答案')
-            return f"💬 {answer}"
-        else:
+
+        if response.status_code == 404:
+            # 旧版服务器没有流式接口
+            yield _vqa_request_once(upload, question.strip())
+            return
+        if response.status_code != 200:
             error_detail = response.json().get('detail', '未知错误')
-            return f"❌ 服务器错误: {error_detail}"
+            yield f"❌ 服务器错误: {error_detail}"
+            return
+
+        answer = ""
+        with response:
+            for event, data in _iter_sse(response):
+                if event == "error":
+                    yield f"❌ 服务器错误: {data.get('detail', '未知错误')}"
+                    return
+                if event == "done":
+                    answer = data.get('answer', answer) or '未返回答案'
+                    timing = (f"首字 {data.get('ttft_ms', 0) / 1000:.2f}s | 总耗时 {data.get('total_ms', 0) / 1000:.2f}s"
+                              f" | {upload_info}")
+                    yield f"💬 {answer}\n\n⏱️ {timing}"
+                    return
+                answer += data.get('token', '')
+                yield f"💬 {answer}"
+        yield f"💬 {answer}" if answer else "❌ 服务器未返回答案"
     except requests.exceptions.Timeout:
-        return "⏱️ 请求超时,服务器处理时间过长,请稍后重试"
+        yield "⏱️ 请求超时,服务器处理时间过长,请稍后重试"
     except requests.exceptions.ConnectionError:
-        return f"❌ 无法连接到服务器 ({config.SERVER_URL})"
+        yield f"❌ 无法连接到服务器 ({config.SERVER_URL})"
     except Exception as e:
-        return f"❌ 发生错误: {str(e)}"
+        yield f"❌ 发生错误: {str(e)}"
+
+def fetch_image(item):
+    """检索结果项 -> PIL 图片：优先使用内嵌 base64，否则通过共享会话拉取缩略图；单张失败时返回 None"""
+    try:
+        if 'image_base64' in item:
+            img_data = base64.b64decode(item['image_base64'])
+        else:
+            thumb = session.get(f"{config.SERVER_URL}{item['thumbnail_url']}", timeout=config.SEARCH_TIMEOUT)
+            thumb.raise_for_status()
+            img_data = thumb.content
+        image = Image.open(BytesIO(img_data))
+        image.load()
+        return image
+    except Exception as e:
+        print(f"缩略图加载失败 {item.get('image')}: {e}")
+        return None
 
 def text2image_search(text_query, top_k):
     if not text_query or text_query.strip() == "":
         return [], "⚠️ 请输入搜索描述"
     
     try:
-        response = requests.post(
+        response = session.post(
             f"{config.SERVER_URL}/text2image_search",
             data={'text_query': text_query.strip(), 'top_k': int(top_k)},
             timeout=config.SEARCH_TIMEOUT
@@ -73,17 +250,22 @@ def text2image_search(text_query, top_k):
             if not results:
                 return [], "🔍 未找到匹配的图片,请尝试其他搜索词"
             
-            images = []
+            if any('image_base64' not in item and 'thumbnail_url' not in item for item in results):
+                return [], "❌ 数据格式错误:缺少thumbnail_url字段"
+            # 服务器默认只返回图片地址，缩略图在连接池上并发拉取
+            with ThreadPoolExecutor(max_workers=config.HTTP_POOL_SIZE) as executor:
+                images = list(executor.map(fetch_image, results))
+            # 加载失败的缩略图不显示，其余结果照常返回
+            failed = [item['image'] for item, image in zip(results, images) if image is None]
+            images = [image for image in images if image is not None]
+
             info_text = f"✅ 成功找到 {len(results)} 张匹配图片\n"
+            if failed:
+                info_text += f"⚠️ {len(failed)} 张缩略图加载失败: {', '.join(failed)}\n"
             info_text += f"📝 搜索词: \"{text_query.strip()}\"\n\n"
             info_text += "匹配结果:\n" + "="*40 + "\n"
             
             for i, item in enumerate(results, 1):
-                if 'image_base64' not in item:
-                    return [], f"❌ 数据格式错误:缺少image_base64字段"
-                img_data = base64.b64decode(item['image_base64'])
-                img = Image.open(BytesIO(img_data))
-                images.append(img)
                 score_percentage = item['score'] * 100
                 info_text += f"{i}. 📷 {item['image']}\n"
                 info_text += f"   相似度: {score_percentage:.1f}%\n\n"
@@ -113,7 +295,7 @@ def build_interface():
                 with gr.Column(scale=1):
                     vqa_image = gr.Image(
                         label="📤 上传图片", 
-                        type="pil", 
+                        type="filepath", 
                         height=350,
                         sources=["upload", "clipboard"]
                     )
@@ -232,7 +414,6 @@ if __name__ == "__main__":
     print("="*60 + "\n")
     
     # 加载CSS样式
-    import os
     css_path = os.path.join(os.path.dirname(__file__), "styles.css")
     with open(css_path, "r", encoding="utf-8") as f:
         custom_css = f.read().replace("{FONT_FAMILY}", config.FONT_FAMILY)
@@ -7,10 +7,23 @@ SERVER_URL = "http://localhost:8000"  # 服务器地址（根据实际部署修
 # ====================================
 # 请求超时配置（秒）
 # ====================================
-VQA_TIMEOUT = 60          # 图文问答超时（首次较慢）
+VQA_TIMEOUT = 60          # 图文问答超时（流式输出时为两段输出之间的最长等待）
 SEARCH_TIMEOUT = 30       # 文搜图超时
 HEALTH_CHECK_TIMEOUT = 5  # 健康检查超时
 
+# ====================================
+# 连接与上传配置
+# ====================================
+HTTP_POOL_SIZE = 8            # 长连接池大小（缩略图并发下载也复用这些连接）
+HTTP_MAX_RETRIES = 3          # 连接失败时的重试次数；GET 请求遇到 502/503/504 时同样重试（遵循 Retry-After），POST 不重试
+HTTP_RETRY_BACKOFF = 0.5      # 重试退避基数（秒），依次等待 0.5, 1, 2 ...
+SERVER_INFO_TTL = 300         # 服务器信息（像素预算等）缓存时间（秒）
+
+# 上传前按服务器公布的像素预算缩小并重新压缩图片（服务器同样会缩小到该预算，画质不受影响）
+UPLOAD_RESIZE_ENABLED = True
+UPLOAD_JPEG_QUALITY = 90              # 重新压缩的 JPEG 质量
+UPLOAD_DEFAULT_MAX_PIXELS = 768 * 28 * 28  # 无法获取服务器像素预算时使用的上限
+
 # ====================================
 # Gradio界面配置
 # ====================================
@@ -0,0 +1,193 @@
+# ====================================
+# 近似最近邻（ANN）索引 - IVF 倒排索引
+# ====================================
+# 功能：大规模图片库的文搜图加速，纯 NumPy 实现
+# 构建：球面 k-means 将特征聚为 nlist 个簇（粗量化），每簇保存一个倒排列表
+# 查询：只对与查询最相近的 nprobe 个簇中的向量计算精确相似度
+
+import os
+import time
+import logging
+from typing import Optional
+
+import numpy as np
+
+from search_index import top_k_indices
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT_VERSION = 2
+
+
+def default_nlist(n: int) -> int:
+    """经验值：簇数约为 4 * sqrt(N)，且每簇至少约 39 个样本"""
+    if n <= 0:
+        return 1
+    return int(max(1, min(4 * np.sqrt(n), n // 39 or 1)))
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, block_size: int = 65536) -> np.ndarray:
+    """分块计算每个向量最相近的簇（余弦相似度），避免一次性生成 N x nlist 矩阵"""
+    labels = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], block_size):
+        block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        labels[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iters: int = 20, seed: int = 0) -> np.ndarray:
+    """球面 k-means：质心保持单位长度，适配已归一化的 CLIP 特征"""
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    k = min(k, n)
+    centroids = np.array(vectors[rng.choice(n, size=k, replace=False)], dtype=np.float32)
+    for _ in range(iters):
+        labels = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            # 空簇重新随机取样本作为质心
+            sums[empty] = vectors[rng.choice(n, size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    """
+    IVF 倒排索引
+
+    centroids: (nlist, D) 簇质心
+    order: 按簇排列的行号，第 c 个簇的成员为 order[offsets[c]:offsets[c + 1]]
+    source: 构建时使用的特征矩阵标识，用于判断磁盘上的索引是否仍然有效
+    trained_size: 训练质心时的图片库规模，增量更新后规模翻倍即建议重新训练
+    """
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray,
+                 source: str = "", nprobe: int = 8, trained_size: int = 0):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.order = np.asarray(order, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.source = source
+        self.nprobe = nprobe
+        self.trained_size = trained_size or self.order.shape[0]
+
+    @classmethod
+    def from_labels(cls, centroids: np.ndarray, labels: np.ndarray, **kwargs) -> "IVFIndex":
+        """由每行所属簇号生成倒排列表（CSR 形式）"""
+        order = np.argsort(labels, kind="stable")
+        offsets = np.zeros(centroids.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=centroids.shape[0]), out=offsets[1:])
+        return cls(centroids, order, offsets, **kwargs)
+
+    def labels(self) -> np.ndarray:
+        """每行所属的簇号"""
+        labels = np.empty(self.size, dtype=np.int64)
+        labels[self.order] = np.repeat(np.arange(self.nlist), np.diff(self.offsets))
+        return labels
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        return _assign(vectors, self.centroids)
+
+    def updated(self, keep: np.ndarray, new_vectors: np.ndarray, source: str = "") -> "IVFIndex":
+        """
+        增量更新：保留 keep 为 True 的旧行（相对顺序不变），新向量追加在末尾并分配到现有质心
+        """
+        labels = self.labels()[keep]
+        if len(new_vectors):
+            labels = np.concatenate([labels, self.assign(new_vectors)])
+        return IVFIndex.from_labels(self.centroids, labels, source=source,
+                                    nprobe=self.nprobe, trained_size=self.trained_size)
+
+    @property
+    def needs_retrain(self) -> bool:
+        return self.size > 2 * self.trained_size
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def size(self) -> int:
+        return self.order.shape[0]
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, nlist: int = 0, nprobe: int = 8, iters: int = 20,
+              train_size: int = 100000, source: str = "", seed: int = 0) -> "IVFIndex":
+        """用图片库特征构建索引：在采样子集上训练质心，再将全部向量分配到倒排列表"""
+        start = time.perf_counter()
+        n = embeddings.shape[0]
+        nlist = nlist or default_nlist(n)
+        rng = np.random.default_rng(seed)
+        if n > train_size:
+            train = np.asarray(embeddings[np.sort(rng.choice(n, size=train_size, replace=False))], dtype=np.float32)
+        else:
+            train = np.asarray(embeddings, dtype=np.float32)
+        centroids = spherical_kmeans(train, nlist, iters=iters, seed=seed)
+        labels = _assign(embeddings, centroids)
+        logger.info(f"✓ IVF 索引构建完成: N={n}, nlist={centroids.shape[0]}, 耗时 {time.perf_counter() - start:.2f}s")
+        return cls.from_labels(centroids, labels, source=source, nprobe=nprobe, trained_size=n)
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """返回 nprobe 个最近簇内的全部行号"""
+        nprobe = min(max(int(nprobe or self.nprobe), 1), self.nlist)
+        probes = top_k_indices(self.centroids @ query, nprobe)
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probes])
+
+    def search(self, embeddings: np.ndarray, query: np.ndarray, top_k: int,
+               nprobe: Optional[int] = None):
+        """返回 (行号数组, 相似度数组)，按相似度降序"""
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        rows = self.candidates(query, nprobe)
+        if rows.size == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        rows.sort()  # 顺序访问 mmap 更友好
+        scores = embeddings[rows] @ query
+        idx = top_k_indices(scores, top_k)
+        return rows[idx], scores[idx]
+
+    def save(self, path: str) -> None:
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, version=INDEX_FORMAT_VERSION, centroids=self.centroids,
+                 order=self.order, offsets=self.offsets, source=np.array(self.source),
+                 trained_size=self.trained_size)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, source: str = "", nprobe: int = 8) -> Optional["IVFIndex"]:
+        """读取磁盘索引；文件不存在、版本或来源不匹配时返回 None"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if int(data["version"]) != INDEX_FORMAT_VERSION or str(data["source"]) != source:
+                    return None
+                return cls(data["centroids"], data["order"], data["offsets"], source=source,
+                           nprobe=nprobe, trained_size=int(data["trained_size"]))
+        except Exception as e:
+            logger.warning(f"⚠ 读取 IVF 索引失败: {e}")
+            return None
+
+
+def recall_at_k(index: IVFIndex, embeddings: np.ndarray, queries: np.ndarray, k: int = 10,
+                nprobe: Optional[int] = None) -> float:
+    """以精确检索为基准，计算 ANN 检索的 recall@k"""
+    hits, total = 0, 0
+    for query in np.asarray(queries, dtype=np.float32):
+        exact = set(top_k_indices(embeddings @ query, k).tolist())
+        approx, _ = index.search(embeddings, query, k, nprobe)
+        hits += len(exact.intersection(approx.tolist()))
+        total += len(exact)
+    return hits / total if total else 1.0
+
+
+def sample_queries(embeddings: np.ndarray, n: int, noise: float = 0.05, seed: int = 0) -> np.ndarray:
+    """从图片库特征中采样并加噪声，生成召回率评估用的查询向量"""
+    rng = np.random.default_rng(seed)
+    n = min(n, embeddings.shape[0])
+    queries = np.asarray(embeddings[rng.choice(embeddings.shape[0], size=n, replace=False)], dtype=np.float32)
+    queries = queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
@@ -6,18 +6,29 @@
 # 环境：12G显存工作站 + Python 3.10+
 
 import os
-import io
 import gc
+import asyncio
 import ssl
+import json
+import time
+import base64
+import hashlib
 import logging
-from typing import Optional
+import mimetypes
+import shutil
+import threading
+import unicodedata
+from datetime import datetime
+from urllib.parse import quote
+from typing import List, Optional
 
 import torch
 import numpy as np
-from PIL import Image
 
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException
+from fastapi.responses import JSONResponse, Response, FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 
 import certifi
 
@@ -26,11 +37,31 @@ from modelscope import Model, AutoTokenizer, snapshot_download
 
 # Transformers 相关
 from transformers import AutoProcessor, Qwen2_5_VLForConditionalGeneration, BitsAndBytesConfig
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
 from torchvision import transforms
 
 # 本地工具/配置
-from qwen_vl_utils import process_vision_info
+from qwen_vl_utils import process_vision_info, smart_resize
 import config
+from embedding_store import EmbeddingStore
+from image_io import ImageTooLarge, fast_downscale, open_image
+from indexing import IndexingStats, iter_encoded_batches
+from search_index import ImageLibrary
+from dedup import find_duplicate_groups, load_groups, save_groups
+from metadata import MetadataIndex, load_records
+from ann_index import IVFIndex, recall_at_k, sample_queries
+from library_watcher import LibraryWatcher
+from thumbnails import ThumbnailCache
+from caches import LRUCache, TieredCache
+from batching import MicroBatcher
+from concurrency import InferencePool
+from coalescing import SingleFlight
+from cpu_inference import (
+    compile_forward, configure_threads, measure_generation, optimize_model, resolve_bf16, synthetic_image,
+)
+from vqa_sessions import SessionStore
+from model_manager import IdleUnloader, ModelComponent, READY, FAILED, LOADING
+from metrics import MetricsRegistry, RequestMetricsMiddleware
 
 # 禁用SSL证书验证（解决ModelScope下载问题）
 ssl._create_default_https_context = ssl._create_unverified_context
@@ -42,6 +73,10 @@ logger = logging.getLogger(__name__)
 # 创建图片库目录
 os.makedirs(config.IMAGE_LIBRARY_PATH, exist_ok=True)
 
+# CPU 节点：在任何推理之前设置 PyTorch 线程数（算子间线程数只能在首次并行计算前设置）
+if config.DEVICE == "cpu":
+    logger.info(f"CPU 推理线程: {configure_threads(config.CPU_NUM_THREADS, config.CPU_INTEROP_THREADS)}")
+
 # ====================================
 # 全局变量
 # ====================================
@@ -49,16 +84,68 @@ app = FastAPI(title="多模态融合服务", description="VQA图文问答 (Qwen2
 
 vqa_model = None           # Qwen2.5-VL-3B-Instruct 视觉问答模型实例
 vqa_processor = None       # Qwen2.5-VL-3B-Instruct 处理器（文本/图片预处理）
+vqa_cpu_profile = None     # CPU 推理配置摘要（精度、量化层数、预热生成速度），仅 DEVICE == "cpu" 时
 clip_model = None          # CLIP 图文检索模型实例
 clip_preprocessor = None   # CLIP 图像预处理（归一化、缩放等）
 clip_tokenizer = None      # CLIP 文本分词器
-image_library = {}         # 图片库特征索引（文件名->特征向量）
+image_library = ImageLibrary.empty()  # 图片库特征索引（连续特征矩阵 + 并行文件名数组）
+embedding_store = None     # 图片特征磁盘缓存（EmbeddingStore）
+library_lock = threading.Lock()  # 串行化图片库写操作（构建/增量更新），检索只读取当前引用，无需加锁
+library_watcher = None     # 图片库目录监控（可选）
+idle_unloader = None       # 空闲模型卸载线程（可选）
+vqa_batcher = None         # VQA 动态微批处理调度器（可选）
+vqa_generate_lock = threading.Lock()  # 串行化 vqa_model.generate（批处理/流式/会话共用一个模型）
+vqa_sessions = SessionStore(
+    ttl=config.VQA_SESSION_TTL,
+    max_sessions=config.VQA_SESSION_MAX,
+    max_state_bytes=config.VQA_SESSION_MAX_MEMORY_MB * 1024 * 1024,
+)                          # 多轮 VQA 会话
+# 推理线程池：VQA 与 CLIP 分开限流，长时间的生成不会拖慢检索和健康检查
+vqa_pool = InferencePool("vqa", config.VQA_WORKERS, config.VQA_MAX_PENDING, config.OVERLOAD_RETRY_AFTER)
+clip_pool = InferencePool("clip", config.CLIP_WORKERS, config.CLIP_MAX_PENDING, config.OVERLOAD_RETRY_AFTER)
+# 相同在途请求合并：每个接口独立的键空间
+search_flights = SingleFlight("text2image_search")
+vqa_flights = SingleFlight("vqa")
+thumbnail_cache = ThumbnailCache(
+    config.THUMBNAIL_CACHE_DIR,
+    max_side=config.THUMBNAIL_MAX_SIDE,
+    quality=config.THUMBNAIL_QUALITY,
+    memory_bytes=config.THUMBNAIL_MEMORY_MB * 1024 * 1024,
+    max_image_pixels=config.IMAGE_MAX_PIXELS,
+    backend=config.IMAGE_DECODE_BACKEND,
+)                          # 检索结果缩略图缓存（内存 LRU + 磁盘）
+text_embedding_cache = LRUCache(max_entries=config.TEXT_EMBEDDING_CACHE_SIZE)  # 文本查询特征缓存
+vqa_answer_cache = TieredCache(
+    max_entries=config.VQA_CACHE_SIZE,
+    ttl=config.VQA_CACHE_TTL,
+    disk_dir=config.VQA_CACHE_DIR or None,
+)                          # VQA 答案缓存（内存 LRU + 可选磁盘）
+
+# ====================================
+# 监控指标（/metrics，Prometheus 文本格式）
+# ====================================
+metrics = MetricsRegistry(prefix="multimodal_")
+http_requests = metrics.counter("http_requests_total", "HTTP 请求数", ("endpoint", "method", "status"))
+http_errors = metrics.counter("http_request_errors_total", "HTTP 5xx 响应数", ("endpoint",))
+http_latency = metrics.histogram("http_request_duration_seconds", "HTTP 请求延迟（秒）", ("endpoint",))
+# 阶段：upload_read / image_decode / vqa_preprocess / vqa_generate / vqa_decode /
+#       text_encode / similarity_search / serialize
+stage_latency = metrics.histogram("stage_duration_seconds", "各处理阶段耗时（秒）", ("stage",))
+vqa_generated_tokens = metrics.counter("vqa_generated_tokens_total", "VQA 生成的 token 总数（不含填充）")
+vqa_tokens_per_second = metrics.histogram(
+    "vqa_generation_tokens_per_second", "单次 generate 调用的生成速度（token/s）",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+coalesced_requests = metrics.counter(
+    "coalesced_requests_total", "与在途相同请求合并、共享其结果的请求数", ("endpoint",)
+)
+app.add_middleware(RequestMetricsMiddleware, requests=http_requests, errors=http_errors, latency=http_latency)
 
 def load_vqa_model(): # VQA 是 Visual Question Answering（视觉问答）的缩写
     """
     加载 Qwen2.5-VL-3B-Instruct 模型
     """
-    global vqa_model, vqa_processor
+    global vqa_model, vqa_processor, vqa_cpu_profile
     try:
         model_id = config.VQA_MODEL_ID
         logger.info(f"正在加载 VQA 模型: {model_id} ...")
@@ -91,26 +178,37 @@ def load_vqa_model(): # VQA 是 Visual Question Answering（视觉问答）的
 
         # 2. 加载模型
         # 使用 Qwen2_5_VLForConditionalGeneration 类
-        # 启用 4-bit 量化以节省显存 (12GB 显存下推荐)
-        quantization_config = BitsAndBytesConfig(**config.VQA_QUANTIZATION_CONFIG)
-        
-        try:
-            logger.info("正在尝试以 4-bit 量化加载模型 (BitsAndBytes)...")
-            vqa_model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
-                model_dir,
-                quantization_config=quantization_config,
-                device_map="auto",
-                trust_remote_code=True,
-                low_cpu_mem_usage=True,  # 降低 CPU 内存使用
-            )
-            # 设置为评估模式
-            vqa_model.eval()
-        except Exception as e:
-            logger.error(f"加载 Qwen2_5_VLForConditionalGeneration 失败: {e}")
-            raise e
+        use_cpu_profile = config.DEVICE == "cpu" and config.VQA_CPU_PROFILE_ENABLED
+        if use_cpu_profile:
+            # 无 GPU：BitsAndBytes 量化依赖 CUDA，改用 CPU 推理配置（动态 int8 量化 + bf16）
+            vqa_model, vqa_cpu_profile = load_vqa_model_cpu(model_dir)
+        else:
+            # 启用 4-bit 量化以节省显存 (12GB 显存下推荐)
+            quantization_config = BitsAndBytesConfig(**config.VQA_QUANTIZATION_CONFIG)
+
+            try:
+                logger.info("正在尝试以 4-bit 量化加载模型 (BitsAndBytes)...")
+                vqa_model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
+                    model_dir,
+                    quantization_config=quantization_config,
+                    device_map="auto",
+                    trust_remote_code=True,
+                    low_cpu_mem_usage=True,  # 降低 CPU 内存使用
+                )
+                # 设置为评估模式
+                vqa_model.eval()
+            except Exception as e:
+                logger.error(f"加载 Qwen2_5_VLForConditionalGeneration 失败: {e}")
+                raise e
 
         # 3. 加载处理器
         vqa_processor = AutoProcessor.from_pretrained(model_dir, trust_remote_code=True)
+        # 批量生成需要左填充，保证每条序列的生成起点对齐
+        vqa_processor.tokenizer.padding_side = "left"
+
+        # 4. CPU 推理预热（启用编译时在此完成编译）
+        if use_cpu_profile and (config.VQA_CPU_WARMUP_TOKENS > 0 or config.VQA_CPU_COMPILE):
+            warm_up_vqa_model()
 
         if torch.cuda.is_available():
             mem_use = torch.cuda.memory_allocated(0) / 1024**3
@@ -122,6 +220,56 @@ def load_vqa_model(): # VQA 是 Visual Question Answering（视觉问答）的
         logger.error(f"✗ VQA 模型加载失败: {str(e)}")
         raise
 
+def load_vqa_model_cpu(model_dir):
+    """
+    CPU 推理配置加载：float32 加载后转换精度并动态量化（见 cpu_inference.py），返回 (模型, 配置摘要)
+    """
+    bf16 = resolve_bf16(config.VQA_CPU_DTYPE)
+    logger.info(f"正在以 CPU 推理配置加载模型 (int8 动态量化: {config.VQA_CPU_QUANTIZE}, bf16: {bf16})...")
+    model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
+        model_dir,
+        torch_dtype=torch.float32,
+        trust_remote_code=True,
+        low_cpu_mem_usage=True,
+    )
+    start = time.perf_counter()
+    profile = optimize_model(model, quantize=config.VQA_CPU_QUANTIZE, bf16=bf16)
+    profile.update(
+        threads=torch.get_num_threads(),
+        interop_threads=torch.get_num_interop_threads(),
+        convert_seconds=round(time.perf_counter() - start, 1),
+        compiled=False,
+        warmup=None,
+    )
+    logger.info(
+        f"✓ CPU 推理配置: 视觉编码器 {profile['vision_dtype']}，语言模型 {profile['text_dtype']}"
+        f"（量化 {profile['quantized_linear_layers']} 个 Linear），权重 {profile['weight_bytes'] / 1024**3:.2f}GB"
+    )
+    return model, profile
+
+def warm_up_vqa_model():
+    """
+    CPU 推理预热：用合成图片执行一次短生成，完成 oneDNN 内核选择、内存分配及可选的 torch.compile 编译，
+    并记录预填充耗时与生成速度（见 /health 的 vqa_cpu_profile）；编译后的前向执行失败时恢复 eager
+    """
+    generation = dict(config.VQA_GENERATION_CONFIG, max_new_tokens=max(1, config.VQA_CPU_WARMUP_TOKENS))
+    inputs = prepare_vqa_inputs([(synthetic_image(), "描述一下这张图片。", resolve_pixel_budget())])
+    original_forward = compile_forward(vqa_model) if config.VQA_CPU_COMPILE else None
+    try:
+        result = measure_generation(vqa_model, inputs, generation)
+    except Exception as e:
+        if original_forward is None:
+            raise
+        logger.warning(f"torch.compile 编译后的前向执行失败，回退到 eager: {e}")
+        vqa_model.forward = original_forward
+        original_forward = None
+        result = measure_generation(vqa_model, inputs, generation)
+    vqa_cpu_profile.update(compiled=original_forward is not None, warmup=result)
+    logger.info(
+        f"✓ VQA 预热完成: 预填充 {result['prefill_ms']}ms（{result['prompt_tokens']} token），"
+        f"生成 {result['decode_tokens_per_second']} token/s"
+    )
+
 def load_clip_model():
     """
     加载 CLIP 图文检索模型 (保持不变)
@@ -160,6 +308,8 @@ def load_clip_model():
         clip_model = Model.from_pretrained(model_dir)
         clip_model.to(config.DEVICE)
         clip_model.eval()
+        # 模型重新加载后旧的文本特征不再有效
+        text_embedding_cache.clear()
 
         # clip_tokenizer 作用说明：
         # CLIP 的分词器（tokenizer）用于将输入的文本（如检索关键词、描述等）
@@ -195,209 +345,1797 @@ def load_clip_model():
         logger.error(f"✗ CLIP 模型加载失败: {str(e)}")
         raise
 
+def unload_vqa_model():
+    """卸载 VQA 模型以释放显存/内存（会话的 KV cache 依赖模型，一并释放）"""
+    global vqa_model, vqa_processor, vqa_cpu_profile
+    with vqa_generate_lock:
+        vqa_model = vqa_processor = vqa_cpu_profile = None
+    vqa_sessions.release_states()
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def unload_clip_model():
+    """卸载 CLIP 模型（图片库特征保留，重新加载后仍然有效）"""
+    global clip_model, clip_preprocessor, clip_tokenizer
+    clip_model = clip_preprocessor = clip_tokenizer = None
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def clip_model_tag():
+    """CLIP 模型与预处理配置标识，任一项变化时特征缓存自动失效"""
+    return {
+        "model_id": config.CLIP_MODEL_ID,
+        "model_path": config.CLIP_LOCAL_MODEL_PATH,
+        "image_size": list(config.CLIP_IMAGE_SIZE),
+        "normalize_mean": list(config.CLIP_NORMALIZE_MEAN),
+        "normalize_std": list(config.CLIP_NORMALIZE_STD),
+        # 解码方式（缩放解码、EXIF 方向）同样影响特征
+        "decode": {"draft": config.IMAGE_DRAFT_DECODE, "exif_transpose": True},
+    }
+
+def preprocess_image_file(img_path):
+    """读取单张图片并完成 CLIP 预处理（在索引工作线程中执行），返回 [C, H, W] 张量"""
+    # 大图按 CLIP 输入尺寸缩放解码，不解码随后会被丢弃的像素
+    image = open_image(
+        img_path,
+        min_size=config.CLIP_IMAGE_SIZE if config.IMAGE_DRAFT_DECODE else None,
+        max_image_pixels=config.IMAGE_MAX_PIXELS,
+        backend=config.IMAGE_DECODE_BACKEND,
+    )
+    # 使用clip_preprocessor对图片进行缩放、归一化等预处理
+    return clip_preprocessor(image)
+
+def encode_image_batch(image_tensors):
+    """批量提取归一化后的 CLIP 图片特征，返回 shape 为 [B, embedding_dim] 的 float32 NumPy 数组"""
+    # 1. torch.stack将多张图片张量堆叠为batch（形状变为[B, C, H, W]），适配模型输入
+    # 2. to(config.DEVICE)将张量移动到指定设备（如GPU），加速特征提取
+    batch = torch.stack(image_tensors).to(config.DEVICE)
+
+    with torch.no_grad():
+        # 使用 ModelScope CLIP 的 encode_image 方法：
+        # 将预处理后的图片张量输入CLIP模型，提取图片的高维特征向量（embedding），
+        # 该特征可用于后续与文本特征做相似度检索，实现跨模态搜索。
+        # 返回结果为图片的特征张量，shape一般为[B, embedding_dim]。
+        image_features = clip_model.clip_model.encode_image(batch)
+        # 归一化
+        image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+
+    # 将特征张量从GPU转到CPU，并转换为NumPy数组，方便后续检索和存储
+    return image_features.cpu().numpy().astype(np.float32)
+
+def encode_image_files(file_names):
+    """
+    流水线批量编码图片库中的文件：工作线程解码+预处理，主线程按批次编码
+
+    返回 (文件名 -> 特征向量, IndexingStats)
+    """
+    stats = IndexingStats()
+    items = [(f, os.path.join(config.IMAGE_LIBRARY_PATH, f)) for f in file_names]
+    features = {}
+    if not items:
+        return features, stats
+    # 特征全部命中缓存时不会走到这里，CLIP 按需加载
+    with clip_component.use():
+        for names, batch_features in iter_encoded_batches(
+            items,
+            preprocess_image_file,
+            encode_image_batch,
+            batch_size=config.CLIP_BATCH_SIZE,
+            num_workers=config.INDEX_NUM_WORKERS,
+            queue_size=config.INDEX_QUEUE_SIZE,
+            stats=stats,
+        ):
+            for name, vector in zip(names, batch_features):
+                features[name] = vector
+    logger.info(f"图片编码统计: {stats.summary()}")
+    return features, stats
+
+def ivf_index_location(store):
+    """IVF 索引的保存路径和来源标识（特征矩阵文件名 + 簇数）；无磁盘缓存时返回 (None, "")"""
+    if store is None or not store.embeddings_path:
+        return None, ""
+    index_path = os.path.join(config.EMBEDDING_CACHE_DIR, "ivf_index.npz")
+    source = f"{os.path.basename(store.embeddings_path)}:{config.IVF_NLIST}"
+    if config.DEDUP_ENABLED:
+        # 去重后索引建立在代表图片上，阈值变化时需要重建
+        source += f":dedup={config.DEDUP_THRESHOLD}"
+    return index_path, source
+
+def attach_ann_index(library, store=None, previous=None, keep=None, new_vectors=None):
+    """
+    按 config.SEARCH_BACKEND 为图片库挂载 IVF 近似检索索引
+
+    索引保存在特征缓存目录，特征矩阵未变化时直接加载，不重复训练。
+    增量更新时传入旧索引 previous、旧行保留掩码 keep 和新增向量 new_vectors，
+    新向量直接分配到已有质心；规模翻倍后才重新训练质心。
+    索引建立在 library.search_matrix 上（启用去重时只含代表图片，此时不做增量更新）。
+    """
+    if config.SEARCH_BACKEND != "ivf" or library.search_size < config.ANN_MIN_LIBRARY_SIZE:
+        return
+    try:
+        index_path, source = ivf_index_location(store)
+        if previous is not None and keep is not None and library.search_rows is None:
+            index = previous.updated(keep, new_vectors, source=source)
+            if not index.needs_retrain:
+                if index_path:
+                    index.save(index_path)
+                library.ann_index = index
+                return
+        elif index_path:
+            index = IVFIndex.load(index_path, source=source, nprobe=config.IVF_NPROBE)
+            if index is not None and index.size == library.search_size:
+                library.ann_index = index
+                logger.info(f"✓ 已加载 IVF 索引: nlist={index.nlist}, nprobe={index.nprobe}")
+                return
+
+        index = IVFIndex.build(
+            library.search_matrix,
+            nlist=config.IVF_NLIST,
+            nprobe=config.IVF_NPROBE,
+            iters=config.IVF_KMEANS_ITERS,
+            train_size=config.IVF_TRAIN_SAMPLE,
+            source=source,
+        )
+        if config.ANN_RECALL_CHECK_QUERIES > 0:
+            queries = sample_queries(library.search_matrix, config.ANN_RECALL_CHECK_QUERIES)
+            recall = recall_at_k(index, library.search_matrix, queries, k=config.ANN_RECALL_CHECK_K)
+            logger.info(f"IVF recall@{config.ANN_RECALL_CHECK_K} (nprobe={index.nprobe}): {recall:.3f}")
+        if index_path:
+            index.save(index_path)
+        library.ann_index = index
+    except Exception as e:
+        logger.warning(f"⚠ IVF 索引构建失败，使用精确检索: {e}")
+
+def new_image_library(names, matrix):
+    """按 config.INDEX_PRECISION 创建图片库索引（matrix 为磁盘缓存 mmap 时压缩矩阵之外不常驻内存）"""
+    return ImageLibrary(names, matrix, precision=config.INDEX_PRECISION,
+                        rerank_factor=config.INDEX_RERANK_FACTOR)
+
+def log_library_memory(library):
+    stats = library.memory_stats()
+    logger.info(f"检索矩阵: {stats['precision']}，每张 {stats['bytes_per_image']} 字节，"
+                f"常驻 {stats['search_matrix_bytes'] / 1024**2:.1f}MB")
+
+def dedup_groups_location(store):
+    """近重复分组的保存路径和来源标识（特征矩阵文件名 + 阈值）；无磁盘缓存时返回 (None, "")"""
+    if store is None or not store.embeddings_path:
+        return None, ""
+    path = os.path.join(config.EMBEDDING_CACHE_DIR, "dedup_groups.json")
+    return path, f"{os.path.basename(store.embeddings_path)}:{config.DEDUP_THRESHOLD}"
+
+def collapse_duplicates(library, store=None, previous=None, changed=()):
+    """
+    按 config.DEDUP_THRESHOLD 折叠近重复图片（在挂载 ANN 索引之前调用）
+
+    store 为与 library 内容一致的特征缓存时，分组保存在缓存目录，特征矩阵与阈值未变化时
+    直接加载，启动时不再重复 O(N^2) 的全量检测。
+    增量更新时传入旧索引 previous 和新增/变化的文件名 changed：
+    延续成员未变化的旧重复组，删除或变化了成员的组按组内相似度重新拆分，
+    只计算变化图片与全库的相似度。
+    """
+    if not config.DEDUP_ENABLED or len(library) < 2:
+        return
+    try:
+        groups_path, source = dedup_groups_location(store)
+        groups = None
+        new_rows, seed_groups, split_groups = None, [], []
+        if previous is not None and len(previous):
+            changed = set(changed)
+            for group in previous.duplicate_groups():
+                rows = [library.position(previous.names[r]) for r in group
+                        if previous.names[r] not in changed and previous.names[r] in library]
+                if len(rows) == len(group):
+                    seed_groups.append(rows)
+                elif len(rows) > 1:
+                    split_groups.append(rows)
+            new_rows = np.array([library.position(n) for n in changed if n in library], dtype=np.int64)
+        elif groups_path:
+            saved = load_groups(groups_path, source)
+            if saved is not None and all(name in library for group in saved for name in group):
+                groups = [np.array([library.position(name) for name in group], dtype=np.int64) for group in saved]
+                logger.info(f"✓ 已加载近重复分组: {len(groups)} 组")
+        if groups is None:
+            groups = find_duplicate_groups(
+                library.embeddings,
+                config.DEDUP_THRESHOLD,
+                block_size=config.DEDUP_BLOCK_SIZE,
+                new_rows=new_rows,
+                seed_groups=seed_groups,
+                split_groups=split_groups,
+            )
+            if groups_path:
+                try:
+                    save_groups(groups_path, source, [[library.names[r] for r in group] for group in groups])
+                except OSError as e:
+                    logger.warning(f"⚠ 近重复分组写入失败: {e}")
+        # 代表图片优先选文件最大的一张（通常是未经压缩/缩小的原图），只需查询重复组成员的大小
+        priority = np.zeros(len(library))
+        for group in groups:
+            for row in group:
+                try:
+                    priority[row] = os.path.getsize(os.path.join(config.IMAGE_LIBRARY_PATH, library.names[row]))
+                except OSError:
+                    pass
+        library.collapse(groups, priority)
+        if groups:
+            logger.info(f"近重复折叠: {len(library)} 张 -> 检索 {library.search_size} 张")
+    except Exception as e:
+        logger.warning(f"⚠ 近重复检测失败，使用未去重的索引: {e}")
+
+def attach_metadata_index(library, previous=None, changed=()):
+    """
+    为图片库挂载元数据过滤索引（类别/标签/文件大小/修改时间）
+
+    增量更新时传入旧索引 previous 和新增/变化的文件名 changed，其余图片复用旧记录；
+    previous 为空时重新读取全部旁路元数据文件。
+    """
+    if not config.METADATA_INDEX_ENABLED or len(library) == 0:
+        return
+    try:
+        store = embedding_store
+        records = load_records(
+            config.IMAGE_LIBRARY_PATH,
+            library.names,
+            entries=store.entries if store is not None else None,
+            previous=previous.metadata.record_map() if previous is not None and previous.metadata is not None else None,
+            changed=changed,
+            separators=config.METADATA_CATEGORY_SEPARATORS,
+            sidecar_suffix=config.METADATA_SIDECAR_SUFFIX,
+        )
+        library.metadata = MetadataIndex(library.names, records, cache_size=config.METADATA_FILTER_CACHE_SIZE)
+    except Exception as e:
+        logger.warning(f"⚠ 元数据索引构建失败，过滤检索不可用: {e}")
+
+def list_library_files():
+    """列出图片库目录中的有效图片文件（排序后返回）"""
+    valid_extensions = config.VALID_IMAGE_EXTENSIONS
+    return sorted(f for f in os.listdir(config.IMAGE_LIBRARY_PATH)
+                  if os.path.splitext(f.lower())[1] in valid_extensions)
+
 def build_image_library():
-    """构建图片库索引"""
-    global image_library
+    """构建图片库索引（优先复用磁盘特征缓存，只编码新增/变更的图片）"""
+    with library_lock:
+        _build_image_library()
+
+def _build_image_library():
+    global image_library, embedding_store
     try:
         logger.info(f"构建图片库索引: {config.IMAGE_LIBRARY_PATH} ...")
-        # 图片格式
-        valid_extensions = config.VALID_IMAGE_EXTENSIONS
-        
+
         if not os.path.exists(config.IMAGE_LIBRARY_PATH):
             logger.warning(f"⚠ 图片库目录不存在: {config.IMAGE_LIBRARY_PATH}")
             return
-        # 过滤有效图片文件   
-        image_files = [f for f in os.listdir(config.IMAGE_LIBRARY_PATH) 
-                      if os.path.splitext(f.lower())[1] in valid_extensions]
+        # 过滤有效图片文件
+        image_files = list_library_files()
 
         if not image_files:
             logger.warning("⚠ 图片库为空")
             return
 
+        if not config.EMBEDDING_CACHE_ENABLED:
+            features, _ = encode_image_files(image_files)
+            names = [f for f in image_files if f in features]
+            if names:
+                image_library = new_image_library(names, np.stack([features[f] for f in names]))
+                collapse_duplicates(image_library)
+                attach_ann_index(image_library)
+                attach_metadata_index(image_library)
+                log_library_memory(image_library)
+            logger.info(f"✓ 图片库构建完成，共 {len(image_library)} 张")
+            return
+
+        store = EmbeddingStore(config.EMBEDDING_CACHE_DIR, clip_model_tag())
+        store.load()
+        embedding_store = store
+        hits, misses = store.resolve(config.IMAGE_LIBRARY_PATH, image_files)
+        logger.info(f"特征缓存命中 {len(hits)} 张，需编码 {len(misses)} 张")
+
+        miss_entries = dict(misses)
+        features, _ = encode_image_files([img_file for img_file, _ in misses])
+        encoded = {f: (miss_entries[f], vector) for f, vector in features.items()}
+
+        names, entries, rows = [], [], []
         for img_file in image_files:
-            img_path = os.path.join(config.IMAGE_LIBRARY_PATH, img_file)
+            if img_file in hits:
+                entry, row = hits[img_file]
+                names.append(img_file)
+                entries.append(entry)
+                rows.append(np.asarray(store.embeddings[row], dtype=np.float32))
+            elif img_file in encoded:
+                entry, vector = encoded[img_file]
+                names.append(img_file)
+                entries.append(entry)
+                rows.append(vector)
+
+        if not names:
+            logger.warning("⚠ 没有可用的图片特征")
+            return
+
+        # 有新编码、已删除、改名或 mtime 变化的文件时才重写缓存（同时清理已删除文件的条目）
+        new_entries = [dict(entry, row=row) for row, entry in enumerate(entries)]
+        matrix = store.embeddings
+        if len(store.entries) != len(names) or new_entries != [store.entries.get(n) for n in names]:
+            matrix = np.stack(rows)
             try:
-                image = Image.open(img_path).convert("RGB")
-                # 1. 使用clip_preprocessor对图片进行缩放、归一化等预处理
-                # 2. unsqueeze(0)将图片张量扩展为batch维度（形状变为[1, C, H, W]），适配模型输入
-                # 3. to(config.DEVICE)将张量移动到指定设备（如GPU），加速特征提取
-                image_tensor = clip_preprocessor(image).unsqueeze(0).to(config.DEVICE)
-                
-                with torch.no_grad():
-                    # 使用 ModelScope CLIP 的 encode_image 方法：
-                    # 将预处理后的图片张量输入CLIP模型，提取图片的高维特征向量（embedding），
-                    # 该特征可用于后续与文本特征做相似度检索，实现跨模态搜索。
-                    # 返回结果为图片的特征张量，shape一般为[1, embedding_dim]。
-                    image_features = clip_model.clip_model.encode_image(image_tensor)
-                    # 归一化
-                    image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-                
-                # 将特征张量从GPU转到CPU，并转换为NumPy数组，方便后续检索和存储
-                image_library[img_file] = image_features.cpu().numpy()
+                store.save(names, entries, matrix)
+                matrix = store.embeddings
+                logger.info(f"特征缓存已更新: {store.embeddings_path}")
             except Exception as e:
-                logger.warning(f"处理图片 {img_file} 失败: {e}")
+                logger.warning(f"⚠ 特征缓存写入失败，本次仅使用内存索引: {e}")
+
+        image_library = new_image_library(names, matrix)
+        # 缓存写入失败时索引内容与磁盘缓存不一致，不读写保存的分组
+        collapse_duplicates(image_library, store if matrix is store.embeddings else None)
+        attach_ann_index(image_library, store)
+        attach_metadata_index(image_library)
+        log_library_memory(image_library)
 
         logger.info(f"✓ 图片库构建完成，共 {len(image_library)} 张")
 
     except Exception as e:
         logger.error(f"✗ 图片库构建失败: {str(e)}")
 
-@app.on_event("startup")
-async def startup_event():
-    logger.info("系统初始化启动...")
-    load_vqa_model()
-    load_clip_model()
-    build_image_library()
-    logger.info("✓ 服务启动完成")
+def apply_library_changes(added, removed=(), refresh_metadata=False):
+    """
+    增量更新图片库（调用方需持有 library_lock）
 
-@app.post("/vqa")
-async def visual_question_answering(
-    image: UploadFile = File(...),
-    question: str = Form(...)
-):
+    added: 文件名 -> (manifest 条目, 特征向量)，同名旧条目会被替换
+    removed: 待移除的文件名
+    refresh_metadata: 重新读取全部图片的元数据（否则只读取新增/变化的图片）
+
+    写时复制：在新对象上完成拼接、持久化和 ANN 索引更新后再整体替换全局引用，
+    检索请求始终看到完整的旧索引或新索引，不会看到中间状态。
+    """
+    global image_library
+    current = image_library
+    drop = set(removed) | set(added)
+    keep = np.array([name not in drop for name in current.names], dtype=bool)
+    kept_names = list(current.names[keep])
+    new_names = sorted(added)
+    new_vectors = (np.stack([added[n][1] for n in new_names]).astype(np.float32)
+                   if new_names else np.zeros((0, current.dim), dtype=np.float32))
+
+    names = kept_names + new_names
+    if current.dim and new_names and new_vectors.shape[1] != current.dim:
+        raise ValueError(f"特征维度不一致: {new_vectors.shape[1]} != {current.dim}")
+    if len(current) == 0:
+        matrix = new_vectors
+    else:
+        matrix = np.concatenate([np.asarray(current.embeddings[keep], dtype=np.float32), new_vectors])
+
+    store = embedding_store
+    if store is not None:
+        entries = [store.entries.get(n) for n in kept_names] + [added[n][0] for n in new_names]
+        if all(e is not None for e in entries):
+            try:
+                store.save(names, entries, matrix)
+                matrix = store.embeddings
+            except Exception as e:
+                logger.warning(f"⚠ 特征缓存写入失败，本次仅更新内存索引: {e}")
+                store = None
+        else:
+            store = None
+
+    library = new_image_library(names, matrix)
+    collapse_duplicates(library, store, previous=current, changed=new_names)
+    if current.ann_index is not None:
+        attach_ann_index(library, store, previous=current.ann_index, keep=keep, new_vectors=new_vectors)
+    else:
+        attach_ann_index(library, store)
+    attach_metadata_index(library, previous=None if refresh_metadata else current, changed=new_names)
+    image_library = library
+    logger.info(f"✓ 图片库已更新: 新增/更新 {len(new_names)} 张，移除 {len(set(removed) & set(current.names))} 张，"
+                f"共 {len(library)} 张（参与检索 {library.search_size} 张）")
+    return library
+
+def encode_library_entries(file_names):
+    """编码图片库中的指定文件，返回 文件名 -> (manifest 条目, 特征向量)"""
+    features, _ = encode_image_files(file_names)
+    result = {}
+    for name, vector in features.items():
+        path = os.path.join(config.IMAGE_LIBRARY_PATH, name)
+        try:
+            entry = EmbeddingStore.describe(path)
+        except OSError as e:
+            logger.warning(f"读取文件失败 {name}: {e}")
+            continue
+        result[name] = (entry, vector)
+    return result
+
+def add_library_files(file_names):
+    """将已放入图片库目录的文件加入索引（只编码这些文件）"""
+    with library_lock:
+        added = encode_library_entries(file_names)
+        if added:
+            apply_library_changes(added)
+            pregenerate_thumbnails(sorted(added))
+        return sorted(added)
+
+def save_library_uploads(uploads):
+    """
+    将上传的图片写入图片库目录（阻塞 IO，在线程池中执行），不覆盖已有的同名文件
+
+    返回 (已保存的 {文件名: 上传文件名}, {上传文件名: 失败原因})
+    """
+    saved, errors = {}, {}
+    for upload in uploads:
+        filename = upload.filename or ""
+        name = os.path.basename(filename)
+        if not name or os.path.splitext(name.lower())[1] not in config.VALID_IMAGE_EXTENSIONS:
+            errors[filename] = "不支持的文件类型"
+            continue
+        path = os.path.join(config.IMAGE_LIBRARY_PATH, name)
+        if name in saved or os.path.exists(path):
+            errors[filename] = "图片库中已存在同名文件"
+            continue
+        # 先写临时文件再硬链接到目标路径：目录监控不会读到写了一半的文件，且目标已存在时失败而不是覆盖
+        tmp_path = f"{path}.{threading.get_ident()}.uploading"   # 并发上传同名文件时互不干扰
+        try:
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(upload.file, f)
+            os.link(tmp_path, path)
+            saved[name] = filename
+        except FileExistsError:
+            errors[filename] = "图片库中已存在同名文件"
+        except OSError as e:
+            errors[filename] = f"保存失败: {e}"
+        finally:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+    return saved, errors
+
+def remove_library_files(file_names, delete_files=True):
+    """从索引中移除文件，并可选删除磁盘上的原图"""
+    with library_lock:
+        removed = [name for name in file_names if name in image_library]
+        if removed:
+            apply_library_changes({}, removed)
+        if delete_files:
+            for name in file_names:
+                path = os.path.join(config.IMAGE_LIBRARY_PATH, name)
+                if os.path.exists(path):
+                    os.remove(path)
+        return removed
+
+def rescan_library():
+    """
+    重新扫描图片库目录，只编码新增或内容变化的文件，并移除已删除文件
+
+    返回 {"added": [...], "removed": [...]}
+    """
+    with library_lock:
+        if not os.path.exists(config.IMAGE_LIBRARY_PATH):
+            return {"added": [], "removed": []}
+        current = image_library
+        image_files = list_library_files()
+        removed = sorted(set(current.names) - set(image_files))
+
+        store = embedding_store
+        added = {}
+        if store is not None:
+            hits, misses = store.resolve(config.IMAGE_LIBRARY_PATH, image_files)
+            # 改名/复制的文件内容哈希命中缓存，直接复用已有特征
+            for name, (entry, row) in hits.items():
+                if name not in current or store.entries.get(name, {}).get("mtime_ns") != entry["mtime_ns"]:
+                    added[name] = (entry, np.asarray(store.embeddings[row], dtype=np.float32))
+            added.update(encode_library_entries([name for name, _ in misses]))
+        else:
+            added = encode_library_entries([f for f in image_files if f not in current])
+
+        if added or removed:
+            apply_library_changes(added, removed, refresh_metadata=True)
+            pregenerate_thumbnails(sorted(added))
+        else:
+            # 图片未变化时旁路元数据文件仍可能被修改
+            attach_metadata_index(current)
+        return {"added": sorted(added), "removed": removed}
+
+def image_version(name):
+    """图片内容版本标识：优先使用特征缓存中的内容哈希，否则使用 大小-mtime"""
+    stat = os.stat(os.path.join(config.IMAGE_LIBRARY_PATH, name))
+    store = embedding_store
+    entry = store.entries.get(name) if store is not None else None
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["sha1"]
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+def pregenerate_thumbnails(file_names):
+    """后台为图片预生成磁盘缩略图，检索结果首次展示时无需解码原图"""
+    if not config.THUMBNAIL_PREGENERATE or not config.THUMBNAIL_CACHE_DIR or not file_names:
+        return
+
+    def run():
+        for name in file_names:
+            try:
+                thumbnail_cache.pregenerate(os.path.join(config.IMAGE_LIBRARY_PATH, name), image_version(name))
+            except Exception as e:
+                logger.warning(f"生成缩略图失败 {name}: {e}")
+
+    threading.Thread(target=run, daemon=True, name="thumbnail-pregenerate").start()
+
+def normalize_query(text):
+    """查询文本归一化：全半角统一、去首尾空白、合并连续空白"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+def encode_text_query(text):
+    """
+    提取归一化后的 CLIP 文本特征，返回 shape 为 [embedding_dim] 的 float32 数组
+
+    结果按 (CLIP 模型 id, 归一化查询) 缓存，重复查询不再经过分词和模型。
+    """
+    return encode_text_queries([text])[0]
+
+def encode_text_queries(texts):
+    """
+    批量提取 CLIP 文本特征，返回 [embedding_dim] 数组的列表（与 texts 等长）
+
+    缓存未命中的查询去重后填充为一个批次，只调用一次 encode_text。
+    """
+    keys = [(config.CLIP_MODEL_ID, normalize_query(text)) for text in texts]
+    vectors = {key: text_embedding_cache.get(key) for key in keys}
+    misses = [key for key, vector in vectors.items() if vector is None]
+
+    if misses:
+        with clip_component.use(), stage_latency.time(stage="text_encode"):
+            # 文本编码 - 使用 ModelScope CLIP 的 encode_text 方法
+            text_tokens = clip_tokenizer([key[1] for key in misses], return_tensors="pt", padding=True, truncation=True)
+            # 将 input_ids 移到 GPU (encode_text 只需要 input_ids)
+            input_ids = text_tokens['input_ids'].to(config.DEVICE)
+
+            with torch.no_grad():
+                text_features = clip_model.clip_model.encode_text(input_ids)
+                # 归一化
+                text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+
+        for key, vector in zip(misses, text_features.cpu().numpy().astype(np.float32)):
+            vector.setflags(write=False)  # 缓存共享同一数组，禁止原地修改
+            text_embedding_cache.put(key, vector)
+            vectors[key] = vector
+    return [vectors[key] for key in keys]
+
+def build_vqa_messages(pil_image, question, pixel_budget=None):
+    """
+    构建 Qwen2.5-VL 消息格式
+
+    pixel_budget 为 {"min_pixels", "max_pixels"}，由 process_vision_info 按该范围缩放图片，
+    决定视觉 token 数量。
+    """
+    image_content = {"type": "image", "image": pil_image}
+    if pixel_budget:
+        image_content.update(pixel_budget)
+    return [
+        {
+            "role": "user",
+            "content": [
+                image_content,
+                {"type": "text", "text": question},
+            ],
+        }
+    ]
+
+def prepare_vqa_inputs(items):
+    """将 [(PIL 图片, 问题, 像素预算)] 预处理为模型输入（左填充为一个批次），并移动到计算设备"""
+    with stage_latency.time(stage="vqa_preprocess"):
+        return _prepare_vqa_inputs(items)
+
+def _prepare_vqa_inputs(items):
+    conversations = [build_vqa_messages(pil_image, question, budget) for pil_image, question, budget in items]
+
+    # 使用Qwen2.5-VL的apply_chat_template方法：
+    # 1. 将多模态消息（图片+文本）格式化为模型所需的输入字符串，
+    #    保证图片和问题以正确的prompt格式传递给大模型。
+    # 2. tokenize=False表示只生成字符串，不做分词，后续由processor统一处理。
+    # 3. add_generation_prompt=True会在末尾自动补充生成指令，
+    #    让模型知道需要输出答案。
+    texts = [
+        vqa_processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        for messages in conversations
+    ]
+
+    # 解析多模态消息，提取图片和视频内容，
+    # 并转换为模型输入所需的格式（如PIL图片转为张量等）。
+    # 传入多组对话时返回按顺序拼接的图片列表，与 texts 中的图片占位符一一对应。
+    image_inputs, video_inputs = process_vision_info(conversations)
+
+    inputs = vqa_processor(
+        text=texts,
+        images=image_inputs,
+        videos=video_inputs,
+        padding=True,           # 自动对输入序列进行padding，保证batch内长度一致
+        return_tensors="pt",   # 返回PyTorch张量格式，便于直接送入模型
+    )
+    return inputs.to(config.DEVICE)
+
+def generate_vqa_answers(items):
+    """
+    批量 VQA 推理：items 为 [(PIL 图片, 问题, 像素预算)]，返回等长的答案列表
+
+    多个请求经 processor(padding=True) 左填充为一个批次，只调用一次 generate。
+    """
     try:
         # 清理显存缓存
         torch.cuda.empty_cache()
-        
-        # 1. 读取图片
-        image_bytes = await image.read()
-        pil_image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-
-        logger.info(f"VQA Request: {question}")
-
-        # 2. 构建 Qwen2.5-VL 消息格式
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "image", "image": pil_image},
-                    {"type": "text", "text": question},
-                ],
-            }
-        ]
-
-        # 3. 预处理
-        # 使用Qwen2.5-VL的apply_chat_template方法：
-        # 1. 将多模态消息（图片+文本）格式化为模型所需的输入字符串，
-        #    保证图片和问题以正确的prompt格式传递给大模型。
-        # 2. tokenize=False表示只生成字符串，不做分词，后续由processor统一处理。
-        # 3. add_generation_prompt=True会在末尾自动补充生成指令，
-        #    让模型知道需要输出答案。
-        text = vqa_processor.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True
-        )
 
-        # 解析多模态消息，提取图片和视频内容，
-        # 并转换为模型输入所需的格式（如PIL图片转为张量等）。
-        # 返回值：image_inputs为图片输入列表，video_inputs为视频输入列表（本场景一般只用图片）。
-        image_inputs, video_inputs = process_vision_info(messages)
-
-        inputs = vqa_processor(
-            text=[text],
-            images=image_inputs,
-            videos=video_inputs,
-            padding=True,           # 自动对输入序列进行padding，保证batch内长度一致
-            return_tensors="pt",   # 返回PyTorch张量格式，便于直接送入模型
-        )
-        inputs = inputs.to(config.DEVICE)
+        inputs = prepare_vqa_inputs(items)
 
-        # 4. 推理 - 使用更保守的参数
+        # 推理 - 使用更保守的参数
         # 使用VQA模型进行推理：
         # 1. torch.no_grad()上下文可关闭梯度计算，节省显存和加速推理。
         # 2. vqa_model.generate方法根据输入内容（图片+问题）生成答案的token序列。
         # 3. config.VQA_GENERATION_CONFIG可控制生成长度、采样方式等参数。
-        with torch.no_grad():
+        # vqa_generate_lock：同一模型上的 generate 串行执行（Qwen2.5-VL 在模型上保存 rope_deltas 等状态）
+        with vqa_generate_lock, torch.no_grad():
+            start = time.perf_counter()
             generated_ids = vqa_model.generate(
-                **inputs, 
+                **inputs,
                 **config.VQA_GENERATION_CONFIG
             )
+            record_generation(generated_ids, inputs.input_ids.shape[1], time.perf_counter() - start)
 
-        # 5. 解码 (去掉输入的 token)
-        generated_ids_trimmed = [
-            out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-        ]
-        output_text = vqa_processor.batch_decode(
-            generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
-        )[0]
+        # 解码 (去掉输入的 token；左填充时批内输入长度一致)
+        with stage_latency.time(stage="vqa_decode"):
+            generated_ids_trimmed = [
+                out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+            ]
+            output_texts = vqa_processor.batch_decode(
+                generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+            )
 
-        logger.info(f"VQA Answer: {output_text}")
-        
         # 清理显存
         del inputs, generated_ids, generated_ids_trimmed
+        return output_texts
+    finally:
+        torch.cuda.empty_cache()
+
+def record_generation(sequences, prompt_length, seconds):
+    """记录一次 generate 的耗时、生成 token 数（不计填充）和生成速度"""
+    stage_latency.observe(seconds, stage="vqa_generate")
+    new_tokens = sequences[:, prompt_length:]
+    pad_token_id = vqa_processor.tokenizer.pad_token_id
+    count = int((new_tokens != pad_token_id).sum()) if pad_token_id is not None else new_tokens.numel()
+    vqa_generated_tokens.inc(count)
+    if count and seconds > 0:
+        vqa_tokens_per_second.observe(count / seconds)
+
+class StopOnEvent(StoppingCriteria):
+    """外部事件置位时提前结束生成（如流式请求的客户端已断开）"""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.event.is_set()
+
+def stream_vqa_answer(pil_image, question, pixel_budget, streamer, stop_event):
+    """流式 VQA 推理（在 VQA 线程池中执行）：生成的 token 逐个写入 streamer"""
+    try:
+        with vqa_component.use():
+            torch.cuda.empty_cache()
+            inputs = prepare_vqa_inputs([(pil_image, question, pixel_budget)])
+            with vqa_generate_lock, torch.no_grad():
+                start = time.perf_counter()
+                generated_ids = vqa_model.generate(
+                    **inputs,
+                    **config.VQA_GENERATION_CONFIG,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([StopOnEvent(stop_event)]),
+                )
+                record_generation(generated_ids, inputs.input_ids.shape[1], time.perf_counter() - start)
+            del inputs, generated_ids
+    finally:
+        # 无论成功与否都结束 streamer，避免消费端一直等待
+        streamer.end()
+        torch.cuda.empty_cache()
+
+def _cache_nbytes(obj):
+    """估算 KV cache / 张量集合占用的字节数（兼容不同版本 transformers 的 Cache 结构）"""
+    if torch.is_tensor(obj):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, dict):
+        return sum(_cache_nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(_cache_nbytes(v) for v in obj)
+    if hasattr(obj, "layers"):
+        return sum(_cache_nbytes(getattr(layer, "keys", None)) + _cache_nbytes(getattr(layer, "values", None))
+                   for layer in obj.layers)
+    if hasattr(obj, "key_cache"):
+        return _cache_nbytes(obj.key_cache) + _cache_nbytes(obj.value_cache)
+    return 0
+
+def _rope_deltas_holder():
+    """Qwen2.5-VL 的 rope_deltas 所在对象（新版 transformers 位于 vqa_model.model 上）"""
+    inner = getattr(vqa_model, "model", None)
+    return inner if inner is not None and hasattr(inner, "rope_deltas") else vqa_model
+
+def _common_prefix_length(a, b):
+    """两个一维 token 张量的公共前缀长度"""
+    n = min(a.shape[0], b.shape[0])
+    if n == 0:
+        return 0
+    mismatch = (a[:n] != b[:n]).nonzero()
+    return int(mismatch[0][0]) if len(mismatch) else n
+
+def _session_generate(session):
+    """
+    基于会话历史生成下一轮回答（调用方持有 session.lock）
+
+    首轮：完整预处理图片并预填充，保存视觉输入、KV cache 和 rope_deltas；
+    后续轮：只对新文本分词，KV cache 裁剪到与新 prompt 的公共前缀后继续预填充，
+    视觉编码器不再运行（缓存位置非 0 时 generate 会忽略 pixel_values）。
+
+    返回 (答案, 新的模型侧缓存, 复用的前缀 token 数)
+    """
+    text = vqa_processor.apply_chat_template(session.messages, tokenize=False, add_generation_prompt=True)
+    state = session.state
+    reused = 0
+    past = None
+
+    with vqa_generate_lock, torch.no_grad():
         torch.cuda.empty_cache()
+        if state is None:
+            image_inputs, video_inputs = process_vision_info(session.messages)
+            inputs = vqa_processor(
+                text=[text], images=image_inputs, videos=video_inputs, padding=True, return_tensors="pt"
+            ).to(config.DEVICE)
+            vision = {"pixel_values": inputs["pixel_values"], "image_grid_thw": inputs["image_grid_thw"]}
+            merge_size = getattr(vqa_processor.image_processor, "merge_size", 2)
+            num_image_tokens = int(inputs["image_grid_thw"].prod(dim=-1).sum()) // (merge_size ** 2)
+            input_ids = inputs["input_ids"]
+        else:
+            vision = state["vision"]
+            num_image_tokens = state["num_image_tokens"]
+            # 与 processor 相同的占位符展开，避免重复图片预处理
+            expanded = text.replace("<|image_pad|>", "<|image_pad|>" * num_image_tokens)
+            input_ids = vqa_processor.tokenizer(expanded, return_tensors="pt")["input_ids"].to(config.DEVICE)
+            past = state.get("past_key_values")
+            if past is not None:
+                cached_ids = state["token_ids"][:past.get_seq_length()]
+                # 至少保留一个新 token 用于预填充
+                reused = min(_common_prefix_length(cached_ids, input_ids[0]), input_ids.shape[1] - 1)
+                if reused > 0:
+                    past.crop(reused)
+                    _rope_deltas_holder().rope_deltas = state["rope_deltas"]
+                else:
+                    past = None
+
+        kwargs = dict(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            **vision,
+            **config.VQA_GENERATION_CONFIG,
+            return_dict_in_generate=True,
+        )
+        if past is not None:
+            kwargs["past_key_values"] = past
+        start = time.perf_counter()
+        outputs = vqa_model.generate(**kwargs)
+        record_generation(outputs.sequences, input_ids.shape[1], time.perf_counter() - start)
+
+    sequences = outputs.sequences
+    with stage_latency.time(stage="vqa_decode"):
+        answer = vqa_processor.batch_decode(
+            sequences[:, input_ids.shape[1]:], skip_special_tokens=True, clean_up_tokenization_spaces=False
+        )[0]
+
+    new_state = {"vision": vision, "num_image_tokens": num_image_tokens}
+    if config.VQA_SESSION_REUSE_KV and getattr(outputs, "past_key_values", None) is not None:
+        new_state.update(
+            past_key_values=outputs.past_key_values,
+            token_ids=sequences[0],
+            rope_deltas=_rope_deltas_holder().rope_deltas,
+        )
+    return answer, new_state, reused
+
+def ask_session(session, question):
+    """会话内提问（在 VQA 线程池中执行）：追加用户消息，生成回答并更新历史与缓存"""
+    with vqa_component.use(), session.lock:
+        if not session.messages:
+            session.messages.extend(build_vqa_messages(session.image, question, session.pixel_budget))
+        else:
+            session.messages.append({"role": "user", "content": [{"type": "text", "text": question}]})
+        try:
+            try:
+                answer, state, reused = _session_generate(session)
+            except Exception as e:
+                if session.state is None:
+                    raise
+                # 缓存与当前模型/版本不兼容时，回退为完整预填充
+                logger.warning(f"会话缓存复用失败，改为完整预填充: {e}")
+                session.release_state()
+                answer, state, reused = _session_generate(session)
+        except Exception:
+            session.messages.pop()
+            raise
+        finally:
+            torch.cuda.empty_cache()
+        session.messages.append({"role": "assistant", "content": [{"type": "text", "text": answer}]})
+        session.turns += 1
+        vqa_sessions.update_state(session, state, _cache_nbytes(state))
+        return answer, reused
+
+def run_vqa_batch(items):
+    """
+    微批处理入口：整批推理失败（如显存不足、个别图片异常）时逐条重试，
+    单个请求的失败以 Exception 形式返回，不影响同批其他请求
+    """
+    with vqa_component.use():
+        try:
+            return generate_vqa_answers(items)
+        except Exception as e:
+            if len(items) == 1:
+                return [e]
+            logger.warning(f"VQA 批量推理失败（{len(items)} 条），改为逐条推理: {e}")
+        results = []
+        for item in items:
+            try:
+                results.append(generate_vqa_answers([item])[0])
+            except Exception as e:
+                results.append(e)
+        return results
+
+def check_admin_token(token):
+    """管理接口鉴权：config.ADMIN_TOKEN 为空时不校验"""
+    if config.ADMIN_TOKEN and token != config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="管理口令无效")
+
+def load_image_library():
+    """
+    构建图片库并启动目录监控（图片库组件的加载函数）
+
+    启用 CLIP 预加载时先等待 CLIP 就绪；特征全部命中磁盘缓存时无需 CLIP 即可完成构建。
+    """
+    global library_watcher
+    if not clip_component.lazy:
+        clip_component.load()
+    build_image_library()
+    pregenerate_thumbnails(list(image_library.names))
+    if config.LIBRARY_WATCH_ENABLED and library_watcher is None:
+        library_watcher = LibraryWatcher(
+            config.IMAGE_LIBRARY_PATH,
+            config.VALID_IMAGE_EXTENSIONS,
+            config.LIBRARY_WATCH_INTERVAL,
+            rescan_library,
+        )
+        library_watcher.start()
 
-        return JSONResponse({"status": "success", "question": question, "answer": output_text})
+# ====================================
+# 组件加载状态（VQA 模型 / CLIP 模型 / 图片库）
+# ====================================
+vqa_component = ModelComponent(
+    "VQA 模型", load_vqa_model, unload_vqa_model,
+    lazy=config.VQA_LAZY_LOAD, idle_unload=config.VQA_IDLE_UNLOAD_SECONDS, retry_after=config.OVERLOAD_RETRY_AFTER,
+    retry_backoff=config.MODEL_RETRY_BACKOFF, retry_backoff_max=config.MODEL_RETRY_BACKOFF_MAX,
+)
+clip_component = ModelComponent(
+    "CLIP 模型", load_clip_model, unload_clip_model,
+    lazy=config.CLIP_LAZY_LOAD, idle_unload=config.CLIP_IDLE_UNLOAD_SECONDS, retry_after=config.OVERLOAD_RETRY_AFTER,
+    retry_backoff=config.MODEL_RETRY_BACKOFF, retry_backoff_max=config.MODEL_RETRY_BACKOFF_MAX,
+)
+# 图片库不经 use() 使用，加载失败后通过 /admin/components/library/reload 重新加载
+library_component = ModelComponent("图片库", load_image_library, retry_after=config.OVERLOAD_RETRY_AFTER,
+                                   auto_retry=False)
+components = {"vqa": vqa_component, "clip": clip_component, "library": library_component}
+started_at = time.time()
 
+@app.on_event("startup")
+async def startup_event():
+    """
+    启动阶段只创建调度器和后台加载线程，服务立即开始接受连接：
+    VQA 模型加载与 CLIP 加载 + 图片库构建并行进行，检索可以先于 VQA 上线
+    """
+    logger.info("系统初始化启动...")
+    global vqa_batcher, idle_unloader
+    if config.VQA_BATCHING_ENABLED:
+        vqa_batcher = MicroBatcher(
+            run_vqa_batch,
+            max_batch_size=config.VQA_MAX_BATCH_SIZE,
+            max_wait_ms=config.VQA_BATCH_MAX_WAIT_MS,
+            name="vqa-batcher",
+        )
+        vqa_batcher.start()
+    if not vqa_component.lazy:
+        vqa_component.load_in_background()
+    library_component.load_in_background()
+    idle_unloader = IdleUnloader(components.values(), config.MODEL_IDLE_CHECK_INTERVAL)
+    idle_unloader.start()
+    logger.info("✓ 服务已启动，模型与图片库在后台加载（就绪状态见 /health/ready）")
+
+def resolve_pixel_budget(quality=None, min_pixels=None, max_pixels=None):
+    """
+    计算本次请求的像素预算：先取质量档位的默认值，再用请求参数覆盖，
+    最后限制在全局范围 [VQA_MIN_PIXELS, VQA_MAX_PIXELS] 内
+    """
+    quality = quality or config.VQA_DEFAULT_QUALITY
+    if quality not in config.VQA_QUALITY_TIERS:
+        raise HTTPException(status_code=400, detail=f"quality 仅支持: {', '.join(config.VQA_QUALITY_TIERS)}")
+    tier = config.VQA_QUALITY_TIERS[quality]
+    lo = min(max(min_pixels or tier["min_pixels"], config.VQA_MIN_PIXELS), config.VQA_MAX_PIXELS)
+    hi = min(max(max_pixels or tier["max_pixels"], lo), config.VQA_MAX_PIXELS)
+    return {"min_pixels": lo, "max_pixels": hi}
+
+def count_visual_tokens(image, pixel_budget):
+    """按 Qwen2.5-VL 的缩放规则（边长取 28 的倍数并限制在像素预算内）估算视觉 token 数"""
+    height, width = smart_resize(
+        image.height, image.width, min_pixels=pixel_budget["min_pixels"], max_pixels=pixel_budget["max_pixels"]
+    )
+    # 每个视觉 token 对应 28x28 像素（14x14 patch 经 2x2 合并）
+    return (height // 28) * (width // 28)
+
+def decode_upload_image(image_bytes, pixel_budget=None):
+    """
+    解码上传的图片（在线程池中执行），按 EXIF 方向旋转；像素数超过 IMAGE_MAX_PIXELS 时抛出 ImageTooLarge
+
+    给出像素预算时：JPEG 在解码阶段直接缩小到预算附近（见 image_io.open_image），
+    解码后再快速缩小到预算以内，送入 processor 前无需在完整分辨率上重采样。
+    """
+    with stage_latency.time(stage="image_decode"):
+        image = open_image(
+            image_bytes,
+            max_pixels=pixel_budget["max_pixels"] if pixel_budget else None,
+            max_image_pixels=config.IMAGE_MAX_PIXELS,
+            backend=config.IMAGE_DECODE_BACKEND,
+        )
+        if pixel_budget:
+            image = fast_downscale(image, pixel_budget["max_pixels"])
+        return image
+
+def vqa_request_key(image_bytes, question, pixel_budget=None):
+    """
+    VQA 请求键（答案缓存与相同请求合并共用）：原始上传字节的 SHA256 + 归一化问题 + 像素预算 + 模型与生成参数
+
+    采样解码（do_sample=True）时答案不确定，返回 None 表示既不缓存也不合并。
+    """
+    if config.VQA_GENERATION_CONFIG.get("do_sample"):
+        return None
+    payload = {
+        "model": config.VQA_MODEL_ID,
+        "image": hashlib.sha256(image_bytes).hexdigest(),
+        "question": normalize_query(question),
+        "pixel_budget": pixel_budget,
+        "generation": config.VQA_GENERATION_CONFIG,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def vqa_cache_key(image_bytes, question, pixel_budget=None):
+    """VQA 答案缓存键：未启用答案缓存时返回 None"""
+    if not config.VQA_CACHE_ENABLED:
+        return None
+    return vqa_request_key(image_bytes, question, pixel_budget)
+
+async def coalesce(flights, key, fn):
+    """
+    合并相同的在途请求：同一 key 的并发请求只执行一次 fn()（异步函数），全部共享结果或异常
+
+    未启用合并或 key 为 None 时直接执行；合并的请求计入 coalesced_requests_total。
+    """
+    if not config.REQUEST_COALESCING_ENABLED:
+        key = None
+    result, shared = await flights.run(key, fn)
+    if shared:
+        coalesced_requests.inc(endpoint=flights.name)
+    return result
+
+def answer_question(pil_image, question, pixel_budget=None):
+    """单条 VQA 推理（未启用微批处理时在 VQA 线程池中执行）"""
+    output_text = run_vqa_batch([(pil_image, question, pixel_budget)])[0]
+    if isinstance(output_text, Exception):
+        raise output_text
+    return output_text
+
+def answer_questions(items):
+    """
+    批量 VQA 推理（在 VQA 线程池中执行）：items 为 [(PIL 图片, 问题, 像素预算)]，
+    按 VQA_MAX_BATCH_SIZE 分批填充后调用 generate，单项失败以 Exception 返回
+    """
+    results = []
+    step = max(1, config.VQA_MAX_BATCH_SIZE)
+    for start in range(0, len(items), step):
+        results.extend(run_vqa_batch(items[start:start + step]))
+    return results
+
+def prepare_batch_item(image_bytes, question, pixel_budget):
+    """
+    批量 VQA 的单项预处理（在线程池中执行）：查找答案缓存，未命中时解码图片
+
+    返回 (缓存键, 缓存的答案, 图片)；图片解码失败时第三项为 Exception。
+    """
+    cache_key = vqa_cache_key(image_bytes, question, pixel_budget)
+    cached = vqa_answer_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        return cache_key, cached, None
+    try:
+        return cache_key, None, decode_upload_image(image_bytes, pixel_budget)
+    except Exception as e:
+        return cache_key, None, ValueError(f"图片解码失败: {e}")
+
+def split_values(value):
+    """逗号分隔的参数值（兼容中文逗号）"""
+    return [v.strip() for v in (value or "").replace("，", ",").split(",") if v.strip()]
+
+def parse_timestamp(value, field):
+    """Unix 时间戳或 ISO 8601 时间（如 2024-05-01、2024-05-01T08:00:00，无时区时按服务器本地时间）"""
+    if value is None or not str(value).strip():
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(str(value).strip()).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{field} 需为 Unix 时间戳或 ISO 8601 时间")
+
+def parse_search_filter(library, category=None, tags=None, min_size=None, max_size=None,
+                        modified_after=None, modified_before=None):
+    """解析检索过滤参数，返回 MetadataIndex.select 的参数；未指定任何条件时返回 None"""
+    search_filter = {
+        "categories": split_values(category),
+        "tags": split_values(tags),
+        "min_size": min_size,
+        "max_size": max_size,
+        "modified_after": parse_timestamp(modified_after, "modified_after"),
+        "modified_before": parse_timestamp(modified_before, "modified_before"),
+    }
+    if not any(v not in (None, []) for v in search_filter.values()):
+        return None
+    if library.metadata is None:
+        raise HTTPException(status_code=400, detail="元数据索引未启用，不支持过滤检索")
+    return search_filter
+
+def select_rows(library, search_filter):
+    """过滤条件 -> 匹配的图片库行号（无过滤条件时返回 None）"""
+    if not search_filter:
+        return None
+    with stage_latency.time(stage="metadata_filter"):
+        return library.metadata.select(**search_filter)
+
+def search_images(library, text_query, top_k, exact=False, nprobe=None, inline_images=False,
+                  search_filter=None):
+    """文本编码 + 相似度检索 + 结果序列化（在 CLIP 线程池中执行）"""
+    # 过滤条件无匹配时无需编码文本
+    rows = select_rows(library, search_filter)
+    if rows is not None and rows.size == 0:
+        return []
+
+    # 文本编码（命中缓存时跳过模型）
+    text_features_np = encode_text_query(text_query)
+
+    # 计算相似度（一次矩阵-向量乘法，有过滤条件时只计算匹配的行）并用 argpartition 取 top_k
+    with stage_latency.time(stage="similarity_search"):
+        top_results = library.search(text_features_np, top_k, exact=exact, nprobe=nprobe, rows=rows)
+    return format_search_results(top_results, inline_images, library.aliases)
+
+def search_images_batch(library, text_queries, top_k, exact=False, nprobe=None, inline_images=False,
+                        search_filter=None):
+    """
+    批量文搜图（在 CLIP 线程池中执行）：一次 encode_text + 一次矩阵-矩阵乘法
+
+    返回与 text_queries 等长的列表，每项为结果列表或 Exception（仅该查询失败）。
+    过滤条件对全部查询生效。
+    """
+    valid = [i for i, text in enumerate(text_queries) if normalize_query(text)]
+    outputs = [ValueError("查询文本为空")] * len(text_queries)
+    if not valid:
+        return outputs
+    rows = select_rows(library, search_filter)
+    if rows is not None and rows.size == 0:
+        for i in valid:
+            outputs[i] = []
+        return outputs
+    vectors = encode_text_queries([text_queries[i] for i in valid])
+    with stage_latency.time(stage="similarity_search"):
+        top_results = library.search_batch(np.stack(vectors), top_k, exact=exact, nprobe=nprobe, rows=rows)
+    for i, results in zip(valid, top_results):
+        try:
+            outputs[i] = format_search_results(results, inline_images, library.aliases)
+        except Exception as e:
+            outputs[i] = e
+    return outputs
+
+def format_search_results(top_results, inline_images=False, aliases=None):
+    """将 [(文件名, 相似度)] 序列化为接口返回格式；aliases 为近重复折叠后的 代表图片 -> 重复图片"""
+    with stage_latency.time(stage="serialize"):
+        return _format_search_results(top_results, inline_images, aliases)
+
+def _format_search_results(top_results, inline_images, aliases):
+    def image_to_base64(image_path):
+        with open(image_path, "rb") as img_file:
+            return base64.b64encode(img_file.read()).decode('utf-8')
+
+    results = []
+    for img, score in top_results:
+        item = {
+            "image": img,
+            "image_id": img,
+            "score": score,
+            "thumbnail_url": f"/images/{quote(img)}",
+            "image_url": f"/images/{quote(img)}?size=original",
+        }
+        if aliases and img in aliases:
+            item["aliases"] = aliases[img]
+        if inline_images:
+            item["image_base64"] = image_to_base64(os.path.join(config.IMAGE_LIBRARY_PATH, img))
+        results.append(item)
+    return results
+
+@app.post("/vqa")
+async def visual_question_answering(
+    image: UploadFile = File(...),
+    question: str = Form(...),
+    quality: Optional[str] = Form(None),
+    min_pixels: Optional[int] = Form(None),
+    max_pixels: Optional[int] = Form(None),
+):
+    """
+    图文问答
+
+    quality（fast/balanced/detailed）及 min_pixels/max_pixels 控制图片缩放后的像素预算，
+    即视觉 token 数量；响应中的 visual_tokens 为本次实际使用的视觉 token 数。
+    """
+    try:
+        vqa_component.check()
+        pixel_budget = resolve_pixel_budget(quality, min_pixels, max_pixels)
+
+        # 1. 读取图片，按 (图片内容哈希, 问题, 像素预算, 生成参数) 查找答案缓存
+        with stage_latency.time(stage="upload_read"):
+            image_bytes = await image.read()
+        request_key = await run_in_threadpool(vqa_request_key, image_bytes, question, pixel_budget)
+        cache_key = request_key if config.VQA_CACHE_ENABLED else None
+        cached = vqa_answer_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            logger.info(f"VQA Cache Hit: {question}")
+            return JSONResponse({
+                "status": "success",
+                "question": question,
+                "answer": cached["answer"],
+                "visual_tokens": cached.get("visual_tokens"),
+                "cached": True,
+            })
+
+        async def infer():
+            # 准入控制：在途 VQA 请求达到上限时立即返回 503 + Retry-After
+            async with vqa_pool.admission():
+                # 解码并按像素预算快速缩小（放到线程池，避免阻塞事件循环）
+                pil_image = await run_in_threadpool(decode_upload_image, image_bytes, pixel_budget)
+                visual_tokens = count_visual_tokens(pil_image, pixel_budget)
+
+                logger.info(f"VQA Request: {question} (视觉 token: {visual_tokens})")
+
+                # 2. 推理：启用动态批处理时与其他并发请求合并为一个批次
+                if vqa_batcher is not None:
+                    output_text = await asyncio.wrap_future(vqa_batcher.submit((pil_image, question, pixel_budget)))
+                else:
+                    output_text = await vqa_pool.execute(answer_question, pil_image, question, pixel_budget)
+
+            logger.info(f"VQA Answer: {output_text}")
+            if cache_key:
+                vqa_answer_cache.put(cache_key, {"answer": output_text, "visual_tokens": visual_tokens})
+            return output_text, visual_tokens
+
+        # 3. 相同的在途请求（同一图片 + 问题 + 像素预算）只解码、推理一次，共享答案或错误
+        output_text, visual_tokens = await coalesce(vqa_flights, request_key, infer)
+
+        return JSONResponse({
+            "status": "success",
+            "question": question,
+            "answer": output_text,
+            "visual_tokens": visual_tokens,
+            "cached": False,
+        })
+
+    except HTTPException:
+        raise
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"VQA Error: {str(e)}")
-        # 清理显存
-        torch.cuda.empty_cache()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/text2image_search")
-async def text_to_image_search(text_query: str = Form(...), top_k: int = Form(5)):
-    """文本搜索图片 - 接受 text_query 参数以匹配客户端"""
+@app.post("/vqa/batch")
+async def visual_question_answering_batch(
+    images: List[UploadFile] = File(...),
+    questions: List[str] = Form(...),
+    quality: Optional[str] = Form(None),
+    min_pixels: Optional[int] = Form(None),
+    max_pixels: Optional[int] = Form(None),
+):
+    """
+    批量图文问答：N 个 (图片, 问题) 对在一次请求中完成，按 VQA_MAX_BATCH_SIZE 分批填充后生成
+
+    questions 只有一个时所有图片使用同一问题。results 与输入一一对应，
+    单项失败（如图片无法解码）只在该项返回 status=error，不影响其他项。
+    """
+    if len(questions) == 1:
+        questions = questions * len(images)
+    if len(questions) != len(images):
+        raise HTTPException(status_code=400, detail=f"图片数 {len(images)} 与问题数 {len(questions)} 不一致")
+    if len(images) > config.VQA_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次最多 {config.VQA_BATCH_MAX_ITEMS} 项")
+    vqa_component.check()
+    pixel_budget = resolve_pixel_budget(quality, min_pixels, max_pixels)
+
     try:
-        if not image_library:
-            raise HTTPException(status_code=400, detail="图片库为空")
+        start = time.perf_counter()
+        # 1. 并行计算缓存键、查找缓存并解码未命中的图片
+        with stage_latency.time(stage="upload_read"):
+            uploads = [await image.read() for image in images]
+        prepared = await asyncio.gather(*[
+            run_in_threadpool(prepare_batch_item, image_bytes, question, pixel_budget)
+            for image_bytes, question in zip(uploads, questions)
+        ])
+
+        results = [None] * len(images)
+        pending = []
+        for i, (question, (cache_key, cached, pil_image)) in enumerate(zip(questions, prepared)):
+            if cached is not None:
+                results[i] = {
+                    "status": "success",
+                    "question": question,
+                    "answer": cached["answer"],
+                    "visual_tokens": cached.get("visual_tokens"),
+                    "cached": True,
+                }
+            elif isinstance(pil_image, Exception):
+                results[i] = {"status": "error", "question": question, "detail": str(pil_image)}
+            else:
+                pending.append((i, cache_key, pil_image))
+
+        # 2. 未命中缓存的项作为一个请求占用一个准入名额，分批生成
+        if pending:
+            logger.info(f"VQA Batch Request: {len(pending)} 项待推理，{len(images) - len(pending)} 项命中缓存或失败")
+            async with vqa_pool.admission():
+                answers = await vqa_pool.execute(
+                    answer_questions, [(pil_image, questions[i], pixel_budget) for i, _, pil_image in pending]
+                )
+            for (i, cache_key, pil_image), answer in zip(pending, answers):
+                if isinstance(answer, Exception):
+                    results[i] = {"status": "error", "question": questions[i], "detail": str(answer)}
+                    continue
+                visual_tokens = count_visual_tokens(pil_image, pixel_budget)
+                if cache_key:
+                    vqa_answer_cache.put(cache_key, {"answer": answer, "visual_tokens": visual_tokens})
+                results[i] = {
+                    "status": "success",
+                    "question": questions[i],
+                    "answer": answer,
+                    "visual_tokens": visual_tokens,
+                    "cached": False,
+                }
+
+        failed = sum(1 for r in results if r["status"] != "success")
+        logger.info(f"VQA Batch: {len(results)} 项，失败 {failed} 项，耗时 {time.perf_counter() - start:.2f}s")
+        return JSONResponse({"status": "success", "results": results, "failed": failed})
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"VQA Batch Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        logger.info(f"Search Request: {text_query}, top_k={top_k}")
+@app.post("/vqa/stream")
+async def visual_question_answering_stream(
+    image: UploadFile = File(...),
+    question: str = Form(...),
+    quality: Optional[str] = Form(None),
+    min_pixels: Optional[int] = Form(None),
+    max_pixels: Optional[int] = Form(None),
+):
+    """
+    流式 VQA：以 SSE（text/event-stream）逐段返回生成的文本
 
-        # 文本编码 - 使用 ModelScope CLIP 的 encode_text 方法
-        text_tokens = clip_tokenizer(text_query, return_tensors="pt", padding=True, truncation=True)
-        # 将 input_ids 移到 GPU (encode_text 只需要 input_ids)
-        input_ids = text_tokens['input_ids'].to(config.DEVICE)
+    事件格式：
+        data: {"token": "..."}                                   生成的增量文本
+        event: done / data: {"answer", "ttft_ms", "total_ms", "visual_tokens"}    生成结束
+        event: error / data: {"detail": "..."}                   推理失败
+    """
+    start = time.perf_counter()
 
-        with torch.no_grad():
-            text_features = clip_model.clip_model.encode_text(input_ids)
-            # 归一化
-            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+    def sse(data, event=None):
+        payload = json.dumps(data, ensure_ascii=False)
+        return (f"event: {event}\n" if event else "") + f"data: {payload}\n\n"
 
-        text_features_np = text_features.cpu().numpy()
+    vqa_component.check()
+    pixel_budget = resolve_pixel_budget(quality, min_pixels, max_pixels)
+    with stage_latency.time(stage="upload_read"):
+        image_bytes = await image.read()
+    cache_key = await run_in_threadpool(vqa_cache_key, image_bytes, question, pixel_budget)
+    cached = vqa_answer_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        logger.info(f"VQA Cache Hit: {question}")
 
-        # 计算相似度
-        similarities = {}
-        for img_file, img_features in image_library.items():
-            similarity = np.dot(text_features_np[0], img_features[0])
-            similarities[img_file] = float(similarity)
+        async def cached_stream():
+            elapsed = round((time.perf_counter() - start) * 1000, 1)
+            yield sse({"token": cached["answer"]})
+            yield sse({
+                "answer": cached["answer"],
+                "ttft_ms": elapsed,
+                "total_ms": elapsed,
+                "visual_tokens": cached.get("visual_tokens"),
+                "cached": True,
+            }, event="done")
 
-        # 排序并取 top_k
-        top_results = sorted(similarities.items(), key=lambda x: x[1], reverse=True)[:top_k]
+        return StreamingResponse(cached_stream(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-        logger.info(f"Search Results: {len(top_results)} images found")
-        import base64
+    # 准入检查在返回响应前完成，过载时仍能返回 503；准入名额在流结束时释放，
+    # 客户端在流开始前断开（生成器未启动、finally 不会执行）时由响应的后台任务释放
+    release_admission = vqa_pool.reserve()
+    try:
+        pil_image = await run_in_threadpool(decode_upload_image, image_bytes, pixel_budget)
+    except Exception as e:
+        release_admission()
+        logger.error(f"VQA Stream Error: {str(e)}")
+        raise HTTPException(status_code=413 if isinstance(e, ImageTooLarge) else 400, detail=f"图片解码失败: {e}")
+    visual_tokens = count_visual_tokens(pil_image, pixel_budget)
 
-        def image_to_base64(image_path):
-            with open(image_path, "rb") as img_file:
-                return base64.b64encode(img_file.read()).decode('utf-8')
+    logger.info(f"VQA Stream Request: {question} (视觉 token: {visual_tokens})")
+
+    async def event_stream():
+        loop = asyncio.get_running_loop()
+        streamer = TextIteratorStreamer(
+            vqa_processor.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True,
+            timeout=config.VQA_STREAM_TOKEN_TIMEOUT,
+        )
+        stop_event = threading.Event()
+        generation = asyncio.ensure_future(
+            vqa_pool.execute(stream_vqa_answer, pil_image, question, pixel_budget, streamer, stop_event)
+        )
+        chunks, ttft = [], None
+        try:
+            iterator = iter(streamer)
+            while True:
+                # streamer 的迭代是阻塞的，放到默认线程池中等待下一段文本
+                chunk = await loop.run_in_executor(None, next, iterator, None)
+                if chunk is None:
+                    break
+                if not chunk:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                chunks.append(chunk)
+                yield sse({"token": chunk})
+            await generation
+            answer = "".join(chunks)
+            total = time.perf_counter() - start
+            logger.info(f"VQA Stream Answer: {answer} (首 token {ttft or 0:.2f}s, 总耗时 {total:.2f}s)")
+            # 客户端中途断开时生成被提前终止，不会走到这里，因此不会缓存不完整的答案
+            if cache_key:
+                vqa_answer_cache.put(cache_key, {"answer": answer, "visual_tokens": visual_tokens})
+            yield sse({
+                "answer": answer,
+                "ttft_ms": round((ttft or total) * 1000, 1),
+                "total_ms": round(total * 1000, 1),
+                "visual_tokens": visual_tokens,
+                "cached": False,
+            }, event="done")
+        except Exception as e:
+            logger.error(f"VQA Stream Error: {str(e)}")
+            yield sse({"detail": str(e)}, event="error")
+        finally:
+            # 客户端断开或出错时通知生成线程尽快结束
+            stop_event.set()
+            release_admission()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release_admission),
+    )
+
+@app.post("/vqa/sessions")
+async def create_vqa_session(
+    image: UploadFile = File(...),
+    question: Optional[str] = Form(None),
+    quality: Optional[str] = Form(None),
+    min_pixels: Optional[int] = Form(None),
+    max_pixels: Optional[int] = Form(None),
+):
+    """创建多轮问答会话：图片只上传一次；可同时携带第一个问题。像素预算在会话内固定"""
+    vqa_component.check()
+    pixel_budget = resolve_pixel_budget(quality, min_pixels, max_pixels)
+    try:
+        with stage_latency.time(stage="upload_read"):
+            image_bytes = await image.read()
+        pil_image = await run_in_threadpool(decode_upload_image, image_bytes, pixel_budget)
+    except Exception as e:
+        raise HTTPException(status_code=413 if isinstance(e, ImageTooLarge) else 400, detail=f"图片解码失败: {e}")
+
+    session = vqa_sessions.create(pil_image, pixel_budget)
+    result = {
+        "status": "success",
+        "session_id": session.session_id,
+        "ttl": config.VQA_SESSION_TTL,
+        "visual_tokens": count_visual_tokens(pil_image, pixel_budget),
+    }
+    if question:
+        try:
+            async with vqa_pool.admission():
+                answer, _ = await vqa_pool.execute(ask_session, session, question)
+        except HTTPException:
+            vqa_sessions.delete(session.session_id)
+            raise
+        except Exception as e:
+            vqa_sessions.delete(session.session_id)
+            logger.error(f"VQA Session Error: {str(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
+        result.update(question=question, answer=answer, turn=session.turns)
+    return JSONResponse(result)
+
+@app.post("/vqa/sessions/{session_id}/ask")
+async def ask_vqa_session(session_id: str, question: str = Form(...)):
+    """会话内追问：复用已编码的图片和对话前缀的 KV cache，延迟接近纯解码时间"""
+    session = vqa_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="会话不存在或已过期")
+    vqa_component.check()
+    try:
+        start = time.perf_counter()
+        async with vqa_pool.admission():
+            answer, reused = await vqa_pool.execute(ask_session, session, question)
+        logger.info(f"VQA Session {session_id[:8]} 第 {session.turns} 轮: 复用前缀 {reused} tokens, 耗时 {time.perf_counter() - start:.2f}s")
+        return JSONResponse({
+            "status": "success",
+            "session_id": session_id,
+            "question": question,
+            "answer": answer,
+            "turn": session.turns,
+            "reused_prefix_tokens": reused,
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"VQA Session Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/vqa/sessions/{session_id}")
+async def get_vqa_session(session_id: str):
+    """查看会话的对话历史"""
+    session = vqa_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="会话不存在或已过期")
+    history = []
+    for message in session.messages:
+        texts = [c["text"] for c in message["content"] if c.get("type") == "text"]
+        history.append({"role": message["role"], "text": "".join(texts)})
+    return {"session_id": session_id, "turns": session.turns, "history": history}
+
+@app.delete("/vqa/sessions/{session_id}")
+async def delete_vqa_session(session_id: str):
+    """结束会话并释放缓存"""
+    if not vqa_sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="会话不存在或已过期")
+    return {"status": "success", "session_id": session_id}
+
+@app.post("/text2image_search")
+async def text_to_image_search(
+    text_query: str = Form(...),
+    top_k: int = Form(5),
+    exact: bool = Form(False),
+    nprobe: Optional[int] = Form(None),
+    inline_images: bool = Form(False),
+    category: Optional[str] = Form(None),
+    tags: Optional[str] = Form(None),
+    min_size: Optional[int] = Form(None),
+    max_size: Optional[int] = Form(None),
+    modified_after: Optional[str] = Form(None),
+    modified_before: Optional[str] = Form(None),
+):
+    """
+    文本搜索图片 - 接受 text_query 参数以匹配客户端
+
+    exact/nprobe 用于控制 IVF 近似检索；结果默认只返回图片 id 和 /images 地址，
+    inline_images=True 时额外内嵌原图 base64（兼容旧客户端）。
+    过滤条件：category（逗号分隔，任一匹配）、tags（逗号分隔，需全部包含）、
+    min_size/max_size（字节）、modified_after/modified_before（Unix 时间戳或 ISO 8601）；
+    指定过滤条件时只对匹配的图片精确打分。
+    """
+    try:
+        # 取当前索引的引用，增量更新替换全局索引不影响本次检索
+        library_component.check()
+        clip_component.check()
+        library = image_library
+        if not library:
+            raise HTTPException(status_code=400, detail="图片库为空")
+
+        search_filter = parse_search_filter(library, category, tags, min_size, max_size,
+                                            modified_after, modified_before)
+
+        logger.info(f"Search Request: {text_query}, top_k={top_k}, filter={search_filter}")
+
+        # 相同的在途检索只计算一次；键包含图片库版本，增量更新后的请求不会共享旧索引的结果
+        flight_key = (
+            id(library), normalize_query(text_query), top_k, exact, nprobe, inline_images,
+            json.dumps(search_filter, sort_keys=True),
+        )
+        results = await coalesce(search_flights, flight_key, lambda: clip_pool.run(
+            search_images, library, text_query, top_k, exact, nprobe, inline_images, search_filter
+        ))
+
+        logger.info(f"Search Results: {len(results)} images found")
 
         return JSONResponse({
             "status": "success",
             "query": text_query,
-            "results": [
-                    {
-                        "image": img,
-                        "score": score,
-                        "image_base64": image_to_base64(os.path.join(config.IMAGE_LIBRARY_PATH, img))
-                    }
-                    for img, score in top_results
-                ]
+            "results": results,
         })
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Search Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/text2image_search/batch")
+async def text_to_image_search_batch(
+    text_queries: List[str] = Form(...),
+    top_k: int = Form(5),
+    exact: bool = Form(False),
+    nprobe: Optional[int] = Form(None),
+    inline_images: bool = Form(False),
+    category: Optional[str] = Form(None),
+    tags: Optional[str] = Form(None),
+    min_size: Optional[int] = Form(None),
+    max_size: Optional[int] = Form(None),
+    modified_after: Optional[str] = Form(None),
+    modified_before: Optional[str] = Form(None),
+):
+    """
+    批量文本搜图：所有查询一次 encode_text，并用一次矩阵-矩阵乘法与图片库打分
+
+    results 与 text_queries 一一对应，单条查询失败（如空查询）只在该项返回 status=error；
+    过滤条件同 /text2image_search，对全部查询生效。
+    """
+    if len(text_queries) > config.SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"单次最多 {config.SEARCH_BATCH_MAX_QUERIES} 条查询")
+    try:
+        library_component.check()
+        clip_component.check()
+        library = image_library
+        if not library:
+            raise HTTPException(status_code=400, detail="图片库为空")
+
+        search_filter = parse_search_filter(library, category, tags, min_size, max_size,
+                                            modified_after, modified_before)
+
+        logger.info(f"Batch Search Request: {len(text_queries)} 条查询, top_k={top_k}, filter={search_filter}")
+
+        outputs = await clip_pool.run(
+            search_images_batch, library, text_queries, top_k, exact, nprobe, inline_images, search_filter
+        )
+        results = []
+        for query, output in zip(text_queries, outputs):
+            if isinstance(output, Exception):
+                results.append({"status": "error", "query": query, "detail": str(output)})
+            else:
+                results.append({"status": "success", "query": query, "results": output})
+
+        failed = sum(1 for r in results if r["status"] != "success")
+        return JSONResponse({"status": "success", "results": results, "failed": failed})
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch Search Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metadata/facets")
+async def metadata_facets():
+    """图片库的类别/标签及各自图片数，供客户端生成过滤选项"""
+    library_component.check()
+    metadata = image_library.metadata
+    if metadata is None:
+        raise HTTPException(status_code=400, detail="元数据索引未启用")
+    return {"status": "success", "image_library_size": len(metadata), **metadata.facets()}
+
+@app.get("/images/{image_name}")
+async def get_image(
+    image_name: str,
+    size: str = "thumb",
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    获取图片库图片：size=thumb 返回缓存的缩略图（默认），size=original 返回原图
+
+    响应带 ETag/Cache-Control，客户端重复请求时可通过 If-None-Match 得到 304。
+    """
+    name = os.path.basename(image_name)
+    if name not in image_library:
+        raise HTTPException(status_code=404, detail=f"图片不存在: {name}")
+    if size not in ("thumb", "original"):
+        raise HTTPException(status_code=400, detail="size 仅支持 thumb 或 original")
+
+    path = os.path.join(config.IMAGE_LIBRARY_PATH, name)
+    try:
+        version = image_version(name)
+    except OSError:
+        raise HTTPException(status_code=404, detail=f"图片不存在: {name}")
+    etag = thumbnail_cache.etag(version) if size == "thumb" else f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={config.IMAGE_CACHE_MAX_AGE}"}
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    if size == "original":
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    try:
+        data = await run_in_threadpool(thumbnail_cache.get, path, version)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.error(f"Thumbnail Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+@app.post("/admin/images")
+async def admin_add_images(
+    images: List[UploadFile] = File(...),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """
+    上传图片到图片库并增量加入索引（写文件和编码都在线程池中执行，不阻塞检索）
+
+    与图片库中已有文件同名的上传不会覆盖原图，在 errors 中报告；errors 均以上传的文件名为键。
+    """
+    check_admin_token(x_admin_token)
+    library_component.check()
+    saved, errors = await run_in_threadpool(save_library_uploads, images)
+    added = await run_in_threadpool(add_library_files, list(saved)) if saved else []
+    for name, filename in saved.items():
+        if name not in added:
+            errors[filename] = "图片编码失败"
+    return {"status": "success", "added": added, "errors": errors, "image_library_size": len(image_library)}
+
+@app.delete("/admin/images/{image_name}")
+async def admin_remove_image(image_name: str, delete_file: bool = True,
+                             x_admin_token: Optional[str] = Header(None)):
+    """从索引中移除图片（默认同时删除原图）"""
+    check_admin_token(x_admin_token)
+    library_component.check()
+    name = os.path.basename(image_name)
+    if name not in image_library:
+        raise HTTPException(status_code=404, detail=f"图片不存在: {name}")
+    removed = await run_in_threadpool(remove_library_files, [name], delete_file)
+    return {"status": "success", "removed": removed, "image_library_size": len(image_library)}
+
+@app.post("/admin/rescan")
+async def admin_rescan(x_admin_token: Optional[str] = Header(None)):
+    """重新扫描图片库目录，增量同步新增/变更/删除的文件"""
+    check_admin_token(x_admin_token)
+    library_component.check()
+    changes = await run_in_threadpool(rescan_library)
+    return {"status": "success", **changes, "image_library_size": len(image_library)}
+
+@app.post("/admin/components/{name}/reload")
+async def admin_reload_component(name: str, x_admin_token: Optional[str] = Header(None)):
+    """立即重新加载加载失败（或未加载）的组件，不等待失败退避结束"""
+    check_admin_token(x_admin_token)
+    component = components.get(name)
+    if component is None:
+        raise HTTPException(status_code=404, detail=f"未知组件: {name}，可选 {', '.join(components)}")
+    if component.state == LOADING:
+        raise HTTPException(status_code=409, detail=f"{component.name} 正在加载")
+    try:
+        await run_in_threadpool(component.load)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"{component.name} 加载失败: {e}")
+    return {"status": "success", "component": name, **component.stats()}
+
+metrics.gauge(
+    "queue_depth", "排队/在途请求数", lambda: {
+        ("vqa_batcher",): vqa_batcher.queue_depth if vqa_batcher is not None else 0,
+        ("vqa_pool",): vqa_pool.in_flight,
+        ("clip_pool",): clip_pool.in_flight,
+    }, ("queue",),
+)
+metrics.gauge(
+    "image_library_size", "图片库规模（total=全部图片，searchable=去重后参与检索）", lambda: {
+        ("total",): len(image_library),
+        ("searchable",): image_library.search_size,
+    }, ("kind",),
+)
+metrics.gauge("search_matrix_bytes", "检索矩阵常驻内存（字节）", lambda: image_library.memory_stats()["search_matrix_bytes"])
+metrics.gauge(
+    "cache_hit_ratio", "缓存命中率", lambda: {
+        ("text_embedding",): text_embedding_cache.hit_ratio,
+        ("vqa_answer",): vqa_answer_cache.hit_ratio,
+    }, ("cache",),
+)
+metrics.gauge(
+    "coalescing_in_flight", "正在执行、可被相同请求合并的计算数", lambda: {
+        (search_flights.name,): search_flights.in_flight,
+        (vqa_flights.name,): vqa_flights.in_flight,
+    }, ("endpoint",),
+)
+metrics.gauge("vqa_sessions_active", "活跃的多轮 VQA 会话数", lambda: len(vqa_sessions))
+metrics.gauge(
+    "component_ready", "组件是否就绪（1=就绪）",
+    lambda: {(name,): int(c.state == READY) for name, c in components.items()}, ("component",),
+)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus 文本格式的监控指标"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def readiness():
+    """各功能是否可以处理请求：search 需要图片库就绪且 CLIP 可用，vqa 需要 VQA 模型可用"""
+    return {
+        "search": library_component.state == READY and clip_component.available,
+        "vqa": vqa_component.available,
+    }
+
+@app.get("/health/live")
+async def liveness_check():
+    """存活检查：进程和事件循环正常即返回 200，不反映模型是否加载完成"""
+    return {"status": "alive", "uptime_seconds": round(time.time() - started_at, 1)}
+
+@app.get("/health/ready")
+async def readiness_check(component: Optional[str] = None):
+    """
+    就绪检查：返回各组件的加载状态（loading/ready/failed/unloaded）和加载耗时
+
+    component=search 或 vqa 时只检查该功能，便于负载均衡按功能分别摘除；
+    未指定时所有功能都就绪才返回 200，否则返回 503。
+    """
+    ready = readiness()
+    if component is not None and component not in ready:
+        raise HTTPException(status_code=400, detail=f"component 仅支持: {', '.join(ready)}")
+    is_ready = ready[component] if component else all(ready.values())
+    body = {
+        "status": "ready" if is_ready else "not_ready",
+        "ready": ready,
+        "components": {name: c.stats() for name, c in components.items()},
+    }
+    return JSONResponse(body, status_code=200 if is_ready else 503)
+
 @app.get("/health")
 async def health_check():
-    """检查服务状态"""
+    """检查服务状态（详细信息）；负载均衡探测请使用 /health/live 和 /health/ready"""
+    states = [c.state for c in components.values()]
+    if FAILED in states:
+        status = "degraded"
+    elif LOADING in states:
+        status = "starting"
+    else:
+        status = "healthy"
     health_info = {
-        "status": "healthy",
+        "status": status,
+        "ready": readiness(),
+        "components": {name: c.stats() for name, c in components.items()},
         "vqa_model_loaded": vqa_model is not None,
         "clip_model_loaded": clip_model is not None,
         "image_library_size": len(image_library),
-        "device": config.DEVICE
+        "image_library_searchable": image_library.search_size,
+        "search_index": image_library.memory_stats(),
+        "device": config.DEVICE,
+        "text_embedding_cache": text_embedding_cache.stats(),
+        "vqa_answer_cache": vqa_answer_cache.stats(),
+        "vqa_sessions": vqa_sessions.stats(),
+        "vqa_pixel_budget": {
+            "default_quality": config.VQA_DEFAULT_QUALITY,
+            "min_pixels": config.VQA_MIN_PIXELS,
+            "max_pixels": config.VQA_MAX_PIXELS,
+            "tiers": config.VQA_QUALITY_TIERS,
+        },
+    }
+    if vqa_cpu_profile is not None:
+        health_info["vqa_cpu_profile"] = vqa_cpu_profile
+    health_info["inference_pools"] = {"vqa": vqa_pool.stats(), "clip": clip_pool.stats()}
+    health_info["request_coalescing"] = {
+        "enabled": config.REQUEST_COALESCING_ENABLED,
+        "text2image_search": search_flights.stats(),
+        "vqa": vqa_flights.stats(),
     }
+    if vqa_batcher is not None:
+        health_info["vqa_batcher"] = vqa_batcher.stats()
     
     if torch.cuda.is_available():
         health_info["gpu_memory_allocated_gb"] = round(torch.cuda.memory_allocated(0) / 1024**3, 2)
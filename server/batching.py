@@ -0,0 +1,117 @@
+# ====================================
+# 动态微批处理调度器
+# ====================================
+# 功能：将并发到达的请求在短时间窗口内合并为一个批次，由单个工作线程统一处理
+# 用途：VQA 生成等适合批量推理的场景，提升加速器利用率和并发吞吐
+
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    动态微批处理
+
+    process_batch: 输入请求列表，返回等长的结果列表；单个结果可以是 Exception 实例，
+                   表示仅该请求失败。process_batch 整体抛出异常时，该批次全部失败。
+    max_batch_size: 单批最大请求数
+    max_wait_ms: 收到第一个请求后最多等待多久凑批
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], max_batch_size: int = 4,
+                 max_wait_ms: float = 20, name: str = "batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self.batches = 0
+        self.items = 0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True, name=self.name)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, item: Any) -> Future:
+        """提交请求，返回 concurrent.futures.Future（asyncio 中可用 asyncio.wrap_future 等待）"""
+        if self._thread is None:
+            raise RuntimeError(f"{self.name} 未启动")
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def average_batch_size(self) -> float:
+        return self.items / self.batches if self.batches else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "batches": self.batches,
+            "items": self.items,
+            "average_batch_size": round(self.average_batch_size, 2),
+        }
+
+    def _collect(self, first) -> List:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                pending = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if pending is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(pending)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = self._collect(first)
+            # 已取消的请求（如客户端断开）不再处理
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = self.process_batch([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"批处理结果数量 {len(results)} 与请求数 {len(batch)} 不一致")
+            except Exception as e:
+                logger.error(f"{self.name} 批处理失败: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
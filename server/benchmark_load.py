@@ -0,0 +1,223 @@
+# ====================================
+# HTTP 并发压测
+# ====================================
+# 用途：对运行中的服务（真实模型或 stub_server.py 替身模型）发起并发请求，
+#       统计 /vqa 与 /text2image_search 的 p50/p95/p99 延迟、吞吐量和错误数
+# 输出：JSON，便于不同版本之间对比
+#
+# 用法：
+#   python benchmark_load.py --url http://127.0.0.1:8000 --endpoint vqa --endpoint search \
+#       --concurrency 8 --duration 30 --output load.json
+
+import io
+import sys
+import math
+import json
+import time
+import random
+import argparse
+import platform
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+
+import requests
+from PIL import Image
+
+QUESTIONS = ["图片中有什么？", "图片的主要颜色是什么？", "描述一下这张图片。", "图中有几个物体？"]
+QUERIES = ["一只猫", "城市夜景", "自行车", "海边的日落", "一只狗和一只猫", "相机", "山脉", "花朵"]
+
+
+def make_image(width=1024, height=768, seed=0):
+    """生成合成 JPEG 图片（随机色块放大），作为 VQA 请求的上传图片"""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (4, 3))
+    image.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(12)])
+    buffer = io.BytesIO()
+    image.resize((width, height), Image.BILINEAR).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def percentile(sorted_values, q):
+    """最近秩百分位（sorted_values 已升序）"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values), max(1, math.ceil(q / 100.0 * len(sorted_values)))) - 1
+    return sorted_values[index]
+
+
+class LoadTest:
+    """
+    固定并发的闭环压测：concurrency 个线程各自循环发送请求，直到达到 duration 秒或 total 个请求
+
+    unique_ratio 控制请求内容的重复程度（影响服务端缓存命中率），0 表示所有请求完全相同。
+    """
+
+    def __init__(self, url, endpoint, concurrency, duration, total=0, unique_ratio=1.0, timeout=120,
+                 top_k=10, image_size=(1024, 768)):
+        self.url = url.rstrip("/")
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.duration = duration
+        self.total = total
+        self.unique_ratio = unique_ratio
+        self.timeout = timeout
+        self.top_k = top_k
+        self.images = [make_image(*image_size, seed=i) for i in range(8)] if endpoint == "vqa" else []
+        self._lock = threading.Lock()
+        self._sent = 0
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = Counter()
+
+    def _next_request(self, rng, n):
+        """第 n 个请求的内容：unique_ratio 比例带唯一后缀，其余从固定集合中选取"""
+        unique = rng.random() < self.unique_ratio
+        suffix = f" #{n}" if unique else ""
+        if self.endpoint == "vqa":
+            files = {"image": ("bench.jpg", self.images[n % len(self.images)], "image/jpeg")}
+            data = {"question": rng.choice(QUESTIONS) + suffix}
+            return f"{self.url}/vqa", data, files
+        data = {"text_query": rng.choice(QUERIES) + suffix, "top_k": self.top_k}
+        return f"{self.url}/text2image_search", data, None
+
+    def _claim(self, deadline):
+        with self._lock:
+            if time.perf_counter() >= deadline or (self.total and self._sent >= self.total):
+                return None
+            self._sent += 1
+            return self._sent
+
+    def _worker(self, worker_id, deadline):
+        session = requests.Session()
+        rng = random.Random(worker_id)
+        while True:
+            n = self._claim(deadline)
+            if n is None:
+                break
+            url, data, files = self._next_request(rng, n)
+            start = time.perf_counter()
+            try:
+                response = session.post(url, data=data, files=files, timeout=self.timeout)
+                status = response.status_code
+                error = None if status == 200 else f"HTTP {status}"
+            except requests.RequestException as e:
+                status, error = 0, type(e).__name__
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.statuses[status] += 1
+                if error:
+                    self.errors[error] += 1
+                else:
+                    self.latencies.append(elapsed)
+
+    def run(self, warmup=0):
+        """执行压测，返回结果字典；warmup 个请求先串行发送且不计入统计"""
+        for i in range(warmup):
+            url, data, files = self._next_request(random.Random(-1 - i), -1 - i)
+            try:
+                requests.post(url, data=data, files=files, timeout=self.timeout)
+            except requests.RequestException:
+                pass
+
+        deadline = time.perf_counter() + (self.duration if self.duration else float("inf"))
+        threads = [threading.Thread(target=self._worker, args=(i, deadline), daemon=True)
+                   for i in range(self.concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+
+        latencies = sorted(self.latencies)
+        completed = len(latencies)
+        return {
+            "endpoint": self.endpoint,
+            "concurrency": self.concurrency,
+            "requests": sum(self.statuses.values()),
+            "succeeded": completed,
+            "errors": dict(self.errors),
+            "status_counts": {str(k): v for k, v in self.statuses.items()},
+            "duration_s": round(wall, 3),
+            "requests_per_second": round(completed / wall, 3) if wall > 0 else 0.0,
+            "latency_ms": {
+                "p50": _round(percentile(latencies, 50)),
+                "p95": _round(percentile(latencies, 95)),
+                "p99": _round(percentile(latencies, 99)),
+                "mean": _round(sum(latencies) / completed) if completed else None,
+                "max": _round(latencies[-1]) if latencies else None,
+            },
+        }
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP 并发压测（/vqa、/text2image_search）")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", action="append", choices=["vqa", "search"],
+                        help="压测的接口，可重复指定；默认两个都测")
+    parser.add_argument("--concurrency", type=int, action="append",
+                        help="并发数，可重复指定以测量多个并发等级；默认 1 和 8")
+    parser.add_argument("--duration", type=float, default=30, help="每轮压测时长（秒）")
+    parser.add_argument("--requests", type=int, default=0, help="每轮最多请求数，0=只按时长")
+    parser.add_argument("--warmup", type=int, default=3, help="每轮开始前的预热请求数")
+    parser.add_argument("--unique-ratio", type=float, default=1.0,
+                        help="带唯一内容的请求比例（1=全部不同，缓存不命中；0=全部相同）")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--wait-ready", type=float, default=300, help="等待服务就绪的最长时间（秒）")
+    parser.add_argument("--output", default="", help="结果 JSON 文件，留空则输出到标准输出")
+    args = parser.parse_args()
+
+    # 等待模型与图片库加载完成（服务启动后先接受连接，就绪前请求会返回 503）
+    deadline = time.time() + args.wait_ready
+    while True:
+        try:
+            if requests.get(f"{args.url}/health/ready", timeout=10).status_code == 200:
+                break
+        except requests.RequestException:
+            pass
+        if time.time() >= deadline:
+            print(f"服务 {args.url} 在 {args.wait_ready}s 内未就绪", file=sys.stderr)
+            sys.exit(1)
+        time.sleep(1)
+    server_info = requests.get(f"{args.url}/health", timeout=10).json()
+
+    report = {
+        "benchmark": "load",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "environment": {"python": sys.version.split()[0], "platform": platform.platform()},
+        "server": {
+            "url": args.url,
+            "status": server_info.get("status"),
+            "device": server_info.get("device"),
+            "image_library_size": server_info.get("image_library_size"),
+        },
+        "args": vars(args),
+        "runs": [],
+    }
+    for endpoint in args.endpoint or ["vqa", "search"]:
+        for concurrency in args.concurrency or [1, 8]:
+            print(f"{endpoint} 并发 {concurrency} ...", file=sys.stderr)
+            test = LoadTest(args.url, endpoint, concurrency, args.duration, total=args.requests,
+                            unique_ratio=args.unique_ratio, timeout=args.timeout, top_k=args.top_k)
+            result = test.run(warmup=args.warmup)
+            print(f"  {result['requests_per_second']} req/s, p50={result['latency_ms']['p50']}ms, "
+                  f"p99={result['latency_ms']['p99']}ms, 错误 {sum(result['errors'].values())}", file=sys.stderr)
+            report["runs"].append(result)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
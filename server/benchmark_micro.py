@@ -0,0 +1,338 @@
+# ====================================
+# 检索微基准测试
+# ====================================
+# 用途：在合成特征上测量特征缓存读写、内存索引构建、近重复检测、精确/批量/IVF 检索和结果序列化的耗时，
+#       以及 float16/int8 压缩检索矩阵的每张图片内存和相对 float32 的 recall@k、
+#       大图完整解码与缩放解码（CLIP 建库 / VQA 像素预算）的单张耗时和峰值内存、
+#       合成图片库经 indexing 流水线（替身 CLIP 编码）的完整构建耗时
+# 输出：JSON（含运行环境信息），便于不同版本之间对比
+#
+# 用法：
+#   python benchmark_micro.py --sizes 1000,100000,1000000 --output micro.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from datetime import datetime, timezone
+
+import numpy as np
+from PIL import Image
+
+from search_index import ImageLibrary
+from ann_index import IVFIndex, recall_at_k
+from dedup import find_duplicate_groups
+from embedding_store import EmbeddingStore
+from image_io import fast_downscale, open_image, turbojpeg_available
+
+
+def synthetic_embeddings(n, dim, seed=0, chunk=100000):
+    """分块生成行归一化的 float32 随机特征，避免一次性创建 float64 临时数组"""
+    rng = np.random.default_rng(seed)
+    matrix = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, chunk):
+        block = rng.standard_normal((min(chunk, n - start), dim), dtype=np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        matrix[start:start + len(block)] = block
+    return matrix
+
+
+def measure(fn, repeat=5, warmup=1):
+    """运行 fn 若干次，返回耗时统计（毫秒）"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples = np.array(samples)
+    return {
+        "repeat": repeat,
+        "mean_ms": round(float(samples.mean()), 4),
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p95_ms": round(float(np.percentile(samples, 95)), 4),
+        "min_ms": round(float(samples.min()), 4),
+    }
+
+
+def bench_size(n, args):
+    """单个图片库规模下的全部测量"""
+    results = {"n": n, "dim": args.dim}
+    embeddings = synthetic_embeddings(n, args.dim, seed=args.seed)
+    names = [f"img_{i:07d}.jpg" for i in range(n)]
+    queries = synthetic_embeddings(args.queries, args.dim, seed=args.seed + 1)
+
+    # 特征已编码时的各步骤：写入特征缓存、冷启动读取缓存、构建内存索引
+    # （包含解码与编码的完整构建见 bench_library_build）
+    with tempfile.TemporaryDirectory(prefix="multimodal-bench-") as cache_dir:
+        store = EmbeddingStore(cache_dir, {"model_id": "benchmark", "dim": args.dim})
+        entries = [{"sha1": f"{i:040x}", "size": 0, "mtime_ns": 0} for i in range(n)]
+        results["store_save"] = measure(lambda: store.save(names, entries, embeddings), repeat=1, warmup=0)
+        results["store_load"] = measure(store.load, repeat=3)
+    results["library_index"] = measure(lambda: ImageLibrary(names, embeddings), repeat=3)
+    library = ImageLibrary(names, embeddings)
+
+    query_iter = iter(range(10 ** 9))
+    results["search_exact"] = measure(
+        lambda: library.search(queries[next(query_iter) % len(queries)], args.top_k, exact=True),
+        repeat=args.repeat,
+    )
+    batch = queries[:args.batch_queries]
+    batch_stats = measure(lambda: library.search_batch(batch, args.top_k, exact=True), repeat=max(1, args.repeat // 10))
+    batch_stats["per_query_ms"] = round(batch_stats["mean_ms"] / len(batch), 4)
+    results["search_batch"] = batch_stats
+
+    if n >= args.ivf_min_size:
+        start = time.perf_counter()
+        index = IVFIndex.build(embeddings, nprobe=args.nprobe, iters=args.kmeans_iters)
+        results["ivf_build_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        library.ann_index = index
+        query_iter = iter(range(10 ** 9))
+        results["search_ivf"] = measure(
+            lambda: library.search(queries[next(query_iter) % len(queries)], args.top_k),
+            repeat=args.repeat,
+        )
+        results["ivf_recall_at_k"] = round(float(recall_at_k(index, embeddings, queries[:100], k=args.top_k)), 4)
+        library.ann_index = None
+
+    results["precision"] = bench_precision(names, embeddings, queries, args)
+
+    if n <= args.dedup_max_size:
+        start = time.perf_counter()
+        groups = find_duplicate_groups(embeddings, args.dedup_threshold)
+        results["dedup_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        results["dedup_groups"] = len(groups)
+    return results
+
+
+def bench_precision(names, embeddings, queries, args):
+    """各存储精度下的每张图片内存、检索耗时和 recall@k（以 float32 精确检索为基准，含/不含重排）"""
+    baseline = ImageLibrary(names, embeddings)
+    recall_queries = queries[:100]
+    expected = [{name for name, _ in baseline.search(q, args.top_k, exact=True)} for q in recall_queries]
+    results = {}
+    for precision in args.precisions.split(","):
+        for rerank_factor in ((0,) if precision == "float32" else (0, args.rerank_factor)):
+            library = ImageLibrary(names, embeddings, precision=precision, rerank_factor=rerank_factor)
+            hits = sum(len(exp & {name for name, _ in library.search(q, args.top_k, exact=True)})
+                       for exp, q in zip(expected, recall_queries))
+            query_iter = iter(range(10 ** 9))
+            stats = measure(
+                lambda: library.search(queries[next(query_iter) % len(queries)], args.top_k, exact=True),
+                repeat=args.repeat,
+            )
+            stats["bytes_per_image"] = library.memory_stats()["bytes_per_image"]
+            stats["recall_at_k"] = round(hits / (len(expected) * args.top_k), 4) if expected else 1.0
+            key = precision if not rerank_factor else f"{precision}+rerank{rerank_factor}"
+            results[key] = stats
+    return results
+
+
+def _decode(mode, path, args):
+    if mode == "full":
+        # 旧路径：完整解码后再缩放到 CLIP 输入尺寸
+        with Image.open(path) as image:
+            return image.convert("RGB").resize((224, 224), Image.BICUBIC)
+    if mode.startswith("clip_"):
+        return open_image(path, min_size=(224, 224), backend=mode[len("clip_"):])
+    with open(path, "rb") as f:
+        data = f.read()
+    image = open_image(data, max_pixels=args.decode_max_pixels, backend=mode[len("vqa_"):])
+    return fast_downscale(image, args.decode_max_pixels)
+
+
+def _decode_worker(mode, paths, args):
+    """在独立进程中解码，ru_maxrss 的增量即为单张解码的峰值内存"""
+    try:
+        import resource
+        # Linux 上单位为 KB，macOS 上为字节
+        unit = 1 if sys.platform == "darwin" else 1024
+        rss = lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+    except ImportError:
+        rss = None
+    _decode(mode, paths[0], args)  # 预热（加载解码库），不计入峰值
+    base = rss() if rss else 0
+    samples, decoded_size = [], None
+    for _ in range(args.decode_repeat):
+        for path in paths:
+            start = time.perf_counter()
+            decoded_size = _decode(mode, path, args).size
+            samples.append((time.perf_counter() - start) * 1000)
+    samples = np.array(samples)
+    return {
+        "mean_ms": round(float(samples.mean()), 3),
+        "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        "output_size": list(decoded_size),
+        "peak_rss_delta_mb": round((rss() - base) / 1024 ** 2, 2) if rss else None,
+    }
+
+
+def bench_decode(args):
+    """合成大尺寸 JPEG，比较完整解码与缩放解码（Pillow draft / libjpeg-turbo）"""
+    width, height = (int(v) for v in args.decode_size.split("x"))
+    with tempfile.TemporaryDirectory(prefix="multimodal-bench-") as workdir:
+        rng = np.random.default_rng(args.seed)
+        paths = []
+        for i in range(args.decode_images):
+            base = rng.integers(0, 256, size=(height // 64, width // 64, 3), dtype=np.uint8)
+            image = Image.fromarray(base).resize((width, height), Image.BICUBIC)
+            path = os.path.join(workdir, f"decode_{i}.jpg")
+            image.save(path, quality=90)
+            paths.append(path)
+
+        modes = ["full", "clip_pil", "vqa_pil"]
+        if turbojpeg_available():
+            modes += ["clip_turbojpeg", "vqa_turbojpeg"]
+        results = {
+            "source_size": [width, height],
+            "file_kb": round(sum(os.path.getsize(p) for p in paths) / len(paths) / 1024, 1),
+            "vqa_max_pixels": args.decode_max_pixels,
+        }
+        context = multiprocessing.get_context("spawn")
+        for mode in modes:
+            with context.Pool(1) as pool:
+                results[mode] = pool.apply(_decode_worker, (mode, paths, args))
+        return results
+
+
+def bench_library_build(args):
+    """
+    图片库完整构建：app.build_image_library 在合成图片库上运行，图片经 indexing 流水线
+    （工作线程解码 + 预处理，替身 CLIP 按批编码）写入特征缓存，再构建内存索引（近重复折叠、ANN、元数据）；
+    分别测量特征缓存为空的冷构建和缓存全部命中的重建
+
+    需要能导入 app 和 stub_models（服务端依赖已安装），否则记录为 skipped。
+    """
+    try:
+        import app as server
+        import stub_models
+    except Exception as e:
+        return {"skipped": f"无法导入 app: {e}"}
+
+    import config
+    from stub_server import generate_library
+    stub_models.install(server, clip_dim=args.dim, clip_latency_ms=args.build_clip_latency_ms)
+    saved = {key: getattr(config, key) for key in ("IMAGE_LIBRARY_PATH", "EMBEDDING_CACHE_DIR")}
+    results = {"images": args.build_images, "clip_latency_ms": args.build_clip_latency_ms}
+    with tempfile.TemporaryDirectory(prefix="multimodal-bench-") as workdir:
+        config.IMAGE_LIBRARY_PATH = os.path.join(workdir, "image_library")
+        config.EMBEDDING_CACHE_DIR = os.path.join(workdir, "index_cache")
+        try:
+            generate_library(config.IMAGE_LIBRARY_PATH, args.build_images, seed=args.seed)
+            # 流水线各阶段耗时（与冷构建的编码步骤相同）
+            _, stats = server.encode_image_files(server.list_library_files())
+            results["indexing"] = stats.as_dict()
+            results["cold_build"] = measure(server.build_image_library, repeat=1, warmup=0)
+            results["cached_rebuild"] = measure(server.build_image_library, repeat=3)
+            results["library_size"] = len(server.image_library)
+        finally:
+            for key, value in saved.items():
+                setattr(config, key, value)
+    return results
+
+
+def bench_serialization(args):
+    """
+    结果序列化：app.format_search_results + JSON 编码，分别测量只返回 URL 和内嵌 base64 两种方式
+
+    需要能导入 app（服务端依赖已安装），否则记录为 skipped。
+    """
+    try:
+        import app as server
+    except Exception as e:
+        return {"skipped": f"无法导入 app: {e}"}
+
+    import config
+    saved_library_path = config.IMAGE_LIBRARY_PATH
+    with tempfile.TemporaryDirectory(prefix="multimodal-bench-") as workdir:
+        config.IMAGE_LIBRARY_PATH = workdir
+        try:
+            names = []
+            for i in range(args.top_k):
+                name = f"img_{i}.jpg"
+                Image.new("RGB", (640, 480), (i * 20 % 256, 80, 160)).save(os.path.join(workdir, name), quality=90)
+                names.append(name)
+            top_results = [(name, 0.9 - i * 0.01) for i, name in enumerate(names)]
+
+            results = {"top_k": args.top_k}
+            for inline in (False, True):
+                key = "inline_base64" if inline else "urls_only"
+                payload = {}
+
+                def run():
+                    payload["body"] = json.dumps(server.format_search_results(top_results, inline_images=inline))
+
+                stats = measure(run, repeat=args.repeat)
+                stats["response_bytes"] = len(payload["body"])
+                results[key] = stats
+        finally:
+            config.IMAGE_LIBRARY_PATH = saved_library_path
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索微基准测试（合成特征）")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="图片库规模，逗号分隔")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=256)
+    parser.add_argument("--batch-queries", type=int, default=32)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--kmeans-iters", type=int, default=10)
+    parser.add_argument("--ivf-min-size", type=int, default=10000, help="规模不小于该值时测量 IVF")
+    parser.add_argument("--dedup-max-size", type=int, default=100000, help="规模不超过该值时测量近重复检测（O(N^2)）")
+    parser.add_argument("--dedup-threshold", type=float, default=0.97)
+    parser.add_argument("--precisions", default="float32,float16,int8", help="比较的检索矩阵存储精度")
+    parser.add_argument("--rerank-factor", type=int, default=4, help="压缩精度下重排的候选倍数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-serialization", action="store_true")
+    parser.add_argument("--skip-library-build", action="store_true")
+    parser.add_argument("--build-images", type=int, default=1000, help="完整构建测试的合成图片数")
+    parser.add_argument("--build-clip-latency-ms", type=float, default=0, help="替身 CLIP 每次编码调用的延迟")
+    parser.add_argument("--skip-decode", action="store_true")
+    parser.add_argument("--decode-size", default="4032x3024", help="解码测试的合成图片尺寸（宽x高）")
+    parser.add_argument("--decode-images", type=int, default=5)
+    parser.add_argument("--decode-repeat", type=int, default=3)
+    parser.add_argument("--decode-max-pixels", type=int, default=768 * 28 * 28, help="VQA 像素预算")
+    parser.add_argument("--output", default="", help="结果 JSON 文件，留空则输出到标准输出")
+    args = parser.parse_args()
+
+    report = {
+        "benchmark": "micro",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "args": vars(args),
+        "search": [],
+    }
+    for n in (int(s) for s in args.sizes.split(",") if s.strip()):
+        print(f"N={n} ...", file=sys.stderr)
+        report["search"].append(bench_size(n, args))
+    if not args.skip_decode:
+        report["decode"] = bench_decode(args)
+    if not args.skip_library_build:
+        report["library_build"] = bench_library_build(args)
+    if not args.skip_serialization:
+        report["serialization"] = bench_serialization(args)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
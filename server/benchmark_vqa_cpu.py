@@ -0,0 +1,130 @@
+# ====================================
+# VQA CPU 推理基准测试
+# ====================================
+# 用途：在无 GPU 节点上比较 VQA 普通加载路径（float32，不量化，默认线程）与 CPU 推理配置
+#       （int8 动态量化 + bf16 + 线程设置，见 cpu_inference.py）的加载耗时、权重内存、
+#       预填充耗时和生成速度（token/s），用于估算 CPU 节点数量
+# 需要真实模型权重（config.VQA_LOCAL_MODEL_PATH 或 ModelScope 缓存/下载）；两种模式依次加载，不同时占用内存
+# 输出：JSON（含运行环境信息），便于不同机型之间对比
+#
+# 用法：
+#   python benchmark_vqa_cpu.py --runs 5 --max-new-tokens 64 --output vqa_cpu.json
+
+import sys
+import json
+import time
+import argparse
+import platform
+from datetime import datetime, timezone
+
+import numpy as np
+import torch
+
+
+def summarize(samples):
+    """多次生成结果的中位数/均值"""
+    summary = {"runs": len(samples)}
+    for key in ("prompt_tokens", "new_tokens", "prefill_ms", "total_ms", "tokens_per_second", "decode_tokens_per_second"):
+        values = np.array([s[key] for s in samples if s[key] is not None], dtype=np.float64)
+        if values.size:
+            summary[key] = {"p50": round(float(np.median(values)), 2), "mean": round(float(values.mean()), 2)}
+    return summary
+
+
+def bench_mode(server, mode, args):
+    """加载一种模式的模型，预热后测量 args.runs 次生成，最后卸载"""
+    import config
+    from cpu_inference import measure_generation, model_nbytes, synthetic_image
+
+    config.VQA_CPU_PROFILE_ENABLED = mode == "profile"
+    start = time.perf_counter()
+    server.load_vqa_model()
+    load_seconds = time.perf_counter() - start
+    try:
+        width, height = (int(v) for v in args.image_size.split("x"))
+        budget = server.resolve_pixel_budget(args.quality)
+        generation = dict(config.VQA_GENERATION_CONFIG, max_new_tokens=args.max_new_tokens)
+        samples = []
+        for i in range(args.warmup + args.runs):
+            inputs = server.prepare_vqa_inputs([(synthetic_image(width, height, seed=i), args.question, budget)])
+            result = measure_generation(server.vqa_model, inputs, generation)
+            if i >= args.warmup:
+                samples.append(result)
+            print(f"  {mode} #{i + 1}: 预填充 {result['prefill_ms']}ms，"
+                  f"生成 {result['decode_tokens_per_second']} token/s", file=sys.stderr)
+        return {
+            "mode": mode,
+            "load_seconds": round(load_seconds, 1),
+            "weight_bytes": model_nbytes(server.vqa_model),
+            "profile": server.vqa_cpu_profile,
+            **summarize(samples),
+        }
+    finally:
+        server.unload_vqa_model()
+
+
+def _ratio(results, key):
+    """CPU 推理配置相对普通路径的倍数（按中位数）"""
+    try:
+        return round(results["profile"][key]["p50"] / results["plain"][key]["p50"], 2)
+    except (KeyError, TypeError, ZeroDivisionError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VQA CPU 推理基准测试（普通路径 vs CPU 推理配置）")
+    parser.add_argument("--modes", default="plain,profile", help="测试的模式，逗号分隔：plain / profile")
+    parser.add_argument("--runs", type=int, default=5, help="每种模式的测量次数")
+    parser.add_argument("--warmup", type=int, default=1, help="每种模式测量前的预热次数")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--quality", default=None, help="像素预算档位（fast/balanced/detailed），默认 config.VQA_DEFAULT_QUALITY")
+    parser.add_argument("--image-size", default="1024x768", help="合成图片尺寸（宽x高）")
+    parser.add_argument("--question", default="描述一下这张图片。")
+    parser.add_argument("--threads", type=int, default=0, help="PyTorch 算子内线程数，0=config.CPU_NUM_THREADS")
+    parser.add_argument("--output", default="", help="结果 JSON 文件，留空则输出到标准输出")
+    args = parser.parse_args()
+
+    import config
+    config.DEVICE = "cpu"
+    if args.threads:
+        config.CPU_NUM_THREADS = args.threads
+    import app as server
+
+    report = {
+        "benchmark": "vqa_cpu",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "torch": torch.__version__,
+            "threads": torch.get_num_threads(),
+        },
+        "model": config.VQA_MODEL_ID,
+        "args": vars(args),
+        "results": {},
+    }
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        if mode not in ("plain", "profile"):
+            parser.error(f"未知模式: {mode}")
+        print(f"{mode} ...", file=sys.stderr)
+        report["results"][mode] = bench_mode(server, mode, args)
+    if {"plain", "profile"} <= set(report["results"]):
+        prefill = _ratio(report["results"], "prefill_ms")
+        report["speedup"] = {
+            "decode_tokens_per_second": _ratio(report["results"], "decode_tokens_per_second"),
+            "tokens_per_second": _ratio(report["results"], "tokens_per_second"),
+            "prefill": round(1 / prefill, 2) if prefill else None,   # 预填充比较耗时，取倒数
+        }
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+# ====================================
+# 离线多进程建库（CPU）
+# ====================================
+# 用途：在多核无 GPU 的机器上为大规模图片库（百万级）离线编码 CLIP 特征，结果写入服务使用的特征缓存
+# 分片：按文件名哈希将待编码图片分到固定数量的分片，每个分片由进程池中的一个进程编码，
+#       写成独立的 shards/shard-XXXXX.npz（先写临时文件再原子替换）
+# 续跑：中断后重新运行，已完成分片中大小/mtime 未变的图片直接复用，只编码剩余图片；
+#       服务特征缓存中已有的图片不进入分片
+# 合并：全部分片完成后按文件名排序合并为 EmbeddingStore 格式（manifest + embeddings-*.npy），
+#       服务启动时直接命中缓存，无需重新编码
+#
+# 用法：
+#   python build_index.py --workers 8 --threads-per-worker 4
+#   python build_index.py --workers 8 --no-merge     # 只编码分片，稍后再合并
+
+import os
+import sys
+import json
+import time
+import zlib
+import logging
+import argparse
+import multiprocessing
+
+import numpy as np
+
+logger = logging.getLogger("build_index")
+
+PLAN_FILE = "plan.json"
+
+_server = None   # 工作进程中导入的 app 模块
+
+
+def shard_of(name, num_shards):
+    """文件名 -> 分片号（与文件顺序无关，图片库新增文件只影响其所在分片）"""
+    return zlib.crc32(name.encode("utf-8")) % num_shards
+
+
+def shard_path(shard_dir, shard_id):
+    return os.path.join(shard_dir, f"shard-{shard_id:05d}.npz")
+
+
+def read_shard(path, fingerprint):
+    """读取分片：返回 (文件名列表, manifest 条目列表, 特征矩阵)；不存在或模型指纹不匹配时返回 None"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["fingerprint"]) != fingerprint:
+                return None
+            names = [str(n) for n in data["names"]]
+            entries = [
+                {"sha1": str(sha1), "size": int(size), "mtime_ns": int(mtime_ns)}
+                for sha1, size, mtime_ns in zip(data["sha1"], data["size"], data["mtime_ns"])
+            ]
+            return names, entries, data["embeddings"]
+    except Exception as e:
+        logger.warning(f"读取分片失败 {os.path.basename(path)}: {e}")
+        return None
+
+
+def write_shard(path, fingerprint, names, entries, embeddings):
+    tmp_path = path + ".tmp.npz"
+    np.savez(
+        tmp_path,
+        fingerprint=np.array(fingerprint),
+        names=np.array(names, dtype=str),
+        sha1=np.array([e["sha1"] for e in entries], dtype=str),
+        size=np.array([e["size"] for e in entries], dtype=np.int64),
+        mtime_ns=np.array([e["mtime_ns"] for e in entries], dtype=np.int64),
+        embeddings=np.asarray(embeddings, dtype=np.float32),
+    )
+    os.replace(tmp_path, path)
+
+
+def _init_worker(threads, overrides):
+    """工作进程初始化：应用主进程的配置覆盖（spawn 子进程会重新导入 config），限制线程数，加载本进程的 CLIP 模型"""
+    global _server
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    import config
+    for key, value in overrides.items():
+        setattr(config, key, value)
+    import app as server
+    server.clip_component.load()
+    _server = server
+
+
+def _encode_shard(job):
+    """编码一个分片：复用旧分片中未变化的图片，其余图片编码后整体写回"""
+    from embedding_store import EmbeddingStore
+    import config
+
+    shard_id, names, path, fingerprint = job
+    start = time.perf_counter()
+    previous = read_shard(path, fingerprint)
+    reused = {}
+    if previous is not None:
+        for row, (name, entry) in enumerate(zip(previous[0], previous[1])):
+            reused[name] = (entry, row)
+
+    out_names, out_entries, out_vectors, to_encode = [], [], [], []
+    reused_count = 0
+    for name in names:
+        try:
+            stat = os.stat(os.path.join(config.IMAGE_LIBRARY_PATH, name))
+        except OSError:
+            continue
+        cached = reused.get(name)
+        if cached and cached[0]["size"] == stat.st_size and cached[0]["mtime_ns"] == stat.st_mtime_ns:
+            out_names.append(name)
+            out_entries.append(cached[0])
+            out_vectors.append(previous[2][cached[1]])
+            reused_count += 1
+        else:
+            to_encode.append(name)
+
+    features, _ = _server.encode_image_files(to_encode)
+    for name in to_encode:
+        if name not in features:
+            continue
+        try:
+            entry = EmbeddingStore.describe(os.path.join(config.IMAGE_LIBRARY_PATH, name))
+        except OSError:
+            continue
+        out_names.append(name)
+        out_entries.append(entry)
+        out_vectors.append(features[name])
+
+    embeddings = np.stack(out_vectors) if out_vectors else np.zeros((0, 0), dtype=np.float32)
+    write_shard(path, fingerprint, out_names, out_entries, embeddings)
+    return {
+        "shard": shard_id,
+        "images": len(out_names),
+        "reused": reused_count,
+        "encoded": len(out_names) - reused_count,
+        "failed": len(names) - len(out_names),
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+def load_plan(shard_dir, fingerprint, num_shards):
+    """分片数在续跑之间必须保持不变：沿用已有计划，模型指纹变化时重新规划"""
+    path = os.path.join(shard_dir, PLAN_FILE)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            plan = json.load(f)
+        if plan.get("fingerprint") == fingerprint:
+            return plan["num_shards"]
+    os.makedirs(shard_dir, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint, "num_shards": num_shards}, f)
+    return num_shards
+
+
+def merge(store, files, cached, shard_dir, num_shards, pending):
+    """将服务特征缓存中已有的图片与各分片合并，按文件名顺序写入 EmbeddingStore"""
+    sources = {}   # 文件名 -> ("cache", 行号, 条目) 或 ("shard", 分片号, 行号, 条目)
+    shards = {}
+    for name, row in cached.items():
+        sources[name] = ("cache", row, store.entries[name])
+    for shard_id in sorted({shard_of(n, num_shards) for n in pending}):
+        shard = read_shard(shard_path(shard_dir, shard_id), store.fingerprint)
+        if shard is None:
+            continue
+        shards[shard_id] = shard[2]
+        for row, (name, entry) in enumerate(zip(shard[0], shard[1])):
+            if name in pending:
+                sources[name] = ("shard", shard_id, row, entry)
+
+    names = [n for n in files if n in sources]
+    if not names:
+        logger.warning("没有可合并的图片特征")
+        return 0
+    dims = {store.embeddings.shape[1]} if cached else set()
+    dims.update(s.shape[1] for s in shards.values() if len(s))
+    if len(dims) != 1:
+        raise ValueError(f"特征维度不一致: {sorted(dims)}")
+
+    # 合并结果先写入磁盘上的临时矩阵，百万级图片库也不需要在内存中拼接
+    tmp_path = os.path.join(shard_dir, "merge.tmp.npy")
+    matrix = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(len(names), dims.pop()))
+    entries = []
+    for position, name in enumerate(names):
+        source = sources[name]
+        if source[0] == "cache":
+            matrix[position] = store.embeddings[source[1]]
+        else:
+            matrix[position] = shards[source[1]][source[2]]
+        entries.append(source[-1])
+    matrix.flush()
+    store.save(names, entries, matrix)
+    del matrix
+    os.remove(tmp_path)
+    return len(names)
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="离线多进程编码图片库特征（CPU）")
+    parser.add_argument("--library", default="", help="图片库目录，默认 config.IMAGE_LIBRARY_PATH")
+    parser.add_argument("--cache-dir", default="", help="特征缓存目录，默认 config.EMBEDDING_CACHE_DIR")
+    parser.add_argument("--shard-dir", default="", help="分片目录，默认 <特征缓存目录>/shards")
+    parser.add_argument("--workers", type=int, default=max(1, cpu_count // 4), help="编码进程数（每个进程一个 CLIP 实例）")
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="每个进程的 PyTorch 计算线程数，0=CPU 核数 / 进程数")
+    parser.add_argument("--decode-threads", type=int, default=2, help="每个进程的解码 + 预处理线程数")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--shard-size", type=int, default=5000, help="首次规划时每个分片的平均图片数")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--no-merge", action="store_true", help="只编码分片，不合并")
+    parser.add_argument("--keep-shards", action="store_true", help="合并后保留分片文件")
+    args = parser.parse_args()
+
+    threads = args.threads_per_worker or max(1, cpu_count // args.workers)
+    # 子进程（spawn）继承环境变量，在导入 torch 之前限制 OpenMP/MKL 线程数，避免进程间超额订阅
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+
+    import config
+    if args.library:
+        config.IMAGE_LIBRARY_PATH = args.library
+    if args.cache_dir:
+        config.EMBEDDING_CACHE_DIR = args.cache_dir
+        config.THUMBNAIL_CACHE_DIR = os.path.join(args.cache_dir, "thumbnails")
+    config.DEVICE = args.device
+    overrides = {
+        "IMAGE_LIBRARY_PATH": config.IMAGE_LIBRARY_PATH,
+        "EMBEDDING_CACHE_DIR": config.EMBEDDING_CACHE_DIR,
+        "THUMBNAIL_CACHE_DIR": config.THUMBNAIL_CACHE_DIR,
+        "DEVICE": config.DEVICE,
+        "INDEX_NUM_WORKERS": args.decode_threads,
+        "CLIP_BATCH_SIZE": args.batch_size,
+    }
+    shard_dir = args.shard_dir or os.path.join(config.EMBEDDING_CACHE_DIR, "shards")
+
+    import app as server
+    from embedding_store import EmbeddingStore
+
+    files = server.list_library_files()
+    store = EmbeddingStore(config.EMBEDDING_CACHE_DIR, server.clip_model_tag())
+    store.load()
+
+    # 服务特征缓存中大小/mtime 未变的图片直接复用（不计算内容哈希）
+    cached = {}
+    for name in files:
+        entry = store.entries.get(name)
+        if entry is None:
+            continue
+        try:
+            stat = os.stat(os.path.join(config.IMAGE_LIBRARY_PATH, name))
+        except OSError:
+            continue
+        if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            cached[name] = entry["row"]
+    pending = [n for n in files if n not in cached]
+    logger.info(f"图片库 {len(files)} 张：特征缓存命中 {len(cached)} 张，待编码 {len(pending)} 张")
+
+    num_shards = load_plan(shard_dir, store.fingerprint, max(1, -(-len(pending) // args.shard_size)))
+    groups = {}
+    for name in pending:
+        groups.setdefault(shard_of(name, num_shards), []).append(name)
+    jobs = [(shard_id, names, shard_path(shard_dir, shard_id), store.fingerprint)
+            for shard_id, names in sorted(groups.items())]
+
+    if jobs:
+        logger.info(f"{len(jobs)} 个分片，{args.workers} 个进程 x {threads} 线程（解码 {args.decode_threads} 线程）")
+        start = time.perf_counter()
+        done, images = 0, 0
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(args.workers, initializer=_init_worker,
+                          initargs=(threads, overrides)) as pool:
+            for result in pool.imap_unordered(_encode_shard, jobs):
+                done += 1
+                images += result["images"]
+                elapsed = time.perf_counter() - start
+                logger.info(
+                    f"[{done}/{len(jobs)}] 分片 {result['shard']}: {result['images']} 张"
+                    f"（复用 {result['reused']}，编码 {result['encoded']}，失败 {result['failed']}，"
+                    f"{result['seconds']}s）| 累计 {images / elapsed:.1f} 张/秒"
+                )
+
+    if args.no_merge:
+        logger.info("已跳过合并，稍后不带 --no-merge 重新运行即可合并（已完成的分片不会重新编码）")
+        return
+    merged = merge(store, files, cached, shard_dir, num_shards, set(pending))
+    logger.info(f"✓ 特征缓存已写入 {store.embeddings_path}（{merged} 张）")
+    if merged and not args.keep_shards:
+        for shard_id in range(num_shards):
+            path = shard_path(shard_dir, shard_id)
+            if os.path.exists(path):
+                os.remove(path)
+        os.remove(os.path.join(shard_dir, PLAN_FILE))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    main()
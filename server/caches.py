@@ -0,0 +1,179 @@
+# ====================================
+# 通用缓存工具
+# ====================================
+# 功能：线程安全的 LRU 缓存，支持条目数/字节数上限、可选 TTL，并统计命中率
+#       TieredCache 在内存 LRU 之外增加可选的磁盘层
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    线程安全的 LRU 缓存
+
+    max_entries: 最大条目数（0 表示不限制）
+    max_bytes: 最大字节数（0 表示不限制，需配合 sizeof 计算每个值的大小）
+    ttl: 条目存活秒数（0 表示不过期）
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 0, ttl: float = 0,
+                 sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof or (lambda value: 0)
+        self._data = OrderedDict()   # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, size, expires_at = item
+            if expires_at and expires_at < time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = self.sizeof(value)
+        if self.max_bytes and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+            while self._data and (
+                (self.max_entries and len(self._data) > self.max_entries)
+                or (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                _, (_, evicted_size, _) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return default
+            self._bytes -= item[1]
+            return item[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hit_ratio, 4),
+        }
+
+
+class TieredCache:
+    """
+    两级缓存：内存 LRU + 可选磁盘目录（值需可 JSON 序列化）
+
+    内存未命中时查找磁盘，磁盘命中的条目会回填内存；两级共用同一 TTL。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 0, disk_dir: Optional[str] = None):
+        self.memory = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key: str) -> Optional[str]:
+        if not self.disk_dir:
+            return None
+        return os.path.join(self.disk_dir, key[:2], key + ".json")
+
+    def get(self, key: str) -> Any:
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        path = self._disk_path(key)
+        if path and os.path.exists(path):
+            try:
+                if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+                else:
+                    with open(path, "r", encoding="utf-8") as f:
+                        value = json.load(f)
+                    self.memory.put(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            except (OSError, ValueError):
+                pass
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: Any) -> None:
+        self.memory.put(key, value)
+        path = self._disk_path(key)
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(value, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+            except OSError:
+                pass
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.memory),
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "evictions": self.memory.evictions,
+            "hit_ratio": round(self.hit_ratio, 4),
+        }
@@ -0,0 +1,58 @@
+# ====================================
+# 相同请求合并（single-flight）
+# ====================================
+# 功能：同一时刻到达的相同请求（相同检索参数 / 相同图片 + 问题）只执行一次计算，
+#       所有等待者共享结果；计算抛出异常时同一异常传递给全部等待者
+# 范围：只合并在途请求，计算完成后键即移除（已完成结果的复用由答案/特征缓存负责）
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class SingleFlight:
+    """
+    按键合并在途的异步计算（只在事件循环线程中使用，无需加锁）
+
+    计算在独立的 Task 中运行：发起请求的客户端断开连接（协程被取消）
+    不会中断计算，其他等待者照常拿到结果。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+        self.executed = 0    # 实际执行的计算次数
+        self.coalesced = 0   # 加入在途计算、未重复执行的请求数
+
+    async def run(self, key: Optional[Hashable], fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        执行 fn() 或等待相同 key 的在途计算，返回 (结果, 是否为合并请求)
+
+        key 为 None 时不合并，直接执行。
+        """
+        if key is None:
+            return await fn(), False
+        task = self._flights.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._flights[key] = task
+            self.executed += 1
+            task.add_done_callback(lambda t, key=key: self._finish(key, t))
+        # shield：当前等待者被取消时不取消共享的计算
+        return await asyncio.shield(task), shared
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # 所有等待者都已取消时异常无人读取，在此读取以免 asyncio 报 "exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "executed": self.executed, "coalesced": self.coalesced}
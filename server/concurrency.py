@@ -0,0 +1,94 @@
+# ====================================
+# 推理并发控制
+# ====================================
+# 功能：将阻塞的模型推理放到独立线程池执行，避免阻塞 asyncio 事件循环
+# 限流：每类负载有独立的在途请求上限，超限时立即返回 503 + Retry-After，而不是无限排队
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable
+
+from fastapi import HTTPException
+
+
+class Overloaded(HTTPException):
+    """在途请求已达上限"""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(
+            status_code=503,
+            detail=f"{name} 服务繁忙，请稍后重试",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class InferencePool:
+    """
+    推理线程池 + 准入控制
+
+    max_workers: 同时执行的推理数（线程数）
+    max_pending: 在途请求上限（执行中 + 排队中），超出时抛出 Overloaded
+    """
+
+    def __init__(self, name: str, max_workers: int, max_pending: int, retry_after: int = 5):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.rejected = 0
+
+    def reserve(self) -> Callable[[], None]:
+        """
+        占用一个准入名额（超限时抛出 Overloaded），返回释放函数
+
+        释放函数可重复调用、只生效一次，适合名额跨越多个清理路径的场景（如流式响应）。
+        """
+        with self._lock:
+            if self._in_flight >= self.max_pending:
+                self.rejected += 1
+                raise Overloaded(self.name, self.retry_after)
+            self._in_flight += 1
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            with self._lock:
+                if not released:
+                    released = True
+                    self._in_flight -= 1
+        return release
+
+    @asynccontextmanager
+    async def admission(self):
+        """准入控制：只计数、不占用线程，适合包裹由其他调度器（如微批处理）执行的请求"""
+        release = self.reserve()
+        try:
+            yield
+        finally:
+            release()
+
+    async def execute(self, fn: Callable, *args: Any) -> Any:
+        """在线程池中执行（不做准入检查）"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def run(self, fn: Callable, *args: Any) -> Any:
+        """准入检查后在线程池中执行"""
+        async with self.admission():
+            return await self.execute(fn, *args)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+        }
@@ -20,6 +20,15 @@ IMAGE_LIBRARY_PATH = "./image_library"  # 图片库路径
 # ====================================
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
+# CPU 推理（DEVICE == "cpu" 时生效，见 cpu_inference.py）
+CPU_NUM_THREADS = 0              # PyTorch 算子内线程数（进程级，VQA 与 CLIP 共用），0=默认（通常为物理核数）
+CPU_INTEROP_THREADS = 1          # 算子间线程数，0=默认
+VQA_CPU_PROFILE_ENABLED = True   # VQA 模型使用 CPU 推理配置；False=与 GPU 相同的加载路径（float32，不量化）
+VQA_CPU_QUANTIZE = True          # 语言模型 nn.Linear 动态 int8 量化（视觉编码器不量化）
+VQA_CPU_DTYPE = "auto"           # "auto"=CPU 原生支持 bf16 时视觉编码器（未量化时整个模型）使用 bfloat16，"bfloat16"，"float32"
+VQA_CPU_COMPILE = False          # torch.compile 编译前向（预热时编译，耗时较长；失败时回退到 eager）
+VQA_CPU_WARMUP_TOKENS = 8        # 加载后预热生成的 token 数，0=不预热（启用编译时至少预热 1 个 token）
+
 # ====================================
 # 模型配置
 # ====================================
@@ -43,6 +52,63 @@ VQA_GENERATION_CONFIG = {
     "num_beams": 1,         # 不使用束搜索
 }
 
+# VQA 视觉 token 预算：Qwen2.5-VL 按像素数决定视觉 token 数（每 28x28 像素 1 个 token），
+# 图片会被缩放到 [min_pixels, max_pixels] 范围内。预算越小，预填充越快、显存越省
+VQA_MIN_PIXELS = 64 * 28 * 28       # 全局下限（请求参数不能低于该值）
+VQA_MAX_PIXELS = 1280 * 28 * 28     # 全局上限（请求参数不能超过该值）
+VQA_QUALITY_TIERS = {
+    "fast": {"min_pixels": 64 * 28 * 28, "max_pixels": 256 * 28 * 28},       # 最多 256 个视觉 token
+    "balanced": {"min_pixels": 128 * 28 * 28, "max_pixels": 768 * 28 * 28},  # 最多 768 个视觉 token
+    "detailed": {"min_pixels": 256 * 28 * 28, "max_pixels": 1280 * 28 * 28}, # 最多 1280 个视觉 token
+}
+VQA_DEFAULT_QUALITY = "balanced"    # 请求未指定 quality 时使用的档位
+
+# VQA 答案缓存：相同图片 + 相同问题 + 相同生成参数直接返回缓存结果（do_sample=True 时自动跳过）
+VQA_CACHE_ENABLED = True
+VQA_CACHE_SIZE = 2048        # 内存缓存条目数上限（LRU 淘汰）
+VQA_CACHE_TTL = 24 * 3600    # 缓存有效期（秒），0=永不过期
+VQA_CACHE_DIR = ""           # 磁盘缓存目录，留空则只用内存缓存（如 "./index_cache/vqa_answers"）
+
+# 多轮 VQA 会话（/vqa/sessions）
+VQA_SESSION_TTL = 600              # 会话空闲超时（秒）
+VQA_SESSION_MAX = 256              # 最大会话数（超出时删除最久未使用的会话）
+VQA_SESSION_MAX_MEMORY_MB = 2048   # 所有会话 KV cache + 视觉输入的总上限（MB），超出时释放最久未使用会话的缓存
+VQA_SESSION_REUSE_KV = True        # 追问时复用对话前缀的 KV cache（关闭则每轮完整预填充）
+
+# VQA 流式输出（/vqa/stream）：两个 token 之间的最长等待时间（秒）
+VQA_STREAM_TOKEN_TIMEOUT = 120
+
+# VQA 动态批处理：并发请求在等待窗口内合并为一个批次，调用一次 generate
+VQA_BATCHING_ENABLED = True
+VQA_MAX_BATCH_SIZE = 4       # 单批最大请求数（受显存限制）
+VQA_BATCH_MAX_WAIT_MS = 20   # 收到首个请求后最多等待多久凑批（毫秒）
+VQA_BATCH_MAX_ITEMS = 32     # /vqa/batch 单次请求最多 (图片, 问题) 对数，按 VQA_MAX_BATCH_SIZE 分批生成
+
+# ====================================
+# 模型加载
+# ====================================
+# 启动时 VQA 模型与 CLIP 模型 + 图片库在后台并行加载，服务先接受连接；就绪状态见 /health/ready
+VQA_LAZY_LOAD = False          # True=启动时不加载 VQA 模型，首次请求时加载
+CLIP_LAZY_LOAD = False         # True=启动时不加载 CLIP 模型（图片特征全部命中缓存时也能完成建库），首次检索时加载
+VQA_IDLE_UNLOAD_SECONDS = 0    # VQA 模型空闲多久后卸载以释放显存/内存（秒），0=不卸载
+CLIP_IDLE_UNLOAD_SECONDS = 0   # CLIP 模型空闲多久后卸载（秒），0=不卸载
+MODEL_IDLE_CHECK_INTERVAL = 30 # 空闲卸载检查间隔（秒）
+MODEL_RETRY_BACKOFF = 30       # 模型加载失败后，下次请求自动重试前等待的秒数（连续失败时翻倍）
+MODEL_RETRY_BACKOFF_MAX = 600  # 加载失败重试等待的上限（秒）；也可通过 /admin/components/{name}/reload 立即重试
+
+# ====================================
+# 推理并发控制
+# ====================================
+# 模型推理在独立线程池中执行；在途请求（执行中 + 排队中）超过上限时立即返回 503 + Retry-After
+VQA_WORKERS = 1            # VQA 推理线程数（未启用批处理时即同时生成的请求数）
+VQA_MAX_PENDING = 16       # VQA 在途请求上限
+CLIP_WORKERS = 4           # 文本编码 + 检索线程数
+CLIP_MAX_PENDING = 64      # 文搜图在途请求上限
+OVERLOAD_RETRY_AFTER = 5   # 过载时 Retry-After 响应头（秒）
+# 相同请求合并：与在途请求完全相同的 /text2image_search 查询、/vqa（图片 + 问题 + 像素预算）
+# 不再单独计算，等待并共享在途请求的结果（只有首个请求占用在途名额；采样解码时不合并 VQA）
+REQUEST_COALESCING_ENABLED = True
+
 # CLIP 模型配置
 CLIP_MODEL_ID = "iic/multi-modal_clip-vit-base-patch16_zh"
 # 本地模型路径（如果已下载，直接指定路径，留空则自动下载）
@@ -58,6 +124,65 @@ CLIP_NORMALIZE_STD = [0.26862954, 0.26130258, 0.27577711]  # 图像归一化标
 # ====================================
 VALID_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
 
+# 图片解码（图片库建库、VQA 上传、缩略图共用，见 image_io.py）
+IMAGE_DECODE_BACKEND = "auto"    # "auto"=已安装 PyTurboJPEG 时用于 JPEG, "pil", "turbojpeg"
+IMAGE_DRAFT_DECODE = True        # 建库时按 CLIP 输入尺寸缩放解码（False=完整解码后再缩放）
+IMAGE_MAX_PIXELS = 100_000_000   # 原图像素数上限（约 1 亿），超过视为解压炸弹，解码前直接拒绝
+
+# 图片特征持久化缓存（重启时只编码新增/变更的图片）
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_DIR = "./index_cache"   # 特征矩阵与 manifest 存放目录
+
+# 图片库编码流水线
+CLIP_BATCH_SIZE = 32      # 每批送入 encode_image 的图片数
+INDEX_NUM_WORKERS = 4     # 解码 + 预处理工作线程数
+INDEX_QUEUE_SIZE = 128    # 预处理结果队列上限（控制内存峰值）
+
+# 图片库增量更新
+LIBRARY_WATCH_ENABLED = False   # 是否轮询监控图片库目录，变化后自动增量更新
+LIBRARY_WATCH_INTERVAL = 10     # 轮询间隔（秒）
+ADMIN_TOKEN = ""                # 管理接口口令（请求头 X-Admin-Token），留空则不校验
+
+# ====================================
+# 文搜图检索配置
+# ====================================
+SEARCH_BACKEND = "exact"        # "exact"=暴力精确检索, "ivf"=IVF 近似最近邻检索
+ANN_MIN_LIBRARY_SIZE = 10000    # 图片数少于该值时始终使用精确检索
+IVF_NLIST = 0                   # 簇数，0=自动（约 4*sqrt(N)）
+IVF_NPROBE = 16                 # 查询时探测的簇数（越大召回越高、越慢）
+IVF_KMEANS_ITERS = 20           # k-means 迭代次数
+IVF_TRAIN_SAMPLE = 100000       # 训练质心的最大采样数
+ANN_RECALL_CHECK_QUERIES = 200  # 构建后评估 recall@k 的查询数，0=不评估
+ANN_RECALL_CHECK_K = 10
+TEXT_EMBEDDING_CACHE_SIZE = 4096  # 文本查询特征 LRU 缓存条目数
+
+# 检索矩阵存储精度："float32"=原始特征, "float16"=内存减半, "int8"=逐行缩放量化（约 1/4）
+# 非 float32 时先在压缩矩阵上取 top_k * INDEX_RERANK_FACTOR 个候选，
+# 再从磁盘特征缓存（mmap）按需读取这些候选的 float32 特征精确重排
+INDEX_PRECISION = "float32"
+INDEX_RERANK_FACTOR = 4   # 0=不重排，直接返回压缩矩阵上的得分
+SEARCH_BATCH_MAX_QUERIES = 256    # /text2image_search/batch 单次请求最多查询数
+
+# 近重复折叠：CLIP 特征余弦相似度不低于阈值的图片（重新编码、缩放后的副本等）归为一组，
+# 每组只有代表图片（文件最大者）参与检索，其余作为别名随结果返回
+DEDUP_ENABLED = True
+DEDUP_THRESHOLD = 0.97   # 余弦相似度阈值，越高越保守
+DEDUP_BLOCK_SIZE = 2048  # 分块矩阵乘法的块大小（行），单块相似度矩阵占用 block^2 * 4 字节
+
+# 元数据过滤检索（类别/标签/文件大小/修改时间）
+METADATA_INDEX_ENABLED = True
+METADATA_CATEGORY_SEPARATORS = "_-"   # 文件名类别去掉的末尾分隔符（与编号一起）：cat3.jpg、cat_001.jpg -> cat
+METADATA_SIDECAR_SUFFIX = ".json"     # 旁路元数据文件：cat_001.jpg.json = {"category": "猫", "tags": ["室内"]}
+METADATA_FILTER_CACHE_SIZE = 256      # 过滤条件 -> 匹配行号 的缓存条目数
+
+# 检索结果图片（/images 接口）
+THUMBNAIL_MAX_SIDE = 256                          # 缩略图最长边（像素）
+THUMBNAIL_QUALITY = 85                            # 缩略图 JPEG 质量
+THUMBNAIL_CACHE_DIR = "./index_cache/thumbnails"  # 缩略图磁盘缓存目录，留空则只用内存缓存
+THUMBNAIL_MEMORY_MB = 64                          # 缩略图内存 LRU 缓存上限（MB）
+THUMBNAIL_PREGENERATE = True                      # 图片库构建/更新后在后台预生成缩略图
+IMAGE_CACHE_MAX_AGE = 86400                       # 图片响应 Cache-Control max-age（秒）
+
 # ====================================
 # 日志配置
 # ====================================
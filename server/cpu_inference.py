@@ -0,0 +1,161 @@
+# ====================================
+# CPU 推理配置（VQA）
+# ====================================
+# 功能：无 GPU 节点上运行 Qwen2.5-VL 的推理配置（BitsAndBytes 量化依赖 CUDA，CPU 上不起作用），
+#       config.DEVICE == "cpu" 时由 load_vqa_model 自动使用
+#   - 线程：显式设置算子内/算子间线程数，避免与 CLIP、解码线程池超额订阅
+#   - 量化：语言模型的 nn.Linear 动态 int8 量化（权重 int8，激活按批动态量化），
+#           逐 token 生成受内存带宽限制，权重字节数减为 1/4 即直接提升生成速度
+#   - bfloat16：CPU 原生支持（AVX512-BF16 / AMX）时视觉编码器使用 bf16（预填充阶段计算量大）；
+#               未量化时语言模型同样使用 bf16。动态量化的 Linear 只接受 float32 激活，量化层保持 float32
+#   - 预热/编译：加载后用合成小图执行一次短生成，提前完成 oneDNN 内核选择与内存分配，
+#                可选 torch.compile 编译前向
+
+import time
+import logging
+from typing import Iterable, Optional
+
+import numpy as np
+import torch
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def native_bf16_supported() -> bool:
+    """CPU 是否原生支持 bfloat16 矩阵运算（AVX512-BF16 或 AMX）；仅靠 AVX512 模拟 bf16 时反而比 float32 慢"""
+    for check in ("_is_amx_tile_supported", "_is_avx512_bf16_supported"):
+        fn = getattr(torch.cpu, check, None)
+        if fn is not None:
+            try:
+                if fn():
+                    return True
+            except Exception:
+                pass
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            flags = f.read()
+        return "avx512_bf16" in flags or "amx_bf16" in flags
+    except OSError:
+        return False
+
+
+def resolve_bf16(setting: str) -> bool:
+    """setting: "auto"=原生支持时启用，"bfloat16"=强制启用，"float32"=不启用"""
+    if setting == "auto":
+        return native_bf16_supported()
+    if setting not in ("bfloat16", "float32"):
+        raise ValueError(f"不支持的 CPU 推理精度: {setting}，可选 auto / bfloat16 / float32")
+    return setting == "bfloat16"
+
+
+def configure_threads(num_threads: int = 0, interop_threads: int = 0) -> dict:
+    """
+    设置 PyTorch 线程数（进程级，同时影响 CLIP 推理），0 表示保持默认（通常为物理核数）
+
+    算子间线程数只能在首次并行计算之前设置，之后设置会失败（记录警告，保持原值）。
+    """
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    if interop_threads > 0:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            logger.warning(f"算子间线程数设置失败（需在首次推理前设置）: {e}")
+    return {"num_threads": torch.get_num_threads(), "interop_threads": torch.get_num_interop_threads()}
+
+
+def _vision_module(model) -> Optional[torch.nn.Module]:
+    # transformers 不同版本中视觉编码器位于 model.visual 或 model.model.visual
+    visual = getattr(model, "visual", None)
+    if visual is None:
+        visual = getattr(getattr(model, "model", None), "visual", None)
+    return visual
+
+
+def optimize_model(model, quantize: bool = True, bf16: bool = False,
+                   skip_modules: Iterable[str] = ("visual",)) -> dict:
+    """
+    原地转换 float32 模型：bf16 时先转换视觉编码器（未量化时整个模型），再动态量化其余 nn.Linear
+
+    skip_modules: 不量化的子模块名（按模块路径中的任一段匹配），默认跳过视觉编码器
+    返回转换结果摘要（精度、量化层数、权重内存）
+    """
+    skip = set(skip_modules)
+    visual = _vision_module(model)
+    if bf16 and not quantize:
+        model.to(torch.bfloat16)
+    elif bf16 and visual is not None:
+        # Qwen2.5-VL 按 visual.dtype 转换 pixel_values，输出的图片特征再转换回文本嵌入的精度
+        visual.to(torch.bfloat16)
+
+    quantized = []
+    if quantize:
+        quantized = [
+            name for name, module in model.named_modules()
+            if isinstance(module, torch.nn.Linear) and not skip.intersection(name.split("."))
+        ]
+        qconfig = torch.ao.quantization.default_dynamic_qconfig
+        torch.ao.quantization.quantize_dynamic(
+            model, {name: qconfig for name in quantized}, dtype=torch.qint8, inplace=True
+        )
+    model.eval()
+    return {
+        "quantized_linear_layers": len(quantized),
+        "vision_dtype": str(next(visual.parameters()).dtype).replace("torch.", "") if visual is not None else None,
+        "text_dtype": "int8 (dynamic) + float32" if quantize else ("bfloat16" if bf16 else "float32"),
+        "weight_bytes": model_nbytes(model),
+    }
+
+
+def model_nbytes(model) -> int:
+    """模型权重与缓冲区的内存（字节），包含动态量化层打包后的 int8 权重"""
+    total = 0
+    for value in model.state_dict().values():
+        tensors = value if isinstance(value, (tuple, list)) else (value,)
+        for tensor in tensors:
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def compile_forward(model):
+    """用 torch.compile 编译前向（编译发生在首次调用时），返回原始 forward 以便失败时恢复"""
+    original = model.forward
+    model.forward = torch.compile(original, dynamic=True)
+    return original
+
+
+def synthetic_image(width: int = 448, height: int = 448, seed: int = 0) -> Image.Image:
+    """合成图片（随机色块放大），用于预热和基准测试"""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 256, size=(max(1, height // 64), max(1, width // 64), 3), dtype=np.uint8)
+    return Image.fromarray(base).resize((width, height), Image.BILINEAR)
+
+
+def measure_generation(model, inputs, generation_config: dict) -> dict:
+    """
+    测量一次生成：先只生成 1 个 token 得到预填充耗时，再完整生成
+
+    decode_tokens_per_second 只计首个 token 之后的生成（逐 token 阶段），
+    tokens_per_second 为完整生成的平均速度（含预填充）
+    """
+    with torch.no_grad():
+        start = time.perf_counter()
+        model.generate(**inputs, **dict(generation_config, max_new_tokens=1))
+        prefill = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sequences = model.generate(**inputs, **generation_config)
+        total = time.perf_counter() - start
+    batch = int(sequences.shape[0])
+    new_tokens = int(sequences.shape[1] - inputs["input_ids"].shape[1]) * batch
+    decode_seconds = max(total - prefill, 1e-9)
+    return {
+        "prompt_tokens": int(inputs["input_ids"].shape[1]),
+        "new_tokens": new_tokens,
+        "prefill_ms": round(prefill * 1000, 1),
+        "total_ms": round(total * 1000, 1),
+        "tokens_per_second": round(new_tokens / total, 2) if total > 0 else None,
+        "decode_tokens_per_second": round((new_tokens - batch) / decode_seconds, 2) if new_tokens > batch else None,
+    }
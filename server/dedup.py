@@ -0,0 +1,158 @@
+# ====================================
+# 近重复图片检测
+# ====================================
+# 功能：在 CLIP 特征上找出余弦相似度超过阈值的图片对（重新编码、缩放后的副本等），
+#       并用并查集合并为重复组
+# 计算：按行分块做矩阵乘法，每次只有 (block, block) 的相似度矩阵在内存中，
+#       特征矩阵可以是磁盘缓存的 mmap，规模不受内存限制
+
+import os
+import json
+import time
+import logging
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def duplicate_pairs(embeddings: np.ndarray, threshold: float, query_rows: Optional[np.ndarray] = None,
+                    block_size: int = 2048) -> np.ndarray:
+    """
+    返回相似度 >= threshold 的行对，shape 为 (P, 2)
+
+    query_rows 为 None 时比较所有行对（只计算上三角分块）；
+    否则只比较 query_rows 与全部行（增量更新时只检查新增图片）。
+    """
+    n = embeddings.shape[0]
+    pairs = []
+    if query_rows is None:
+        for i0 in range(0, n, block_size):
+            a = np.asarray(embeddings[i0:i0 + block_size], dtype=np.float32)
+            for j0 in range(i0, n, block_size):
+                b = a if j0 == i0 else np.asarray(embeddings[j0:j0 + block_size], dtype=np.float32)
+                sims = a @ b.T
+                if j0 == i0:
+                    # 同一分块只保留上三角（不含对角线）
+                    sims[np.tril_indices(sims.shape[0])] = -np.inf
+                ii, jj = np.nonzero(sims >= threshold)
+                if len(ii):
+                    pairs.append(np.stack([ii + i0, jj + j0], axis=1))
+    else:
+        query_rows = np.asarray(query_rows, dtype=np.int64)
+        for q0 in range(0, len(query_rows), block_size):
+            rows = query_rows[q0:q0 + block_size]
+            a = np.asarray(embeddings[rows], dtype=np.float32)
+            for j0 in range(0, n, block_size):
+                sims = a @ np.asarray(embeddings[j0:j0 + block_size], dtype=np.float32).T
+                ii, jj = np.nonzero(sims >= threshold)
+                jj = jj + j0
+                keep = rows[ii] != jj
+                if keep.any():
+                    pairs.append(np.stack([rows[ii[keep]], jj[keep]], axis=1))
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.concatenate(pairs).astype(np.int64)
+
+
+def group_rows(n: int, pairs: np.ndarray, seed_groups: Iterable[Sequence[int]] = ()) -> List[np.ndarray]:
+    """
+    并查集合并：pairs 中的行对及 seed_groups（如上一次的重复组）属于同一组
+
+    返回成员数 >= 2 的组（每组为升序行号数组）
+    """
+    parent = np.arange(n)
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(a, b):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+
+    for group in seed_groups:
+        group = list(group)
+        for other in group[1:]:
+            union(group[0], other)
+    for a, b in pairs:
+        union(int(a), int(b))
+
+    # 向量化压缩路径（parent 指向更小的行号，反复跳转直到不再变化），避免逐行调用 find
+    while True:
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            break
+        parent = grand
+    roots = parent
+    order = np.argsort(roots, kind="stable")
+    boundaries = np.flatnonzero(np.diff(roots[order])) + 1
+    return [g for g in np.split(order, boundaries) if len(g) > 1]
+
+
+def group_pairs(embeddings: np.ndarray, threshold: float, groups: Iterable[Sequence[int]]) -> np.ndarray:
+    """组内相似度 >= threshold 的行对（每组一次小矩阵乘法），用于重新拆分失去成员的旧重复组"""
+    pairs = []
+    for group in groups:
+        rows = np.asarray(group, dtype=np.int64)
+        if len(rows) < 2:
+            continue
+        vectors = np.asarray(embeddings[rows], dtype=np.float32)
+        sims = vectors @ vectors.T
+        ii, jj = np.nonzero(np.triu(sims >= threshold, k=1))
+        if len(ii):
+            pairs.append(np.stack([rows[ii], rows[jj]], axis=1))
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.concatenate(pairs)
+
+
+def find_duplicate_groups(embeddings: np.ndarray, threshold: float, block_size: int = 2048,
+                          new_rows: Optional[np.ndarray] = None,
+                          seed_groups: Iterable[Sequence[int]] = (),
+                          split_groups: Iterable[Sequence[int]] = ()) -> List[np.ndarray]:
+    """
+    近重复分组
+
+    全量：比较所有行对；增量：传入 new_rows（新增行）和 seed_groups（成员未变化的旧重复组），
+    只需计算新增行与全部行的相似度。split_groups 为删除或变化了成员的旧重复组的剩余成员：
+    链式相连的组（A~B、B~C 而 A、C 不相似）失去中间成员后可能不再连通，
+    因此只按组内重新计算的相似度合并，不整体沿用。
+    """
+    start = time.perf_counter()
+    pairs = duplicate_pairs(embeddings, threshold, query_rows=new_rows, block_size=block_size)
+    pairs = np.concatenate([pairs, group_pairs(embeddings, threshold, split_groups)])
+    groups = group_rows(embeddings.shape[0], pairs, seed_groups)
+    if groups:
+        logger.info(f"近重复检测: {len(groups)} 组，共 {sum(len(g) for g in groups)} 张，"
+                    f"耗时 {time.perf_counter() - start:.2f}s")
+    return groups
+
+
+def save_groups(path: str, source: str, groups: Iterable[Sequence[str]]) -> None:
+    """保存重复组（按文件名），source 标识计算所用的特征矩阵与阈值"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"source": source, "groups": [list(g) for g in groups]}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_groups(path: str, source: str) -> Optional[List[List[str]]]:
+    """读取重复组；文件不存在或来源不匹配时返回 None"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("source") != source:
+            return None
+        return [list(g) for g in data["groups"]]
+    except Exception as e:
+        logger.warning(f"⚠ 读取近重复分组失败: {e}")
+        return None
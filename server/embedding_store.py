@@ -0,0 +1,161 @@
+# ====================================
+# 图片特征持久化缓存
+# ====================================
+# 功能：将图片库的 CLIP 特征保存到磁盘，重启时只编码新增/变更的图片
+# 存储：embeddings-<版本>.npy（float32 特征矩阵，可 mmap 加载）
+#       manifest.json（文件名 -> 内容哈希/大小/mtime/行号，并记录模型标识和矩阵文件名）
+
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def file_sha1(path: str, chunk_size: int = 1 << 20) -> str:
+    """计算文件内容的 SHA1（分块读取，避免大文件占用内存）"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def model_fingerprint(model_tag: dict) -> str:
+    """模型标识 + 预处理配置的指纹，任一项变化都会使缓存失效"""
+    payload = json.dumps(model_tag, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    内容寻址的图片特征缓存
+
+    - 文件大小和 mtime 未变：直接复用，不读取文件内容
+    - 大小或 mtime 变化：重新计算内容哈希，哈希一致（如仅 touch/复制/改名）仍复用
+    - 模型或预处理配置变化：整个缓存失效
+    """
+
+    def __init__(self, cache_dir: str, model_tag: dict):
+        self.cache_dir = cache_dir
+        self.model_tag = model_tag
+        self.fingerprint = model_fingerprint(model_tag)
+        self.entries: Dict[str, dict] = {}       # 文件名 -> {sha1, size, mtime_ns, row}
+        self.embeddings: Optional[np.ndarray] = None  # mmap 的 (N, D) float32 矩阵
+        self._rows_by_hash: Dict[str, int] = {}
+        self.embeddings_path: Optional[str] = None
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.cache_dir, MANIFEST_FILE)
+
+    def load(self) -> None:
+        """读取 manifest 并以 mmap 方式打开特征矩阵，缓存无效时保持为空"""
+        self.entries, self.embeddings, self._rows_by_hash = {}, None, {}
+        self.embeddings_path = None
+        if not os.path.exists(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") != MANIFEST_VERSION:
+                logger.info("特征缓存版本不匹配，将重新构建")
+                return
+            if manifest.get("fingerprint") != self.fingerprint:
+                logger.info("CLIP 模型或预处理配置已变化，特征缓存失效")
+                return
+            embeddings_path = os.path.join(self.cache_dir, manifest["embeddings_file"])
+            embeddings = np.load(embeddings_path, mmap_mode="r")
+            entries = manifest.get("entries", {})
+            if any(e["row"] >= len(embeddings) for e in entries.values()):
+                logger.warning("⚠ 特征缓存与 manifest 不一致，将重新构建")
+                return
+            self.entries, self.embeddings = entries, embeddings
+            self.embeddings_path = embeddings_path
+            self._rows_by_hash = {e["sha1"]: e["row"] for e in entries.values()}
+        except Exception as e:
+            logger.warning(f"⚠ 读取特征缓存失败，将重新构建: {e}")
+            self.entries, self.embeddings, self._rows_by_hash = {}, None, {}
+            self.embeddings_path = None
+
+    @staticmethod
+    def describe(path: str) -> dict:
+        """计算文件的 manifest 条目（内容哈希、大小、mtime）"""
+        stat = os.stat(path)
+        return {"sha1": file_sha1(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def resolve(self, library_path: str, file_names: List[str]) -> Tuple[Dict[str, Tuple[dict, int]], List[Tuple[str, dict]]]:
+        """
+        对比当前目录与缓存
+
+        返回:
+            hits: 文件名 -> (新的 manifest 条目, 旧矩阵中的行号)
+            misses: [(文件名, manifest 条目)]，需要重新编码
+        """
+        hits, misses = {}, []
+        for name in file_names:
+            path = os.path.join(library_path, name)
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                logger.warning(f"读取文件信息失败 {name}: {e}")
+                continue
+            cached = self.entries.get(name)
+            if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+                hits[name] = (dict(cached), cached["row"])
+                continue
+            try:
+                sha1 = file_sha1(path)
+            except OSError as e:
+                logger.warning(f"读取文件失败 {name}: {e}")
+                continue
+            entry = {"sha1": sha1, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            row = self._rows_by_hash.get(sha1)
+            if row is not None:
+                hits[name] = (dict(entry, row=row), row)
+            else:
+                misses.append((name, entry))
+        return hits, misses
+
+    def save(self, names: List[str], entries: List[dict], embeddings: np.ndarray) -> None:
+        """
+        写入新的特征矩阵和 manifest，未列出的旧条目即被清理
+
+        矩阵写入带版本号的新文件，manifest 最后原子替换，
+        中途崩溃时旧 manifest 仍指向完整的旧矩阵。
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        embeddings_file = f"embeddings-{time.time_ns()}.npy"
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "fingerprint": self.fingerprint,
+            "model": self.model_tag,
+            "embeddings_file": embeddings_file,
+            "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 and len(embeddings) else 0,
+            "entries": {
+                name: dict(entry, row=row) for row, (name, entry) in enumerate(zip(names, entries))
+            },
+        }
+        np.save(os.path.join(self.cache_dir, embeddings_file), embeddings)
+        tmp_manifest = self.manifest_path + ".tmp"
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, default=str)
+        os.replace(tmp_manifest, self.manifest_path)
+
+        # 清理旧版本矩阵（Linux 下已 mmap 的旧文件删除后仍可继续读取）
+        for name in os.listdir(self.cache_dir):
+            if name.startswith("embeddings-") and name.endswith(".npy") and name != embeddings_file:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+        self.load()
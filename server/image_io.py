@@ -0,0 +1,146 @@
+# ====================================
+# 图片解码
+# ====================================
+# 功能：图片库建库、VQA 上传、缩略图共用的图片读取层
+#   - 缩放解码：JPEG 在解码阶段直接按 1/2、1/4、1/8 缩小（DCT 缩放），只解码需要的分辨率
+#   - 可选后端：安装 PyTurboJPEG 时使用 libjpeg-turbo 解码 JPEG（缩放比例更细，速度更快）
+#   - EXIF 方向：缩小后只旋转一次（旋转小图的代价很小）
+#   - 解压炸弹：读取文件头得到尺寸后立即检查像素数，超限时不进入解码
+
+import io
+import logging
+from typing import Optional, Tuple, Union
+
+from PIL import Image
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+except ImportError:
+    TurboJPEG = None
+
+logger = logging.getLogger(__name__)
+
+# EXIF Orientation -> 对应的变换（与 ImageOps.exif_transpose 一致）
+_ORIENTATION = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+_turbo = None
+
+
+class ImageTooLarge(ValueError):
+    """图片像素数超过上限（疑似解压炸弹）"""
+
+
+def turbojpeg_available() -> bool:
+    """PyTurboJPEG 及 libjpeg-turbo 动态库是否可用（首次调用时加载）"""
+    global _turbo, TurboJPEG
+    if _turbo is None and TurboJPEG is not None:
+        try:
+            _turbo = TurboJPEG()
+        except Exception as e:
+            logger.warning(f"libjpeg-turbo 加载失败，使用 Pillow 解码: {e}")
+            TurboJPEG = None
+    return _turbo is not None
+
+
+def _target_size(width: int, height: int, min_size: Optional[Tuple[int, int]],
+                 max_pixels: Optional[int]) -> Optional[Tuple[int, int]]:
+    """解码所需的最小尺寸：不小于 min_size，且像素数按 max_pixels 缩小；均未指定时为 None（完整解码）"""
+    scale = 1.0
+    if max_pixels and width * height > max_pixels:
+        scale = (max_pixels / float(width * height)) ** 0.5
+    if min_size:
+        # min_size 按短边/长边匹配，旋转 90 度的图片同样适用
+        short, long = sorted(min_size)
+        scale = max(scale, short / float(min(width, height)), long / float(max(width, height)))
+    if scale >= 1.0:
+        return None
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def _decode_turbo(data: bytes, width: int, height: int, target: Optional[Tuple[int, int]]) -> Image.Image:
+    """libjpeg-turbo 解码：选择结果不小于 target 的最小缩放比例"""
+    factor = None
+    if target:
+        candidates = [(num, den) for num, den in _turbo.scaling_factors
+                      if num <= den and width * num >= target[0] * den and height * num >= target[1] * den]
+        if candidates:
+            factor = min(candidates, key=lambda f: f[0] / f[1])
+    pixels = _turbo.decode(data, pixel_format=TJPF_RGB, scaling_factor=factor)
+    return Image.fromarray(pixels)
+
+
+def open_image(source: Union[str, bytes], min_size: Optional[Tuple[int, int]] = None,
+               max_pixels: Optional[int] = None, max_image_pixels: int = 0,
+               backend: str = "auto", stats: Optional[dict] = None) -> Image.Image:
+    """
+    读取图片并返回已按 EXIF 方向旋转的 RGB 图片
+
+    source: 文件路径或图片字节
+    min_size: 后续处理需要的最小尺寸（如 CLIP 的 224x224），缩放解码结果不小于该尺寸
+    max_pixels: 像素预算（如 VQA 的 max_pixels），缩放解码到预算附近（可能略大，调用方再精确缩放）
+    max_image_pixels: 原图像素数上限，超过时抛出 ImageTooLarge，0 表示不限制
+    backend: "auto"（有 PyTurboJPEG 时用于 JPEG）、"pil" 或 "turbojpeg"
+    stats: 传入字典时记录原图尺寸、解码尺寸和使用的后端
+    """
+    data = source if isinstance(source, (bytes, bytearray)) else None
+    try:
+        image = Image.open(io.BytesIO(data) if data is not None else source)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    try:
+        width, height = image.size
+        if max_image_pixels and width * height > max_image_pixels:
+            raise ImageTooLarge(f"图片像素数 {width}x{height} 超过上限 {max_image_pixels}")
+        target = _target_size(width, height, min_size, max_pixels)
+        orientation = image.getexif().get(0x0112, 1)
+
+        use_turbo = (image.format == "JPEG" and backend != "pil"
+                     and (backend == "turbojpeg" or target is not None) and turbojpeg_available())
+        decoded = None
+        if use_turbo:
+            if data is None:
+                with open(source, "rb") as f:
+                    data = f.read()
+            try:
+                decoded = _decode_turbo(bytes(data), width, height, target)
+                used = "turbojpeg"
+            except Exception as e:
+                # CMYK 等 libjpeg-turbo 无法直接输出 RGB 的文件回退到 Pillow
+                logger.debug(f"libjpeg-turbo 解码失败，回退到 Pillow: {e}")
+        if decoded is None:
+            if target is not None:
+                image.draft("RGB", target)
+            decoded = image.convert("RGB")
+            used = "pil"
+    finally:
+        image.close()
+
+    if orientation in _ORIENTATION:
+        decoded = decoded.transpose(_ORIENTATION[orientation])
+    if stats is not None:
+        stats.update(source_size=(width, height), decoded_size=decoded.size, backend=used)
+    return decoded
+
+
+def fast_downscale(image: Image.Image, max_pixels: int) -> Image.Image:
+    """
+    像素数明显超出预算时的快速缩小：先用整数倍 reduce（盒式滤波，开销很小）
+    再双线性缩放到预算附近，避免后续在完整分辨率上做高质量重采样
+    """
+    width, height = image.size
+    if width * height <= max_pixels * 1.1:
+        return image
+    scale = (max_pixels / float(width * height)) ** 0.5
+    target = (max(28, int(width * scale)), max(28, int(height * scale)))
+    factor = min(width // target[0], height // target[1])
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image.resize(target, Image.BILINEAR)
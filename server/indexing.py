@@ -0,0 +1,182 @@
+# ====================================
+# 图片库批量编码流水线
+# ====================================
+# 功能：多线程解码 + 预处理，主线程按批次调用 CLIP encode_image
+# 设计：有界队列保证内存占用与图片库规模无关，结束时输出吞吐量和各阶段耗时
+
+import time
+import queue
+import logging
+import threading
+from typing import Callable, Iterator, List, Tuple, Any
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()  # 工作线程结束标记
+
+
+class IndexingStats:
+    """索引构建统计（各阶段耗时单位均为秒）"""
+
+    def __init__(self):
+        self.total = 0              # 提交的图片数
+        self.encoded = 0            # 成功编码的图片数
+        self.failed = 0             # 解码/预处理/编码失败数
+        self.batches = 0
+        self.decode_seconds = 0.0   # 工作线程解码 + 预处理累计耗时（多线程累加）
+        self.wait_seconds = 0.0     # 主线程等待预处理结果的耗时（编码器空闲）
+        self.encode_seconds = 0.0   # encode_image 累计耗时
+        self.wall_seconds = 0.0
+
+    @property
+    def images_per_second(self) -> float:
+        return self.encoded / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "encoded": self.encoded,
+            "failed": self.failed,
+            "batches": self.batches,
+            "decode_seconds": round(self.decode_seconds, 3),
+            "wait_seconds": round(self.wait_seconds, 3),
+            "encode_seconds": round(self.encode_seconds, 3),
+            "wall_seconds": round(self.wall_seconds, 3),
+            "images_per_second": round(self.images_per_second, 2),
+        }
+
+    def summary(self) -> str:
+        return (
+            f"{self.encoded}/{self.total} 张, {self.images_per_second:.1f} 张/秒 | "
+            f"解码+预处理 {self.decode_seconds:.2f}s(累计) | 等待 {self.wait_seconds:.2f}s | "
+            f"编码 {self.encode_seconds:.2f}s ({self.batches} 批) | 总耗时 {self.wall_seconds:.2f}s"
+        )
+
+
+def iter_encoded_batches(
+    items: List[Tuple[str, Any]],
+    load_fn: Callable[[Any], Any],
+    encode_fn: Callable[[List[Any]], np.ndarray],
+    batch_size: int = 32,
+    num_workers: int = 4,
+    queue_size: int = 128,
+    stats: IndexingStats = None,
+) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """
+    流水线编码
+
+    参数:
+        items: [(名称, load_fn 的输入)]，如 (文件名, 图片路径)
+        load_fn: 在工作线程中执行，完成解码和预处理，返回单张图片张量
+        encode_fn: 在调用方线程中执行，输入张量列表，返回 (B, D) 的归一化特征
+        queue_size: 预处理结果队列上限，决定内存峰值
+
+    逐批产出 (名称列表, 特征矩阵)；单张图片失败只记录日志，不影响其他图片。
+    """
+    stats = stats if stats is not None else IndexingStats()
+    stats.total += len(items)
+    if not items:
+        return
+
+    start = time.perf_counter()
+    num_workers = max(1, min(num_workers, len(items)))
+    work_queue = queue.Queue()
+    for item in items:
+        work_queue.put(item)
+    result_queue = queue.Queue(maxsize=max(queue_size, batch_size))
+    stop_event = threading.Event()
+    decode_lock = threading.Lock()
+
+    def put(result):
+        # 队列满时阻塞，形成背压；调用方提前退出时放弃
+        while not stop_event.is_set():
+            try:
+                result_queue.put(result, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def worker():
+        while not stop_event.is_set():
+            try:
+                name, source = work_queue.get_nowait()
+            except queue.Empty:
+                break
+            t0 = time.perf_counter()
+            try:
+                result = (name, load_fn(source), None)
+            except Exception as e:
+                result = (name, None, e)
+            with decode_lock:
+                stats.decode_seconds += time.perf_counter() - t0
+            put(result)
+        put(_DONE)
+
+    threads = [threading.Thread(target=worker, daemon=True, name=f"index-worker-{i}")
+               for i in range(num_workers)]
+    for t in threads:
+        t.start()
+
+    def encode_one_by_one(names, tensors):
+        # 批量编码失败时逐张重试，只跳过真正无法编码的图片
+        kept_names, kept_features = [], []
+        for name, tensor in zip(names, tensors):
+            try:
+                kept_features.append(encode_fn([tensor])[0])
+                kept_names.append(name)
+            except Exception as e:
+                logger.warning(f"编码图片 {name} 失败: {e}")
+                stats.failed += 1
+        return kept_names, kept_features
+
+    def flush(names, tensors):
+        t0 = time.perf_counter()
+        try:
+            features = encode_fn(tensors)
+        except Exception as e:
+            if len(names) == 1:
+                logger.warning(f"编码图片 {names[0]} 失败: {e}")
+                stats.failed += 1
+                return None
+            logger.warning(f"批量编码失败（{len(names)} 张），改为逐张编码: {e}")
+            names, features = encode_one_by_one(names, tensors)
+            if not names:
+                return None
+            features = np.stack(features)
+        finally:
+            stats.encode_seconds += time.perf_counter() - t0
+        stats.batches += 1
+        stats.encoded += len(names)
+        return names, features
+
+    try:
+        finished = 0
+        names, tensors = [], []
+        while finished < num_workers:
+            t0 = time.perf_counter()
+            result = result_queue.get()
+            stats.wait_seconds += time.perf_counter() - t0
+            if result is _DONE:
+                finished += 1
+                continue
+            name, tensor, error = result
+            if error is not None:
+                logger.warning(f"处理图片 {name} 失败: {error}")
+                stats.failed += 1
+                continue
+            names.append(name)
+            tensors.append(tensor)
+            if len(names) >= batch_size:
+                batch = flush(names, tensors)
+                names, tensors = [], []
+                if batch:
+                    yield batch
+        if names:
+            batch = flush(names, tensors)
+            if batch:
+                yield batch
+    finally:
+        stop_event.set()
+        stats.wall_seconds += time.perf_counter() - start
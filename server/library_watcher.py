@@ -0,0 +1,75 @@
+# ====================================
+# 图片库目录监控
+# ====================================
+# 功能：定期轮询 IMAGE_LIBRARY_PATH，文件新增/删除/修改后触发增量更新
+# 说明：采用轮询而非系统文件事件，无需额外依赖；目录连续两次扫描一致后才触发，
+#       避免文件仍在复制时被读取
+
+import os
+import logging
+import threading
+from typing import Callable, Dict, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_directory(path: str, extensions: Iterable[str]) -> Dict[str, Tuple[int, int]]:
+    """返回 文件名 -> (大小, mtime_ns)"""
+    extensions = set(extensions)
+    result = {}
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if os.path.splitext(entry.name.lower())[1] not in extensions:
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                result[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    except OSError as e:
+        logger.warning(f"扫描图片库目录失败: {e}")
+    return result
+
+
+class LibraryWatcher:
+    """后台轮询线程，目录内容稳定变化后调用 on_change()"""
+
+    def __init__(self, path: str, extensions: Iterable[str], interval: float,
+                 on_change: Callable[[], None]):
+        self.path = path
+        self.extensions = set(extensions)
+        self.interval = interval
+        self.on_change = on_change
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True, name="library-watcher")
+        self._thread.start()
+        logger.info(f"图片库目录监控已启动: {self.path}（间隔 {self.interval}s）")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def _run(self) -> None:
+        applied = snapshot_directory(self.path, self.extensions)
+        seen = applied
+        while not self._stop.wait(self.interval):
+            current = snapshot_directory(self.path, self.extensions)
+            if current != seen:
+                # 目录仍在变化，等待下一轮确认稳定
+                seen = current
+                continue
+            if current == applied:
+                continue
+            try:
+                self.on_change()
+                applied = current
+            except Exception as e:
+                logger.error(f"✗ 图片库增量更新失败: {e}")
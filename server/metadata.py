@@ -0,0 +1,181 @@
+# ====================================
+# 图片元数据与过滤索引
+# ====================================
+# 元数据：类别（旁路文件指定，否则取文件名去掉末尾编号，如 cat3.jpg -> cat、city_night_02.jpg -> city_night）、
+#         标签、文件大小、修改时间
+# 旁路文件：<图片文件名><后缀>，如 cat_001.jpg.json = {"category": "猫", "tags": ["室内", "黑色"]}
+# 索引：类别/标签为 值 -> 升序行号数组（倒排列表），大小/修改时间为排序数组（范围条件二分查找）
+# 过滤：各条件解析为行号列表后从最短的开始求交集，结果只含匹配的行，检索时只对这些行打分
+
+import os
+import re
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def normalize_value(value) -> str:
+    return str(value).strip().lower()
+
+
+def category_from_name(name: str, separators: str = "_-") -> str:
+    """
+    文件名类别：去掉扩展名及末尾的编号和分隔符
+
+    cat.jpg / cat3.jpg / cat_001.jpg -> cat，city_night2.jpg -> city_night，
+    dog_and_cat.jpg -> dog_and_cat；只有编号的文件名（如 001.jpg）类别为空
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return normalize_value(re.sub(f"[0-9{re.escape(separators)}\\s]+$", "", stem))
+
+
+def read_sidecar(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception as e:
+        logger.warning(f"读取元数据文件失败 {os.path.basename(path)}: {e}")
+        return {}
+
+
+def load_records(library_path: str, names: Iterable[str], entries: Optional[Dict[str, dict]] = None,
+                 previous: Optional[Dict[str, dict]] = None, changed: Iterable[str] = (),
+                 separators: str = "_-", sidecar_suffix: str = ".json") -> List[dict]:
+    """
+    生成每张图片的元数据记录 {category, tags, size, mtime}
+
+    entries 为特征缓存的 manifest 条目（含 size/mtime_ns，可省去 stat）；
+    previous 为上一版本的记录，未在 changed 中的图片直接复用，不重新读取旁路文件。
+    """
+    changed = set(changed)
+    sidecars = None
+    records = []
+    for name in names:
+        if previous is not None and name in previous and name not in changed:
+            records.append(previous[name])
+            continue
+        if sidecars is None:
+            sidecars = {f for f in os.listdir(library_path) if f.endswith(sidecar_suffix)} if sidecar_suffix else set()
+        entry = entries.get(name) if entries else None
+        if entry is not None:
+            size, mtime = entry["size"], entry["mtime_ns"] / 1e9
+        else:
+            try:
+                stat = os.stat(os.path.join(library_path, name))
+                size, mtime = stat.st_size, stat.st_mtime
+            except OSError:
+                size, mtime = 0, 0.0
+        record = {"category": category_from_name(name, separators), "tags": [], "size": size, "mtime": mtime}
+        if name + sidecar_suffix in sidecars:
+            sidecar = read_sidecar(os.path.join(library_path, name + sidecar_suffix))
+            if sidecar.get("category"):
+                record["category"] = normalize_value(sidecar["category"])
+            tags = sidecar.get("tags") or []
+            record["tags"] = sorted({normalize_value(t) for t in (tags if isinstance(tags, list) else [tags]) if str(t).strip()})
+        records.append(record)
+    return records
+
+
+def _postings(pairs) -> Dict[str, np.ndarray]:
+    lists: Dict[str, list] = {}
+    for value, row in pairs:
+        lists.setdefault(value, []).append(row)
+    return {value: np.array(rows, dtype=np.int64) for value, rows in lists.items()}
+
+
+class MetadataIndex:
+    """
+    图片库元数据过滤索引（行号与 ImageLibrary.names 一一对应）
+
+    select() 返回满足全部条件的升序行号数组（不含任何条件时返回 None），
+    结果按条件缓存；索引随图片库整体替换，缓存无需失效处理。
+    """
+
+    def __init__(self, names: Iterable[str], records: List[dict], cache_size: int = 256):
+        self.names = list(names)
+        self.records = records
+        self.size = np.array([r["size"] for r in records], dtype=np.int64)
+        self.mtime = np.array([r["mtime"] for r in records], dtype=np.float64)
+        self._size_order = np.argsort(self.size, kind="stable")
+        self._sorted_size = self.size[self._size_order]
+        self._mtime_order = np.argsort(self.mtime, kind="stable")
+        self._sorted_mtime = self.mtime[self._mtime_order]
+        self.categories = _postings((r["category"], i) for i, r in enumerate(records) if r["category"])
+        self.tags = _postings((t, i) for i, r in enumerate(records) for t in r["tags"])
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def record_map(self) -> Dict[str, dict]:
+        """文件名 -> 记录，供增量更新复用"""
+        return dict(zip(self.names, self.records))
+
+    @staticmethod
+    def _range(sorted_values: np.ndarray, order: np.ndarray, low, high) -> np.ndarray:
+        start = np.searchsorted(sorted_values, low, side="left") if low is not None else 0
+        end = np.searchsorted(sorted_values, high, side="right") if high is not None else len(order)
+        return np.sort(order[start:end])
+
+    def select(self, categories: Iterable[str] = (), tags: Iterable[str] = (),
+               min_size: Optional[int] = None, max_size: Optional[int] = None,
+               modified_after: Optional[float] = None, modified_before: Optional[float] = None) -> Optional[np.ndarray]:
+        """
+        categories 任一匹配，tags 需全部包含，大小/修改时间为闭区间
+
+        各条件的行号列表从最短的开始，用其余条件的位图逐个筛选，
+        代价与最短列表和位图大小成正比，选择性越高越快。
+        """
+        categories = tuple(sorted({normalize_value(c) for c in categories if str(c).strip()}))
+        tags = tuple(sorted({normalize_value(t) for t in tags if str(t).strip()}))
+        key = (categories, tags, min_size, max_size, modified_after, modified_before)
+        if key == ((), (), None, None, None, None):
+            return None
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        parts = []
+        if categories:
+            # 每张图片只属于一个类别，各倒排列表互不相交
+            parts.append(np.sort(np.concatenate([self.categories.get(c, _EMPTY) for c in categories])))
+        parts.extend(self.tags.get(t, _EMPTY) for t in tags)
+        if min_size is not None or max_size is not None:
+            parts.append(self._range(self._sorted_size, self._size_order, min_size, max_size))
+        if modified_after is not None or modified_before is not None:
+            parts.append(self._range(self._sorted_mtime, self._mtime_order, modified_after, modified_before))
+
+        parts.sort(key=len)
+        rows = parts[0]
+        for part in parts[1:]:
+            if not rows.size:
+                break
+            bitmap = np.zeros(len(self), dtype=bool)
+            bitmap[part] = True
+            rows = rows[bitmap[rows]]
+        rows.flags.writeable = False
+
+        with self._lock:
+            self._cache[key] = rows
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return rows
+
+    def facets(self) -> dict:
+        """各类别/标签的图片数"""
+        return {
+            "categories": {c: int(len(rows)) for c, rows in sorted(self.categories.items())},
+            "tags": {t: int(len(rows)) for t, rows in sorted(self.tags.items())},
+        }
@@ -0,0 +1,199 @@
+# ====================================
+# Prometheus 格式指标
+# ====================================
+# 功能：轻量的计数器 / 直方图 / 回调型仪表，按 Prometheus 文本格式导出（/metrics）
+# 开销：每次记录只做一次 bisect 和加锁累加；仪表值在抓取时才通过回调计算，请求路径上无额外开销
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 默认延迟分桶（秒），覆盖毫秒级的检索到数十秒的生成
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """单调递增计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Histogram:
+    """累积分桶直方图（同时导出 _sum 与 _count）"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}   # key -> [各桶计数..., +Inf 计数, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            slots = self._values.get(key)
+            if slots is None:
+                slots = self._values[key] = [0] * (len(self.buckets) + 2)
+            slots[index] += 1
+            slots[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """计时上下文：退出时记录耗时（秒），异常时同样记录"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(slots)) for key, slots in self._values.items()]
+        lines = []
+        for key, slots in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), slots[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(slots[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    回调型仪表：抓取时调用 fn 取值
+
+    fn 返回数值，或 {标签值元组: 数值}（有 labelnames 时）
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+
+    def collect(self) -> List[str]:
+        value = self.fn()
+        if not self.labelnames:
+            return [f"{self.name} {_format_value(value)}"]
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+                for key, v in value.items()]
+
+
+class MetricsRegistry:
+    """指标注册表，render() 输出 Prometheus 文本格式（text/plain; version=0.0.4）"""
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self.prefix + name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Optional[Sequence[float]] = None) -> Histogram:
+        return self._register(Histogram(self.prefix + name, help, labelnames, buckets or DEFAULT_BUCKETS))
+
+    def gauge(self, name: str, help: str, fn: Callable, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self.prefix + name, help, fn, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.collect()
+            except Exception:
+                # 回调失败（如组件尚未初始化）时跳过该指标，不影响其他指标
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI 中间件：按路由模板统计请求数、错误数和延迟
+
+    使用路由模板（如 /images/{image_name}）而不是原始路径作为标签，避免标签基数失控；
+    流式响应的延迟统计到响应体发送完毕为止。
+    """
+
+    def __init__(self, app, requests: Counter, errors: Counter, latency: Histogram):
+        self.app = app
+        self.requests = requests
+        self.errors = errors
+        self.latency = latency
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            endpoint = getattr(route, "path", "unmatched")
+            self.requests.inc(endpoint=endpoint, method=scope.get("method", ""), status=status)
+            if status >= 500:
+                self.errors.inc(endpoint=endpoint)
+            self.latency.observe(time.perf_counter() - start, endpoint=endpoint)
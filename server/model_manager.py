@@ -0,0 +1,210 @@
+# ====================================
+# 模型加载状态管理
+# ====================================
+# 功能：记录每个组件（VQA 模型、CLIP 模型、图片库）的加载状态与耗时，支持：
+#   - 启动时后台加载（多个组件并行，服务先接受连接，就绪的功能先上线）
+#   - 首次使用时加载（lazy）
+#   - 空闲超时后卸载以释放显存/内存，下次使用时自动重新加载
+#   - 加载失败后按指数退避等待，退避结束后的下一次使用自动重试；也可由管理接口立即重新加载
+
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+UNLOADED = "unloaded"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class ModelUnavailable(HTTPException):
+    """组件正在加载或加载失败"""
+
+    def __init__(self, name: str, state: str, retry_after: int):
+        detail = f"{name} 正在加载，请稍后重试" if state == LOADING else f"{name} 加载失败，暂不可用"
+        super().__init__(status_code=503, detail=detail, headers={"Retry-After": str(retry_after)})
+
+
+class ModelComponent:
+    """
+    可加载组件
+
+    load_fn: 加载函数（阻塞执行，失败时抛出异常）
+    unload_fn: 卸载函数，为 None 时不支持空闲卸载
+    lazy: True 时启动阶段不加载，首次 use() 时加载
+    idle_unload: 空闲多少秒后卸载（0 表示不卸载）
+    retry_backoff: 加载失败后首次重试前等待的秒数，连续失败时翻倍，最多 retry_backoff_max 秒
+    auto_retry: False 时失败状态保持到显式调用 load()（如不经 use() 使用的组件）
+    """
+
+    def __init__(self, name: str, load_fn: Callable[[], None], unload_fn: Optional[Callable[[], None]] = None,
+                 lazy: bool = False, idle_unload: float = 0, retry_after: int = 5,
+                 retry_backoff: float = 30, retry_backoff_max: float = 600, auto_retry: bool = True):
+        self.name = name
+        self.load_fn = load_fn
+        self.unload_fn = unload_fn
+        self.lazy = lazy
+        self.idle_unload = idle_unload if unload_fn else 0
+        self.retry_after = retry_after
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = max(retry_backoff, retry_backoff_max)
+        self.auto_retry = auto_retry
+        self.state = UNLOADED
+        self.error = None
+        self.failures = 0                      # 连续加载失败次数
+        self._retry_at = 0.0                   # 失败后允许自动重试的时间（time.monotonic）
+        self.load_seconds = None
+        self.loads = 0
+        self.unloads = 0
+        self.last_used = time.monotonic()
+        self._in_use = 0
+        self._load_lock = threading.Lock()     # 串行化加载/卸载
+        self._usage_lock = threading.Lock()    # 保护使用计数与状态切换
+
+    @property
+    def available(self) -> bool:
+        """已就绪，或处于未加载/失败退避已结束的状态（下次使用时自动加载）"""
+        return self.state in (READY, UNLOADED) or (self.state == FAILED and self._retry_due())
+
+    def retry_in(self) -> float:
+        """加载失败后距离允许自动重试的秒数（未失败时为 0）"""
+        if self.state != FAILED:
+            return 0.0
+        return max(0.0, self._retry_at - time.monotonic())
+
+    def _retry_due(self) -> bool:
+        return self.auto_retry and self.retry_in() == 0
+
+    def _unavailable(self) -> ModelUnavailable:
+        if self.state == FAILED and self.auto_retry:
+            return ModelUnavailable(self.name, FAILED, max(1, math.ceil(self.retry_in())))
+        return ModelUnavailable(self.name, self.state, self.retry_after)
+
+    def load(self, force: bool = True) -> None:
+        """
+        加载组件（已就绪时直接返回；其他线程正在加载时等待其完成）
+
+        force=False 时处于失败退避期内不尝试加载，直接抛出 ModelUnavailable
+        （同时到达的请求在前一个请求重试失败后不再逐个重试）。
+        """
+        with self._load_lock:
+            if self.state == READY:
+                return
+            if not force and self.state == FAILED and not self._retry_due():
+                raise self._unavailable()
+            self.state = LOADING
+            start = time.perf_counter()
+            try:
+                self.load_fn()
+            except Exception as e:
+                self.failures += 1
+                backoff = min(self.retry_backoff * 2 ** (self.failures - 1), self.retry_backoff_max)
+                self._retry_at = time.monotonic() + backoff
+                self.state, self.error = FAILED, str(e)
+                logger.error(f"✗ {self.name} 加载失败（第 {self.failures} 次，{backoff:.0f}s 后允许重试）: {e}")
+                raise
+            self.load_seconds = round(time.perf_counter() - start, 2)
+            self.state, self.error = READY, None
+            self.failures = 0
+            self.loads += 1
+            self.last_used = time.monotonic()
+            logger.info(f"✓ {self.name} 就绪，耗时 {self.load_seconds}s")
+
+    def load_in_background(self) -> threading.Thread:
+        """在后台线程中加载；立即标记为 loading，便于就绪检查反映真实状态"""
+        self.state = LOADING
+        thread = threading.Thread(target=self._load_quietly, daemon=True, name=f"load-{self.name}")
+        thread.start()
+        return thread
+
+    def _load_quietly(self) -> None:
+        try:
+            self.load()
+        except Exception:
+            pass  # 失败状态已记录在 state/error 中
+
+    def check(self) -> None:
+        """请求入口检查：正在加载或处于失败退避期内时立即返回 503，而不是阻塞等待"""
+        if self.state == LOADING or (self.state == FAILED and not self._retry_due()):
+            raise self._unavailable()
+
+    @contextmanager
+    def use(self):
+        """使用组件：未加载时先加载，加载失败且退避期已过时重试；使用期间不会被空闲卸载"""
+        with self._usage_lock:
+            self._in_use += 1
+        try:
+            if self.state != READY:
+                self.load(force=False)
+            yield
+        finally:
+            with self._usage_lock:
+                self._in_use -= 1
+                self.last_used = time.monotonic()
+
+    def unload_if_idle(self) -> bool:
+        """空闲超过 idle_unload 秒且无人使用时卸载，返回是否卸载"""
+        if not self.idle_unload or self.state != READY:
+            return False
+        with self._load_lock:
+            with self._usage_lock:
+                if self.state != READY or self._in_use or time.monotonic() - self.last_used < self.idle_unload:
+                    return False
+                # 在使用计数锁内切换状态，之后进入的 use() 会等待卸载完成再重新加载
+                self.state = UNLOADED
+            try:
+                self.unload_fn()
+            except Exception as e:
+                logger.error(f"✗ {self.name} 卸载失败: {e}")
+            self.unloads += 1
+            logger.info(f"{self.name} 空闲 {self.idle_unload}s，已卸载")
+            return True
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "lazy": self.lazy,
+            "load_seconds": self.load_seconds,
+            "loads": self.loads,
+            "unloads": self.unloads,
+            "in_use": self._in_use,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+            "error": self.error,
+            "failures": self.failures,
+            "retry_in_seconds": round(self.retry_in(), 1),
+        }
+
+
+class IdleUnloader:
+    """后台线程，定期卸载空闲超时的组件"""
+
+    def __init__(self, components: Iterable[ModelComponent], interval: float):
+        self.components = [c for c in components if c.idle_unload]
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is not None or not self.components:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True, name="idle-unloader")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            for component in self.components:
+                component.unload_if_idle()
+
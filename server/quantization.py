@@ -0,0 +1,100 @@
+# ====================================
+# 特征矩阵压缩存储
+# ====================================
+# 功能：将检索用的 (N, D) float32 特征矩阵压缩为 float16 或逐行缩放的 int8，降低常驻内存
+#   - float16：每张图片 2*D 字节，CLIP 余弦相似度误差约 1e-3
+#   - int8：每行对称量化 codes = round(x / scale)，scale = max|x| / 127，每张图片 D + 4 字节
+# 打分：分块反量化为 float32 后做矩阵乘法（NumPy 没有 float16/int8 的 BLAS 路径），
+#       临时内存不超过 block_rows * D * 4 字节
+
+from typing import Optional
+
+import numpy as np
+
+PRECISIONS = ("float32", "float16", "int8")
+
+
+class QuantizedMatrix:
+    """
+    压缩存储的特征矩阵，提供与 float32 ndarray 相同的只读接口：
+    shape / len / matrix[rows]（返回反量化后的 float32）/ matrix @ query / np.asarray(matrix)
+    """
+
+    def __init__(self, codes: np.ndarray, scales: Optional[np.ndarray] = None, block_rows: int = 16384):
+        self.codes = codes
+        self.scales = scales
+        self.block_rows = block_rows
+
+    @property
+    def precision(self) -> str:
+        return "int8" if self.scales is not None else "float16"
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def ndim(self) -> int:
+        return 2
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        values = self.codes[key].astype(np.float32)
+        if self.scales is not None:
+            values *= np.asarray(self.scales[key], dtype=np.float32)[..., None]
+        return values
+
+    def __array__(self, dtype=None, copy=None):
+        values = self[:]
+        return values if dtype is None else values.astype(dtype, copy=False)
+
+    def __matmul__(self, other) -> np.ndarray:
+        """(N, D) @ (D,) 或 (N, D) @ (D, Q)，按行分块反量化后计算"""
+        other = np.asarray(other, dtype=np.float32)
+        out = np.empty((len(self),) + other.shape[1:], dtype=np.float32)
+        for start in range(0, len(self), self.block_rows):
+            end = start + self.block_rows
+            block = self.codes[start:end].astype(np.float32) @ other
+            if self.scales is not None:
+                block *= self.scales[start:end].reshape((-1,) + (1,) * (other.ndim - 1))
+            out[start:end] = block
+        return out
+
+
+def quantize(matrix: np.ndarray, precision: str, rows: Optional[np.ndarray] = None,
+             block_rows: int = 65536):
+    """
+    按 precision 压缩 matrix（可以是磁盘 mmap），rows 不为空时只取这些行
+
+    float32 返回连续的 ndarray 副本，其余返回 QuantizedMatrix；
+    分块读取，不会一次性生成完整的 float32 临时矩阵。
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"不支持的特征存储精度: {precision}，可选 {', '.join(PRECISIONS)}")
+    if precision == "float32":
+        return np.ascontiguousarray(matrix if rows is None else matrix[rows], dtype=np.float32)
+    n = matrix.shape[0] if rows is None else len(rows)
+    codes = np.empty((n, matrix.shape[1]), dtype=np.float16 if precision == "float16" else np.int8)
+    scales = np.empty(n, dtype=np.float32) if precision == "int8" else None
+    for start in range(0, n, block_rows):
+        index = slice(start, start + block_rows) if rows is None else rows[start:start + block_rows]
+        block = np.asarray(matrix[index], dtype=np.float32)
+        end = start + len(block)
+        if scales is None:
+            codes[start:end] = block
+        else:
+            scale = np.abs(block).max(axis=1) / 127.0
+            scale[scale == 0] = 1.0
+            codes[start:end] = np.rint(block / scale[:, None])
+            scales[start:end] = scale
+    return QuantizedMatrix(codes, scales)
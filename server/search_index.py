@@ -0,0 +1,261 @@
+# ====================================
+# 图片库检索索引
+# ====================================
+# 功能：以连续的 (N, D) float32 特征矩阵 + 并行文件名数组保存图片库
+# 检索：一次矩阵-向量乘法计算全部相似度，argpartition 选出 top-k
+#       多条查询时用矩阵-矩阵乘法一次算出 (Q, N) 相似度矩阵
+#       挂载 ANN 索引（见 ann_index.py）时只对候选簇内的向量打分
+# 去重：近重复图片折叠后每组只有代表图片参与检索，其余作为别名返回
+# 压缩：检索矩阵可存为 float16 / int8（见 quantization.py），候选再用全精度特征重排
+# 过滤：传入元数据过滤得到的行号（见 metadata.py）时只对这些行打分
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from quantization import quantize
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回得分最高的 k 个下标（按得分降序），复杂度 O(N + k log k)"""
+    n = scores.shape[0]
+    k = min(max(int(k), 0), n)
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class ImageLibrary:
+    """
+    图片库特征索引
+
+    embeddings 为行归一化的 (N, D) float32 矩阵（可以是磁盘缓存的 mmap），
+    names[i] 为第 i 行对应的文件名；ann_index 为可选的近似检索索引（建立在 search_matrix 上）。
+    collapse() 之后 search_rows 为参与检索的行号，aliases 为 代表图片 -> 重复图片列表。
+    metadata 为可选的元数据过滤索引（MetadataIndex），行号与 names 一致。
+
+    precision 为 float16 / int8 时 search_matrix 为压缩矩阵，embeddings 只在重排时按行读取
+    （磁盘缓存的 mmap 不会整体驻留内存）；rerank_factor > 0 时先在压缩矩阵上取
+    top_k * rerank_factor 个候选，再用 embeddings 的 float32 特征精确打分。
+    """
+
+    def __init__(self, names: Sequence[str], embeddings: np.ndarray, precision: str = "float32",
+                 rerank_factor: int = 0):
+        mapped = isinstance(embeddings, np.memmap)
+        embeddings = np.asarray(embeddings)
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(names):
+            raise ValueError(f"特征矩阵形状 {embeddings.shape} 与文件数 {len(names)} 不匹配")
+        if embeddings.dtype != np.float32 or not embeddings.flags["C_CONTIGUOUS"]:
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+            mapped = False
+        self.embeddings = embeddings
+        self._mapped = mapped   # embeddings 是否为磁盘 mmap（不常驻内存）
+        self.names = np.asarray(list(names), dtype=object)
+        self._positions: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        self.ann_index = None
+        self.metadata = None
+        self.search_rows: Optional[np.ndarray] = None
+        self._search_position: Optional[np.ndarray] = None
+        self._representative: Optional[np.ndarray] = None   # 图片库行号 -> 所在重复组代表图片的行号
+        self.aliases: Dict[str, List[str]] = {}
+        self.precision = precision
+        self.rerank_factor = rerank_factor if precision != "float32" else 0
+        self._search_matrix = None
+        self._build_search_matrix()
+
+    @classmethod
+    def empty(cls, dim: int = 0) -> "ImageLibrary":
+        return cls([], np.zeros((0, dim), dtype=np.float32))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._positions
+
+    @property
+    def dim(self) -> int:
+        return self.embeddings.shape[1]
+
+    def position(self, name: str) -> int:
+        return self._positions[name]
+
+    def vector(self, name: str) -> np.ndarray:
+        return self.embeddings[self._positions[name]]
+
+    def collapse(self, groups: Sequence[Sequence[int]], priority: Optional[np.ndarray] = None) -> None:
+        """
+        近重复折叠：每组只保留一张代表图片参与检索，其余记为代表图片的别名
+
+        代表图片取 priority 最高者（如文件大小，优先保留原图），相同时取行号最小者。
+        """
+        if not groups:
+            self.search_rows, self._search_position, self._representative, self.aliases = None, None, None, {}
+            self._build_search_matrix()
+            return
+        priority = np.zeros(len(self)) if priority is None else np.asarray(priority)
+        drop = np.zeros(len(self), dtype=bool)
+        representative = np.arange(len(self), dtype=np.int64)
+        aliases = {}
+        for group in groups:
+            group = np.asarray(group, dtype=np.int64)
+            rep = group[np.lexsort((group, -priority[group]))[0]]
+            duplicates = group[group != rep]
+            drop[duplicates] = True
+            representative[duplicates] = rep
+            aliases[self.names[rep]] = sorted(self.names[duplicates])
+        self.search_rows = np.flatnonzero(~drop)
+        self._search_position = np.full(len(self), -1, dtype=np.int64)
+        self._search_position[self.search_rows] = np.arange(len(self.search_rows))
+        self._representative = representative
+        self.aliases = aliases
+        self._build_search_matrix()
+
+    def _build_search_matrix(self) -> None:
+        if self.precision == "float32" and self.search_rows is None:
+            self._search_matrix = None
+        else:
+            self._search_matrix = quantize(self.embeddings, self.precision, rows=self.search_rows)
+
+    def duplicate_groups(self) -> List[List[int]]:
+        """当前的重复组（行号），用于增量更新时延续已有分组"""
+        return [[self._positions[rep]] + [self._positions[d] for d in dups] for rep, dups in self.aliases.items()]
+
+    @property
+    def search_matrix(self):
+        """参与检索的特征矩阵（折叠后只含代表图片；压缩存储时为 QuantizedMatrix）"""
+        return self.embeddings if self._search_matrix is None else self._search_matrix
+
+    @property
+    def search_size(self) -> int:
+        return self.search_matrix.shape[0]
+
+    def memory_stats(self) -> dict:
+        """检索矩阵的常驻内存（mmap 的 float32 特征按需换入，不计入）"""
+        matrix = self.search_matrix
+        resident = 0 if self._search_matrix is None and self._mapped else int(matrix.nbytes)
+        return {
+            "precision": self.precision,
+            "rerank_factor": self.rerank_factor,
+            "search_matrix_bytes": resident,
+            "bytes_per_image": round(matrix.nbytes / self.search_size, 1) if self.search_size else 0,
+        }
+
+    def _names_for(self, rows: np.ndarray) -> np.ndarray:
+        """search_matrix 的行号 -> 文件名"""
+        if self.search_rows is not None:
+            rows = self.search_rows[rows]
+        return self.names[rows]
+
+    def _to_search_rows(self, rows: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        过滤后的图片库行号 -> (search_matrix 行号（升序、去重）, 各行结果显示的图片库行号)
+
+        折叠掉的重复图片满足条件时按所在组的代表图片打分；代表图片本身不满足条件时，
+        结果显示满足条件的重复图片（同组多张时取行号最小者）。未折叠时第二项为 None。
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if self._search_position is None:
+            return rows, None
+        positions = self._search_position[self._representative[rows]]
+        is_representative = self._search_position[rows] >= 0
+        order = np.lexsort((rows, ~is_representative, positions))
+        positions, shown = positions[order], rows[order]
+        first = np.ones(len(positions), dtype=bool)
+        first[1:] = positions[1:] != positions[:-1]
+        return positions[first], shown[first]
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """query 为 (D,) 或 (1, D) 的归一化向量，返回与 search_matrix 各行的余弦相似度"""
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        return self.search_matrix @ query
+
+    def _candidates(self, top_k: int) -> int:
+        """压缩矩阵上选取的候选数（需要重排时放大）"""
+        return top_k * self.rerank_factor if self.rerank_factor else top_k
+
+    def _rerank(self, rows: np.ndarray, query: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """用 embeddings 中的 float32 特征对候选精确打分（行号排序后读取，对 mmap 更友好）"""
+        rows = np.sort(rows)
+        full_rows = rows if self.search_rows is None else self.search_rows[rows]
+        scores = np.asarray(self.embeddings[full_rows], dtype=np.float32) @ query
+        idx = top_k_indices(scores, top_k)
+        return rows[idx], scores[idx]
+
+    def _results(self, rows: np.ndarray, scores: np.ndarray, filtered: Optional[np.ndarray] = None,
+                 shown: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """search_matrix 行号 -> [(文件名, 相似度)]；shown 为 _to_search_rows 给出的显示行（与升序的 filtered 对应）"""
+        if shown is None:
+            names = self._names_for(rows)
+        else:
+            names = self.names[shown[np.searchsorted(filtered, rows)]]
+        return [(name, float(score)) for name, score in zip(names, scores)]
+
+    def search(self, query: np.ndarray, top_k: int, exact: bool = False,
+               nprobe: Optional[int] = None, rows: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """
+        返回 [(文件名, 相似度)]，按相似度降序；exact=True 时忽略 ANN 索引
+
+        rows 为过滤后的图片库行号（升序）时只在这些行中精确检索。
+        """
+        if len(self) == 0:
+            return []
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        if rows is not None:
+            return self.search_batch(query[None, :], top_k, rows=rows)[0]
+        candidates = self._candidates(top_k)
+        if self.ann_index is not None and not exact:
+            rows, scores = self.ann_index.search(self.search_matrix, query, candidates, nprobe)
+        else:
+            scores = self.scores(query)
+            rows = top_k_indices(scores, candidates)
+            scores = scores[rows]
+        if self.rerank_factor:
+            rows, scores = self._rerank(rows, query, top_k)
+        return self._results(rows, scores)
+
+    def search_batch(self, queries: np.ndarray, top_k: int, exact: bool = False,
+                     nprobe: Optional[int] = None, rows: Optional[np.ndarray] = None,
+                     block_elements: int = 1 << 24) -> List[List[Tuple[str, float]]]:
+        """
+        多条查询检索，queries 为 (Q, D) 归一化矩阵，返回每条查询的 [(文件名, 相似度)]
+
+        精确检索按查询分块做矩阵-矩阵乘法，单块相似度矩阵不超过 block_elements 个元素；
+        挂载 ANN 索引且 exact=False 时逐条走 ANN 检索。
+        rows 为过滤后的图片库行号时始终精确检索（满足条件的重复图片按所在组参与，见 _to_search_rows）：匹配行不超过一半时先取出这些行再打分
+        （代价与匹配行数成正比），否则整体打分后只取匹配列。
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if len(self) == 0:
+            return [[] for _ in range(queries.shape[0])]
+        if rows is None and self.ann_index is not None and not exact:
+            return [self.search(query, top_k, nprobe=nprobe) for query in queries]
+        matrix = self.search_matrix
+        gathered = False
+        shown = None
+        if rows is not None:
+            rows, shown = self._to_search_rows(rows)
+            if rows.size == 0:
+                return [[] for _ in range(queries.shape[0])]
+            if rows.size * 2 <= matrix.shape[0]:
+                matrix, gathered = matrix[rows], True
+        results = []
+        candidates = self._candidates(top_k)
+        block = max(1, block_elements // matrix.shape[0])
+        for start in range(0, queries.shape[0], block):
+            scores = (matrix @ queries[start:start + block].T).T
+            if rows is not None and not gathered:
+                scores = scores[:, rows]
+            for query, row in zip(queries[start:start + block], scores):
+                idx = top_k_indices(row, candidates)
+                hits = idx if rows is None else rows[idx]
+                if self.rerank_factor:
+                    hits, hit_scores = self._rerank(hits, query, top_k)
+                else:
+                    hit_scores = row[idx]
+                results.append(self._results(hits, hit_scores, rows, shown))
+        return results
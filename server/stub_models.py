@@ -0,0 +1,211 @@
+# ====================================
+# 基准测试用的轻量替身模型
+# ====================================
+# 用途：在没有 GPU、不下载模型权重的环境下启动完整服务，测量调度、预处理、检索和序列化的开销
+# 特点：输出确定（同样的输入总是得到同样的特征/答案），延迟可配置，用于模拟真实模型的耗时
+#   - StubCLIPModel：图片特征 = 8x8 平均池化后的固定随机投影（相似图片得到相近特征），
+#                    文本特征 = 按 token 哈希生成的随机单位向量
+#   - StubVQAModel / StubVQAProcessor：字节级分词，generate 按 "预填充 + 每 token" 的延迟生成固定答案
+
+import time
+import hashlib
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torchvision import transforms
+
+IMAGE_PAD = "<|image_pad|>"
+
+
+class ByteTokenizer:
+    """字节级分词器：token id = 字节值 + 1，0 为填充"""
+
+    pad_token_id = 0
+
+    def __init__(self, max_length: int = 0):
+        self.max_length = max_length
+        self.padding_side = "right"
+
+    def encode(self, text):
+        ids = [b + 1 for b in text.encode("utf-8")]
+        return ids[:self.max_length] if self.max_length else ids
+
+    def __call__(self, texts, return_tensors="pt", padding=True, truncation=True, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        encoded = [self.encode(t) for t in texts]
+        return {"input_ids": _pad(encoded, self.pad_token_id, self.padding_side)}
+
+    def decode(self, ids, skip_special_tokens=True, **kwargs):
+        if torch.is_tensor(ids):
+            ids = ids.tolist()
+        return bytes(i - 1 for i in ids if 0 < i <= 256).decode("utf-8", errors="ignore")
+
+    def batch_decode(self, sequences, **kwargs):
+        return [self.decode(seq, **kwargs) for seq in sequences]
+
+
+def _pad(sequences, pad_id, side):
+    length = max((len(s) for s in sequences), default=0)
+    rows = [([pad_id] * (length - len(s)) + s) if side == "left" else (s + [pad_id] * (length - len(s)))
+            for s in sequences]
+    return torch.tensor(rows, dtype=torch.long).reshape(len(sequences), length)
+
+
+def _hash_vector(key: bytes, dim: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha1(key).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class _StubCLIPInner:
+    def __init__(self, dim: int, latency_ms: float):
+        self.dim = dim
+        self.latency = latency_ms / 1000.0
+        generator = torch.Generator().manual_seed(0)
+        self.projection = torch.randn(3 * 8 * 8, dim, generator=generator)
+
+    def encode_image(self, batch):
+        time.sleep(self.latency)
+        pooled = F.adaptive_avg_pool2d(batch.float().cpu(), 8).flatten(1)
+        return pooled @ self.projection
+
+    def encode_text(self, input_ids):
+        time.sleep(self.latency)
+        rows = [_hash_vector(bytes(str([i for i in row if i]), "utf-8"), self.dim) for row in input_ids.tolist()]
+        return torch.from_numpy(np.stack(rows))
+
+
+class StubCLIPModel:
+    """与 ModelScope CLIP 相同的调用方式：model.clip_model.encode_image / encode_text"""
+
+    def __init__(self, dim: int = 512, latency_ms: float = 5):
+        self.clip_model = _StubCLIPInner(dim, latency_ms)
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+
+class _StubBatch(dict):
+    """模拟 processor 返回的 BatchFeature：支持属性访问与 .to(device)"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def to(self, device):
+        return self
+
+
+class StubVQAProcessor:
+    """模拟 Qwen2.5-VL 的 AutoProcessor：chat template、图片占位符展开、批量解码"""
+
+    def __init__(self):
+        self.tokenizer = ByteTokenizer()
+        self.image_processor = SimpleNamespace(merge_size=2)
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        parts = []
+        for message in messages:
+            content = "".join(IMAGE_PAD if c.get("type") == "image" else c.get("text", "") for c in message["content"])
+            parts.append(f"<{message['role']}>{content}")
+        if add_generation_prompt:
+            parts.append("<assistant>")
+        return "".join(parts)
+
+    def __call__(self, text, images=None, videos=None, padding=True, return_tensors="pt", **kwargs):
+        images = list(images or [])
+        grids, sequences, image_index = [], [], 0
+        for prompt in text:
+            ids = []
+            for i, chunk in enumerate(prompt.split(IMAGE_PAD)):
+                if i > 0:
+                    # 与真实 processor 一样，每张图片按 14x14 patch、2x2 合并展开为若干视觉 token
+                    width, height = images[image_index].size
+                    grid = [1, max(2, height // 14), max(2, width // 14)]
+                    grids.append(grid)
+                    ids.extend([1] * (grid[1] * grid[2] // 4))
+                    image_index += 1
+                ids.extend(self.tokenizer.encode(chunk))
+            sequences.append(ids)
+        input_ids = _pad(sequences, self.tokenizer.pad_token_id, self.tokenizer.padding_side)
+        return _StubBatch(
+            input_ids=input_ids,
+            attention_mask=(input_ids != self.tokenizer.pad_token_id).long(),
+            pixel_values=torch.zeros(len(grids), 1),
+            image_grid_thw=torch.tensor(grids or [[1, 2, 2]], dtype=torch.long),
+        )
+
+    def batch_decode(self, sequences, **kwargs):
+        return self.tokenizer.batch_decode(sequences, **kwargs)
+
+
+class StubVQAModel:
+    """
+    模拟 generate：耗时 = prefill_ms + 生成 token 数 * token_ms
+
+    答案由 prompt 哈希决定（同一问题总是得到同一答案），长度不超过 answer_tokens 和 max_new_tokens。
+    """
+
+    def __init__(self, prefill_ms: float = 50, token_ms: float = 10, answer_tokens: int = 32):
+        self.prefill = prefill_ms / 1000.0
+        self.token = token_ms / 1000.0
+        self.answer_tokens = answer_tokens
+
+    def eval(self):
+        return self
+
+    def _answer(self, row, length):
+        digest = hashlib.sha1(str(row.tolist()).encode()).hexdigest()
+        text = f"stub answer {digest} "
+        text = text * (length // len(text) + 1)
+        return [b + 1 for b in text.encode("utf-8")][:length]
+
+    def generate(self, input_ids=None, max_new_tokens=128, streamer=None, stopping_criteria=None,
+                 return_dict_in_generate=False, **kwargs):
+        limit = min(self.answer_tokens, max_new_tokens)
+        answers = [self._answer(row, limit) for row in input_ids]
+        sequences = input_ids
+        if streamer is not None:
+            streamer.put(input_ids[0])
+        time.sleep(self.prefill)
+        for step in range(limit):
+            time.sleep(self.token)
+            column = torch.tensor([[a[step]] for a in answers], dtype=input_ids.dtype)
+            sequences = torch.cat([sequences, column], dim=1)
+            if streamer is not None:
+                streamer.put(column[0])
+            if stopping_criteria is not None and any(bool(c(sequences, None)) for c in stopping_criteria):
+                break
+        if streamer is not None:
+            streamer.end()
+        if return_dict_in_generate:
+            return SimpleNamespace(sequences=sequences, past_key_values=None)
+        return sequences
+
+
+def install(app_module, clip_dim: int = 512, clip_latency_ms: float = 5,
+            prefill_ms: float = 50, token_ms: float = 10, answer_tokens: int = 32):
+    """将服务的模型加载函数替换为替身模型（需在服务启动前调用）"""
+
+    def load_vqa():
+        app_module.vqa_model = StubVQAModel(prefill_ms, token_ms, answer_tokens)
+        app_module.vqa_processor = StubVQAProcessor()
+        app_module.vqa_processor.tokenizer.padding_side = "left"
+
+    def load_clip():
+        app_module.clip_model = StubCLIPModel(clip_dim, clip_latency_ms)
+        app_module.clip_tokenizer = ByteTokenizer(max_length=52)
+        app_module.clip_preprocessor = transforms.Compose([transforms.Resize((64, 64)), transforms.ToTensor()])
+
+    app_module.vqa_component.load_fn = load_vqa
+    app_module.clip_component.load_fn = load_clip
+    # 替身模型的特征与真实模型不同，使用独立的缓存标识
+    app_module.clip_model_tag = lambda: {"model_id": "stub", "dim": clip_dim}
@@ -0,0 +1,82 @@
+# ====================================
+# 替身模型服务（基准测试用）
+# ====================================
+# 用途：用 stub_models 中的替身模型启动完整的 app.py 服务，无需 GPU 和模型下载
+# 图片库：在临时目录生成合成图片（含部分缩放后的近重复副本），特征缓存同样放在临时目录
+#
+# 用法：
+#   python stub_server.py --images 1000 --prefill-ms 50 --token-ms 10
+#   python benchmark_load.py --url http://127.0.0.1:8000 --endpoint vqa --endpoint search
+
+import os
+import argparse
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+
+def generate_library(path, count, seed=0, duplicate_ratio=0.1):
+    """生成合成图片库：随机色块渐变图，其中 duplicate_ratio 比例为已有图片缩放后的副本"""
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    originals = []
+    for i in range(count):
+        name = f"synthetic_{i:06d}.jpg"
+        if originals and rng.random() < duplicate_ratio:
+            source = Image.open(os.path.join(path, originals[rng.integers(len(originals))]))
+            source.resize((source.width // 2, source.height // 2)).save(os.path.join(path, name), quality=75)
+            continue
+        base = rng.integers(0, 256, size=(4, 4, 3), dtype=np.uint8)
+        image = Image.fromarray(base).resize((320, 240), Image.BILINEAR)
+        image.save(os.path.join(path, name), quality=90)
+        originals.append(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用替身模型启动服务（基准测试用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--images", type=int, default=1000, help="合成图片库的图片数")
+    parser.add_argument("--workdir", default="", help="图片库与缓存目录，留空则使用临时目录")
+    parser.add_argument("--clip-dim", type=int, default=512)
+    parser.add_argument("--clip-latency-ms", type=float, default=5, help="每次 CLIP 编码调用的延迟")
+    parser.add_argument("--prefill-ms", type=float, default=50, help="每次 generate 的预填充延迟")
+    parser.add_argument("--token-ms", type=float, default=10, help="每个生成 token 的延迟")
+    parser.add_argument("--answer-tokens", type=int, default=32, help="每个答案的 token 数")
+    parser.add_argument("--no-cache", action="store_true", help="关闭 VQA 答案缓存（测量真实推理路径）")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="multimodal-bench-")
+    library_path = os.path.join(workdir, "image_library")
+    if not os.path.isdir(library_path) or not os.listdir(library_path):
+        generate_library(library_path, args.images)
+
+    # 必须在导入 app 之前修改配置：app 在导入时创建缓存目录和各类缓存对象
+    import config
+    config.IMAGE_LIBRARY_PATH = library_path
+    config.EMBEDDING_CACHE_DIR = os.path.join(workdir, "index_cache")
+    config.THUMBNAIL_CACHE_DIR = os.path.join(workdir, "index_cache", "thumbnails")
+    config.VQA_CACHE_DIR = ""
+    config.VQA_CACHE_ENABLED = not args.no_cache
+    config.LIBRARY_WATCH_ENABLED = False
+    config.DEVICE = "cpu"
+
+    import app as server
+    import stub_models
+    stub_models.install(
+        server,
+        clip_dim=args.clip_dim,
+        clip_latency_ms=args.clip_latency_ms,
+        prefill_ms=args.prefill_ms,
+        token_ms=args.token_ms,
+        answer_tokens=args.answer_tokens,
+    )
+
+    import uvicorn
+    print(f"替身模型服务: http://{args.host}:{args.port}（工作目录 {workdir}）")
+    uvicorn.run(server.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
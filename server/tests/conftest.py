@@ -0,0 +1,5 @@
+# 服务端模块为 server/ 下的平铺模块，测试直接按模块名导入
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,19 @@
+# 准入名额的占用与释放
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from concurrency import InferencePool, Overloaded
+
+
+def test_reserve_release_is_idempotent():
+    pool = InferencePool("vqa", max_workers=1, max_pending=1)
+    release = pool.reserve()
+    with pytest.raises(Overloaded):
+        pool.reserve()
+    release()
+    release()   # 流结束与后台任务都会调用，第二次不再减少计数
+    assert pool.in_flight == 0
+    pool.reserve()
+    assert pool.in_flight == 1
@@ -0,0 +1,76 @@
+# 近重复分组：增量更新与分组的保存/复用
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from dedup import find_duplicate_groups, group_rows, load_groups, save_groups
+
+THRESHOLD = 0.97
+
+
+def chain_library():
+    """a~b、b~c 超过阈值而 a·c ≈ 0.92；d~e 为另一组；f 与其他图片都不相似"""
+    step = np.arccos(0.98)
+    vectors = np.zeros((6, 4), dtype=np.float32)
+    for i in range(3):
+        vectors[i, :2] = np.cos(i * step), np.sin(i * step)
+    vectors[3, 2] = vectors[4, 2] = 1
+    vectors[5, 3] = 1
+    return ["a.jpg", "b.jpg", "c.jpg", "d.jpg", "e.jpg", "f.jpg"], vectors
+
+
+def as_lists(groups):
+    return sorted(sorted(int(r) for r in g) for g in groups)
+
+
+def test_chain_splits_when_middle_member_removed():
+    names, vectors = chain_library()
+    assert as_lists(find_duplicate_groups(vectors, THRESHOLD)) == [[0, 1, 2], [3, 4]]
+
+    # 删除 b：新库行号 a=0, c=1, d=2, e=3, f=4
+    keep = [0, 2, 3, 4, 5]
+    remaining = vectors[keep]
+    incremental = find_duplicate_groups(remaining, THRESHOLD, new_rows=np.zeros(0, dtype=np.int64),
+                                        seed_groups=[[2, 3]], split_groups=[[0, 1]])
+    assert as_lists(incremental) == as_lists(find_duplicate_groups(remaining, THRESHOLD)) == [[2, 3]]
+
+
+def test_chain_splits_when_middle_member_changed():
+    _, vectors = chain_library()
+    vectors[1] = [0, 0, np.sqrt(0.5), -np.sqrt(0.5)]
+    incremental = find_duplicate_groups(vectors, THRESHOLD, new_rows=np.array([1]),
+                                        seed_groups=[[3, 4]], split_groups=[[0, 2]])
+    assert as_lists(incremental) == as_lists(find_duplicate_groups(vectors, THRESHOLD)) == [[3, 4]]
+
+
+def test_reloaded_groups_match_fresh_detection(tmp_path):
+    names, vectors = chain_library()
+    keep = [0, 2, 3, 4, 5]
+    names, remaining = [names[i] for i in keep], vectors[keep]
+    incremental = find_duplicate_groups(remaining, THRESHOLD, new_rows=np.zeros(0, dtype=np.int64),
+                                        seed_groups=[[2, 3]], split_groups=[[0, 1]])
+    path = str(tmp_path / "dedup_groups.json")
+    save_groups(path, f"embeddings-2.npy:{THRESHOLD}", [[names[r] for r in g] for g in incremental])
+
+    reloaded = load_groups(path, f"embeddings-2.npy:{THRESHOLD}")
+    fresh = find_duplicate_groups(remaining, THRESHOLD)
+    assert reloaded == [[names[r] for r in g] for g in fresh] == [["d.jpg", "e.jpg"]]
+
+
+def test_group_rows_resolves_long_chains():
+    n = 1000
+    pairs = np.stack([np.arange(n - 1, 0, -1), np.arange(n - 2, -1, -1)], axis=1)
+    groups = group_rows(n + 2, pairs, seed_groups=[[n, n + 1]])
+    assert as_lists(groups) == [list(range(n)), [n, n + 1]]
+
+
+def test_saved_groups_reused_only_for_same_source(tmp_path):
+    path = str(tmp_path / "dedup_groups.json")
+    groups = [["cat.jpg", "cat3.jpg"], ["城市夜景.jpg", "城市夜景2.jpg", "城市夜景3.jpg"]]
+    save_groups(path, "embeddings-1.npy:0.95", groups)
+
+    assert load_groups(path, "embeddings-1.npy:0.95") == groups
+    assert load_groups(path, "embeddings-1.npy:0.9") is None
+    assert load_groups(path, "embeddings-2.npy:0.95") is None
+    assert load_groups(str(tmp_path / "missing.json"), "embeddings-1.npy:0.95") is None
@@ -0,0 +1,41 @@
+# 元数据类别：使用仓库自带的 image_library/ 示例图片文件名，而不是合成的文件名
+
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from metadata import MetadataIndex, category_from_name, load_records
+
+LIBRARY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "image_library")
+NAMES = sorted(f for f in os.listdir(LIBRARY) if f.lower().endswith((".jpg", ".jpeg", ".png", ".bmp", ".webp")))
+
+
+def test_every_sample_image_has_a_category():
+    assert NAMES
+    assert [n for n in NAMES if not category_from_name(n, "_-")] == []
+
+
+@pytest.mark.parametrize("name, category", [
+    ("cat.jpg", "cat"),
+    ("cat3.jpg", "cat"),
+    ("dog11.jpg", "dog"),
+    ("city_night.jpg", "city_night"),
+    ("city_night2.jpg", "city_night"),
+    ("dog_and_cat.jpg", "dog_and_cat"),
+    ("dogandcat1.jpg", "dogandcat"),
+    ("cat_001.jpg", "cat"),
+    ("001.jpg", ""),
+])
+def test_category_from_name(name, category):
+    assert category_from_name(name, "_-") == category
+
+
+def test_filter_by_category_on_sample_library():
+    records = load_records(LIBRARY, NAMES)
+    index = MetadataIndex(NAMES, records)
+    cats = [NAMES[i] for i in index.select(categories=["cat"])]
+    assert cats == ["cat.jpg", "cat11.jpg", "cat3.jpg", "cat5.jpg"]
+    night = [NAMES[i] for i in index.select(categories=["City_Night"])]
+    assert night == [f"city_night{s}.jpg" for s in ("", "2", "3", "4", "5")]
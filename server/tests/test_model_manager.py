@@ -0,0 +1,63 @@
+# 加载失败后的退避重试
+
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from model_manager import FAILED, READY, ModelComponent, ModelUnavailable
+
+
+def flaky_loader(failures):
+    calls = []
+
+    def load():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise RuntimeError("下载失败")
+    return load, calls
+
+
+def test_failed_component_retries_after_backoff():
+    load, calls = flaky_loader(failures=1)
+    component = ModelComponent("VQA 模型", load, retry_backoff=0.05)
+    with pytest.raises(RuntimeError):
+        component.load()
+    assert component.state == FAILED and not component.available
+
+    # 退避期内不重试加载
+    with pytest.raises(ModelUnavailable):
+        component.check()
+    with pytest.raises(ModelUnavailable):
+        with component.use():
+            pass
+    assert len(calls) == 1
+
+    time.sleep(0.06)
+    assert component.available
+    component.check()
+    with component.use():
+        pass
+    assert component.state == READY and component.failures == 0 and len(calls) == 2
+
+
+def test_backoff_doubles_and_manual_load_skips_it():
+    load, calls = flaky_loader(failures=2)
+    component = ModelComponent("CLIP 模型", load, retry_backoff=10, retry_backoff_max=15)
+    for expected in (10, 15):
+        with pytest.raises(RuntimeError):
+            component.load()
+        assert expected - 1 < component.retry_in() <= expected
+    component.load()
+    assert component.state == READY and len(calls) == 3
+
+
+def test_without_auto_retry_failure_persists():
+    load, _ = flaky_loader(failures=1)
+    component = ModelComponent("图片库", load, retry_backoff=0, auto_retry=False)
+    with pytest.raises(RuntimeError):
+        component.load()
+    with pytest.raises(ModelUnavailable):
+        component.check()
+    assert not component.available
@@ -0,0 +1,45 @@
+# 过滤检索与近重复折叠
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from search_index import ImageLibrary
+
+
+def make_library(n=12, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    # n10、n11 为 n9 的近重复
+    embeddings[10] = embeddings[11] = embeddings[9]
+    library = ImageLibrary([f"n{i}" for i in range(n)], embeddings)
+    priority = np.zeros(n)
+    priority[9] = 1
+    library.collapse([[9, 10, 11]], priority=priority)
+    return library
+
+
+def test_filter_matching_only_duplicates_returns_them():
+    library = make_library()
+    query = library.vector("n9")
+    results = library.search(query, 5, rows=np.array([10, 11]))
+    assert [name for name, _ in results] == ["n10"]
+    assert results[0][1] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_filter_matching_representative_returns_representative():
+    library = make_library()
+    query = library.vector("n9")
+    results = library.search(query, 5, rows=np.array([3, 9, 10]))
+    names = [name for name, _ in results]
+    assert names[0] == "n9"
+    assert sorted(names) == ["n3", "n9"]
+
+
+def test_filter_without_collapse():
+    library = make_library()
+    library.collapse([])
+    results = library.search(library.vector("n2"), 3, rows=np.array([1, 2]))
+    assert [name for name, _ in results][0] == "n2"
+    assert len(results) == 2
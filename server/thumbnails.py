@@ -0,0 +1,97 @@
+# ====================================
+# 检索结果缩略图缓存
+# ====================================
+# 功能：为图片库图片生成尺寸受限的 JPEG 缩略图
+# 缓存：内存 LRU（按字节数限制）+ 磁盘目录，两级命中后无需再解码原图
+
+import io
+import os
+import hashlib
+import logging
+from typing import Optional
+
+from caches import LRUCache
+from image_io import open_image
+
+logger = logging.getLogger(__name__)
+
+
+def render_thumbnail(path: str, max_side: int, quality: int = 85, max_image_pixels: int = 0,
+                     backend: str = "auto") -> bytes:
+    """生成最长边不超过 max_side 的 JPEG 缩略图；原图像素数超过 max_image_pixels 时抛出 ImageTooLarge"""
+    # JPEG 在解码时直接缩小到不小于 max_side，避免解码完整分辨率
+    image = open_image(path, min_size=(max_side, max_side), max_image_pixels=max_image_pixels, backend=backend)
+    image.thumbnail((max_side, max_side))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+class ThumbnailCache:
+    """
+    两级缩略图缓存
+
+    version 为图片内容标识（内容哈希或 大小-mtime），原图变化后自动生成新缩略图，
+    同时作为 HTTP ETag 的一部分。
+    """
+
+    def __init__(self, cache_dir: Optional[str], max_side: int = 256, quality: int = 85,
+                 memory_bytes: int = 64 * 1024 * 1024, max_image_pixels: int = 0, backend: str = "auto"):
+        self.cache_dir = cache_dir
+        self.max_side = max_side
+        self.quality = quality
+        self.max_image_pixels = max_image_pixels
+        self.backend = backend
+        self.memory = LRUCache(max_entries=0, max_bytes=memory_bytes, sizeof=len)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def etag(self, version: str) -> str:
+        return f'"{version}-{self.max_side}"'
+
+    def _disk_path(self, version: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        key = hashlib.sha1(f"{version}:{self.max_side}:{self.quality}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + ".jpg")
+
+    def get(self, path: str, version: str) -> bytes:
+        """返回缩略图字节，依次查找内存、磁盘，均未命中时生成并写入两级缓存"""
+        data = self.memory.get(version)
+        if data is not None:
+            return data
+
+        disk_path = self._disk_path(version)
+        if disk_path and os.path.exists(disk_path):
+            try:
+                with open(disk_path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+        if data is None:
+            data = self._render(path)
+            if disk_path:
+                try:
+                    self._write(disk_path, data)
+                except OSError as e:
+                    logger.warning(f"缩略图写入磁盘缓存失败: {e}")
+        self.memory.put(version, data)
+        return data
+
+    def _render(self, path: str) -> bytes:
+        return render_thumbnail(path, self.max_side, self.quality, self.max_image_pixels, self.backend)
+
+    @staticmethod
+    def _write(disk_path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+        tmp_path = disk_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, disk_path)
+
+    def pregenerate(self, path: str, version: str) -> None:
+        """仅确保磁盘缓存存在（不占用内存缓存），用于图片库构建后预生成"""
+        disk_path = self._disk_path(version)
+        if disk_path is None or os.path.exists(disk_path):
+            return
+        self._write(disk_path, self._render(path))
@@ -0,0 +1,137 @@
+# ====================================
+# 多轮 VQA 会话管理
+# ====================================
+# 功能：图片只上传一次，后续追问复用预处理后的视觉输入和已有前缀的 KV cache
+# 回收：空闲超过 TTL 的会话被删除；模型侧缓存总量超过上限时，
+#       先释放最久未使用会话的 KV cache（会话仍可继续，只是下一轮需完整预填充），
+#       会话数超过上限时删除最久未使用的会话
+
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class VQASession:
+    """
+    单个会话
+
+    messages: Qwen chat template 格式的对话历史（第一轮用户消息包含图片）
+    pixel_budget: 图片的像素预算（min_pixels/max_pixels），整个会话保持不变以便复用 KV cache
+    state: 模型侧缓存（视觉输入、KV cache、已处理的 token 序列等），由调用方维护
+    lock: 串行化同一会话内的提问，保证历史与 KV cache 一致
+    """
+
+    def __init__(self, session_id: str, image: Any, pixel_budget: Optional[dict] = None):
+        self.session_id = session_id
+        self.image = image
+        self.pixel_budget = pixel_budget
+        self.messages = []
+        self.turns = 0
+        self.state = None
+        self.state_bytes = 0
+        self.lock = threading.Lock()
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+
+    def release_state(self) -> None:
+        self.state = None
+        self.state_bytes = 0
+
+
+class SessionStore:
+    """会话存储：按最近使用排序，支持空闲 TTL、会话数上限和模型侧缓存总字节上限"""
+
+    def __init__(self, ttl: float = 600, max_sessions: int = 256, max_state_bytes: int = 0):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_state_bytes = max_state_bytes
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self.states_released = 0
+
+    def create(self, image: Any, pixel_budget: Optional[dict] = None) -> VQASession:
+        session = VQASession(uuid.uuid4().hex, image, pixel_budget)
+        with self._lock:
+            self._purge_expired()
+            self._sessions[session.session_id] = session
+            self.created += 1
+            while self.max_sessions and len(self._sessions) > self.max_sessions:
+                _, oldest = self._sessions.popitem(last=False)
+                oldest.release_state()
+                self.evicted += 1
+        return session
+
+    def get(self, session_id: str) -> Optional[VQASession]:
+        with self._lock:
+            self._purge_expired()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.release_state()
+        return True
+
+    def update_state(self, session: VQASession, state: Any, nbytes: int) -> None:
+        """保存会话的模型侧缓存，超出总量上限时从最久未使用的会话开始释放"""
+        with self._lock:
+            session.state, session.state_bytes = state, nbytes
+            session.last_used = time.monotonic()
+            if session.session_id in self._sessions:
+                self._sessions.move_to_end(session.session_id)
+            if self.max_state_bytes:
+                for other in list(self._sessions.values()):
+                    if self._state_bytes() <= self.max_state_bytes:
+                        break
+                    if other.state is not None and other is not session:
+                        other.release_state()
+                        self.states_released += 1
+                if self._state_bytes() > self.max_state_bytes:
+                    # 单个会话就超过上限，不保留其缓存
+                    session.release_state()
+                    self.states_released += 1
+
+    def release_states(self) -> None:
+        """释放所有会话的模型侧缓存（如模型被卸载），会话本身保留"""
+        with self._lock:
+            for session in self._sessions.values():
+                if session.state is not None:
+                    session.release_state()
+                    self.states_released += 1
+
+    def _state_bytes(self) -> int:
+        return sum(s.state_bytes for s in self._sessions.values())
+
+    def _purge_expired(self) -> None:
+        if not self.ttl:
+            return
+        deadline = time.monotonic() - self.ttl
+        expired = [sid for sid, s in self._sessions.items() if s.last_used < deadline]
+        for sid in expired:
+            self._sessions.pop(sid).release_state()
+            self.expired += 1
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": len(self._sessions),
+                "state_bytes": self._state_bytes(),
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "states_released": self.states_released,
+            }